@@ -1,21 +1,38 @@
+import argparse
 import logging
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from datetime import timedelta
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import (
     Application,
     CommandHandler,
     CallbackQueryHandler,
     ContextTypes,
     MessageHandler,
+    TypeHandler,
     filters
 )
-from vk_api import VkApi, VkApiError
+from vk_api import VkApiError
 import time
 import json
 import os
-import requests
 import sqlite3
+import tempfile
 import asyncio
+import contextvars
+import math
+import signal
+import socket
+import uuid
+import aiohttp
+from aiohttp import web
+import hashlib
+import hmac
+import html
+import re
+import heapq
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 
 # Укажите токен вашего бота-посредника
 BOT_TOKEN = 'YOUR_BOT_TOKEN'  # Замените на ваш токен
@@ -29,241 +46,2277 @@ logger = logging.getLogger(__name__)
 
 USER_DATA_FILE = 'user_data.json'
 DB_FILE = 'user_data.db'
+DB_BUSY_TIMEOUT_MS = 5000  # ожидание блокировки базы другим процессом
+DB_CACHE_SIZE_KB = 8192  # размер страничного кэша SQLite
+SCHEMA_VERSION = 1  # версия схемы базы (PRAGMA user_version)
+DB_SYNC_INTERVAL = 1.0  # как часто проверять, не изменил ли базу другой процесс (тогда кэш сбрасывается), секунд
 
-class UserConfig:
+# Настройки одного бота и количество ботов на пользователя
+BOT_SETTINGS = ('vk_token', 'vk_group_id', 'tg_bot_token', 'tg_channel')
+LEGACY_BOT_KEYS = BOT_SETTINGS + ('last_post_id',)
+BOT_SLOTS = 3
+
+# Кэш пользователей в памяти
+USER_CACHE_SIZE = 1000  # максимум пользователей в кэше
+
+# Максимальное количество ботов, проверяемых одновременно
+MAX_CONCURRENT_CHECKS = 10
+PROGRESS_EDIT_INTERVAL = 3.0  # как часто обновлять сообщение о ходе ручной проверки, секунд
+
+# Загрузка файлов байтами, если Telegram не смог скачать их по ссылке VK
+MEDIA_UPLOAD_FALLBACK = True  # включить запасной путь отправки файлом
+MEDIA_FETCH_CONCURRENCY = 4  # одновременных загрузок фото из VK
+MEDIA_SPOOL_SIZE = 1024 * 1024  # сколько байт одного файла держать в памяти, остальное во временном файле
+MEDIA_MEMORY_BUDGET = 8 * 1024 * 1024  # сколько байт всех скачанных файлов держать в памяти (на все воркеры), остальное - на диске
+MEDIA_BUFFER_FILES = 20  # сколько скачанных файлов могут одновременно ждать загрузки в Telegram (не меньше MEDIA_GROUP_LIMIT)
+MEDIA_MAX_FILE_SIZE = 10 * 1024 * 1024  # лимит Telegram на фото, байт
+MEDIA_MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # лимит Telegram на остальные файлы, байт
+MEDIA_GROUP_LIMIT = 10  # сколько файлов Telegram принимает в одной медиагруппе, большие альбомы делятся
+
+# Лимиты длины текста Telegram (в символах UTF-16 после разбора HTML)
+TG_MESSAGE_LIMIT = 4096
+TG_CAPTION_LIMIT = 1024
+
+# Выбор размера фото из вариантов, которые отдаёт VK
+PHOTO_SIZE_POLICY = 'target'  # 'max' - самый большой вариант, 'target' - наименьший не меньше PHOTO_TARGET_SIDE
+PHOTO_TARGET_SIDE = 1280  # длинная сторона, px (Telegram всё равно пережимает фото до 1280 или 2560)
+PHOTO_SIZE_POLICY_BY_CHANNEL = {}  # {'@channel': {'policy': 'max'}} или {'@channel': {'target_side': 2560}}
+MEDIA_CHUNK_SIZE = 64 * 1024  # размер блока при скачивании и отправке, байт
+MEDIA_FETCH_TIMEOUT = 30.0  # секунд на скачивание одного файла
+
+# Очередь отправки постов (outbox)
+OUTBOX_WORKERS = 10  # количество параллельных воркеров отправки
+OUTBOX_POLL_INTERVAL = 1.0  # как часто свободный воркер заглядывает в очередь, секунд
+OUTBOX_MAX_ATTEMPTS = 8  # после стольких неудачных попыток пост уходит в dead-letter
+OUTBOX_RETRY_BASE = 10.0  # задержка перед первой повторной попыткой, секунд (дальше удваивается)
+OUTBOX_RETRY_MAX = 3600.0  # максимальная задержка между попытками, секунд
+OUTBOX_CLAIM_TIMEOUT = 300.0  # через сколько секунд зависшая отправка возвращается в очередь
+OUTBOX_RESEND_UNCERTAIN = False  # повторять часть поста, исход отправки которой неизвестен (таймаут, падение процесса): True - возможен дубль, False - возможна потеря части
+
+# Журнал опубликованных постов (защита от повторной публикации)
+LEDGER_RETENTION_DAYS = 30  # сколько дней помнить опубликованные посты
+LEDGER_PURGE_INTERVAL = 3600.0  # как часто удалять устаревшие записи, секунд
+LEDGER_BLOOM_BITS = 2 ** 23  # размер фильтра Блума в битах (1 МБ)
+LEDGER_BLOOM_HASHES = 7  # количество хеш-функций фильтра Блума
+LEDGER_SYNC_SLACK = 60.0  # запас при подгрузке чужих записей журнала (расхождение часов между транзакциями), секунд
+
+# Кэш file_id уже отправленных фото
+MEDIA_CACHE_SIZE = 50000  # сколько file_id хранить, самые давно использованные вытесняются
+MEDIA_CACHE_CROSS_BOT = False  # пробовать file_id, полученный другим ботом (при отказе Telegram отправим по ссылке)
+
+# Адаптивный интервал опроса групп
+SCHEDULER_TICK = 5.0  # как часто планировщик ищет группы, которые пора проверить, секунд
+SOURCES_REFRESH_INTERVAL = 60.0  # как часто перечитывать список ботов из базы, секунд
+POLL_MIN_INTERVAL = 30.0  # минимальный интервал проверки группы, секунд
+POLL_MAX_INTERVAL = 900.0  # максимальный интервал проверки группы, секунд
+POLL_GAP_FRACTION = 0.25  # доля среднего промежутка между постами, через которую проверяем снова
+POLL_BACKOFF = 1.5  # множитель интервала после каждой пустой проверки
+POLL_RATE_SMOOTHING = 0.3  # вес нового промежутка в скользящем среднем
+
+# Опрос в нескольких процессах (python Bot.py --role worker)
+WORKER_SHARDS = 64  # на сколько шардов делятся группы VK; больше, чем воркеров, чтобы их можно было перераспределять
+LEASE_TTL = 30.0  # через сколько секунд без heartbeat шарды воркера считаются свободными
+LEASE_HEARTBEAT_INTERVAL = 10.0  # как часто воркер продлевает аренду шардов, секунд
+
+# Настройки подключения к VK API
+VK_API_URL = 'https://api.vk.com/method'
+VK_API_VERSION = '5.131'
+VK_API_TIMEOUT = 10.0  # секунд на один запрос
+VK_POOL_SIZE = 100  # максимум одновременных соединений с VK
+VK_POLL_COUNT = 10  # постов в обычном запросе стены
+VK_PAGE_SIZE = 100  # постов на страницу при догрузке пропущенных (максимум VK)
+VK_BACKLOG_LIMIT = 300  # сколько пропущенных постов догружать за одну проверку
+VK_BATCH_POLLING = True  # опрашивать группы с общим токеном пачками через метод execute
+VK_EXECUTE_BATCH = 25  # максимум вызовов API внутри одного execute (лимит VK)
+VK_LONG_POLL = True  # получать новые посты через Bots Long Poll API, если токен группы это позволяет
+VK_LONG_POLL_WAIT = 25  # сколько секунд VK держит запрос long poll без событий
+VK_LONG_POLL_RETRY = 3600.0  # через сколько снова пробовать long poll для группы без доступа, секунд
+VK_LONG_POLL_RECONCILE = 900.0  # интервал страховочного wall.get для групп на long poll, секунд
+VK_LONG_POLL_ERROR_DELAY = 5.0  # пауза перед переподключением после сетевой ошибки, секунд
+
+# Настройки подключения к Telegram Bot API
+TELEGRAM_API_URL = 'https://api.telegram.org'
+TG_CONNECT_TIMEOUT = 5.0  # секунд на установку соединения
+TG_READ_TIMEOUT = 30.0  # секунд на ожидание ответа
+TG_POOL_SIZE = 10  # максимум соединений на один токен бота
+
+# Лимиты Telegram на отправку сообщений
+TG_GLOBAL_RATE = 30.0  # сообщений в секунду на один токен бота
+TG_CHAT_RATE = 20 / 60  # сообщений в секунду в один канал (20 в минуту)
+TG_CHAT_BURST = 10  # сообщений подряд в один канал без ожидания
+TG_MAX_RETRIES = 3  # повторов после ответа 429 Too Many Requests
+
+# Проверка настроек, которые вводит пользователь
+VALIDATION_TIMEOUT = 5.0  # секунд на одну проверку; при таймауте настройка сохраняется с предупреждением
+VALIDATION_CACHE_TTL = 600.0  # сколько секунд помнить результат проверки токена, группы или канала
+VALIDATION_CACHE_SIZE = 1000  # максимум результатов в кэше проверок
+
+# Режим webhook для интерфейса бота вместо long polling (python Bot.py --webhook-url ...)
+WEBHOOK_URL = ''  # публичный адрес для Telegram, например https://bot.example.com/telegram; пусто - long polling
+WEBHOOK_LISTEN = '127.0.0.1'  # адрес встроенного HTTP-сервера (обычно за reverse proxy)
+WEBHOOK_PORT = 8080  # порт встроенного HTTP-сервера; у реплик на одной машине - разные
+WEBHOOK_PATH = '/telegram'  # путь, на который reverse proxy передаёт запросы Telegram
+WEBHOOK_SECRET = ''  # секрет из заголовка X-Telegram-Bot-Api-Secret-Token, одинаковый у всех реплик; без него webhook не запускается
+WEBHOOK_SET = True  # регистрировать webhook в Telegram при запуске
+
+# Метрики в формате Prometheus (http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_HOST = '127.0.0.1'  # слушать только локально
+METRICS_PORT = 9108  # 0 - не запускать; воркерам порт задаётся через --metrics-port
+METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # границы гистограмм задержек, секунд
+METRICS_PASS_BUCKETS = (0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)  # границы гистограммы прохода, секунд
+
+class Metric:
+    """Метрика с метками: значения хранятся по кортежу значений меток"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def _format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labels, key)) + list((extra or {}).items())
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{self._escape(value)}"' for name, value in pairs) + '}'
+
+    @staticmethod
+    def _format_value(value: float) -> str:
+        """Значение без потери точности: целые как есть, дробные через repr (как prometheus_client)"""
+        if isinstance(value, int):
+            return str(value)
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if math.isnan(value):
+            return 'NaN'
+        return repr(float(value))
+
+    def samples(self):
+        for key, value in self.values.items():
+            yield self.name, self._format_labels(key), value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines += [f"{name}{labels} {self._format_value(value)}" for name, labels, value in self.samples()]
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        if not labels:
+            self.values[()] = 0
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+    def remove(self, **labels):
+        self.values.pop(self._key(labels), None)
+
+    def clear(self):
+        self.values.clear()
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = METRICS_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                state['buckets'][i] += 1
+        state['sum'] += value
+        state['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер времени блока with"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        for key, state in self.values.items():
+            for bound, count in zip(self.buckets, state['buckets']):
+                yield f"{self.name}_bucket", self._format_labels(key, {'le': f"{bound:g}"}), count
+            yield f"{self.name}_bucket", self._format_labels(key, {'le': '+Inf'}), state['count']
+            yield f"{self.name}_sum", self._format_labels(key), state['sum']
+            yield f"{self.name}_count", self._format_labels(key), state['count']
+
+class MetricsRegistry:
+    """Набор метрик процесса и их вывод в текстовом формате Prometheus"""
     def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (),
+                  buckets: tuple = METRICS_LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def add_collector(self, collector):
+        """collector() вызывается перед каждым выводом, чтобы обновить метрики, которые считаются по запросу"""
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Ошибка сбора метрик: {e}")
+        return '\n'.join(metric.render() for metric in self.metrics) + '\n'
+
+class MetricsServer:
+    """Локальный HTTP-сервер, отдающий метрики на /metrics"""
+    def __init__(self, registry: MetricsRegistry, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8')
+
+    async def start(self):
+        if not self.port or self.runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get('/metrics', self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        try:
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        except OSError as e:
+            logger.error(f"Не удалось запустить сервер метрик на {self.host}:{self.port}: {e}")
+            await self.runner.cleanup()
+            self.runner = None
+            return
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+class WebhookServer:
+    """HTTP-сервер, принимающий обновления Telegram и передающий их в очередь Application.
+    
+    Сервер ничего не хранит: всё состояние интерфейса лежит в базе, поэтому за одним
+    reverse proxy можно запустить несколько реплик с одинаковым WEBHOOK_SECRET.
+    Без секрета любой, кто знает адрес, мог бы присылать поддельные обновления от имени
+    пользователей, поэтому он обязателен.
+    """
+    def __init__(self, application: Application, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                 path: str = WEBHOOK_PATH, secret: str = WEBHOOK_SECRET):
+        if not secret:
+            raise ValueError("Для webhook нужен WEBHOOK_SECRET")
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.path = path
+        self.secret = secret
+        self.runner = None
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        token = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(token, self.secret):
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except Exception as e:
+            logger.warning(f"Некорректное обновление на webhook: {e}")
+            return web.Response(status=400)
+        await self.application.update_queue.put(update)
+        return web.Response()
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.Response(text='ok')
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.router.add_get('/healthz', self.handle_health)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.listen, self.port).start()
+        logger.info(f"Webhook слушает http://{self.listen}:{self.port}{self.path}")
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+metrics = MetricsRegistry()
+VK_REQUEST_SECONDS = metrics.histogram('vk_request_duration_seconds', "Время запроса к VK API", ('method',))
+TG_REQUEST_SECONDS = metrics.histogram(
+    'telegram_request_duration_seconds', "Время запроса к Telegram Bot API (без ожидания лимитов отправки)", ('method',)
+)
+PASS_SECONDS = metrics.histogram(
+    'poll_pass_duration_seconds', "Длительность прохода планировщика", buckets=METRICS_PASS_BUCKETS
+)
+POLL_OVERDUE_SECONDS = metrics.gauge(
+    'poll_overdue_seconds', "Насколько самая просроченная группа опоздала к началу последнего прохода"
+)
+POSTS_FETCHED = metrics.counter('posts_fetched_total', "Новых постов получено из VK")
+POSTS_SENT = metrics.counter('posts_sent_total', "Постов опубликовано в Telegram")
+POSTS_RETRIED = metrics.counter('posts_retried_total', "Неудачных отправок, поставленных на повтор")
+POSTS_FAILED = metrics.counter('posts_failed_total', "Постов, перемещённых в dead-letter")
+SOURCE_LAG_SECONDS = metrics.gauge(
+    'source_lag_seconds', "Возраст самого старого неотправленного поста бота по дате в VK (0, если очередь пуста)",
+    ('user_id', 'slot')
+)
+SOURCE_VK_FAILED = metrics.gauge(
+    'source_vk_access_failed', "Бот, собственный токен VK которого не читает его группу", ('user_id', 'slot')
+)
+OUTBOX_ROWS = metrics.gauge('outbox_rows', "Записей в очереди отправки по статусам", ('status',))
+
+class UserConfig:
+    def __init__(self, cache_size: int = USER_CACHE_SIZE):
+        self.conn = self.connect()
         self.init_db()
+        
+        # LRU cache of user records: user_id -> {'data': dict, 'bots': list}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_hits = 0
+        self.cache_misses = 0
+        
+        # Changes committed by other processes (UI, workers) are detected through PRAGMA data_version
+        self.data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        self.synced_at = time.monotonic()
+
+    def connect(self) -> sqlite3.Connection:
+        """Open a long-lived database connection with WAL mode and tuned pragmas"""
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, cached_statements=128)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        return conn
+
+    def close(self):
+        """Close the database connection"""
+        self.conn.close()
 
     def init_db(self):
-        """Initialize the database and create tables if they don't exist"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        # Create users table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                data TEXT
-            )
-        ''')
+        """Initialize the database, create tables and migrate old data"""
+        with self.conn:
+            # Per-user settings that are not tied to a bot (awaiting_input etc.)
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS users (
+                    user_id INTEGER PRIMARY KEY,
+                    data TEXT
+                )
+            ''')
+            
+            # Bot configurations, one row per slot
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS bots (
+                    user_id INTEGER NOT NULL,
+                    slot INTEGER NOT NULL,
+                    vk_token TEXT,
+                    vk_group_id TEXT,
+                    tg_bot_token TEXT,
+                    tg_channel TEXT,
+                    PRIMARY KEY (user_id, slot)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_bots_vk_group_id ON bots (vk_group_id)')
+            
+            # Last forwarded post per slot, kept apart so cursor updates touch one narrow row
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS cursors (
+                    user_id INTEGER NOT NULL,
+                    slot INTEGER NOT NULL,
+                    last_post_id INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (user_id, slot)
+                ) WITHOUT ROWID
+            ''')
+        
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            self.migrate_json_data()
+
+    def migrate_json_data(self):
+        """One-shot migration of bots from the users.data JSON blob into the bots/cursors tables"""
+        rows = self.conn.execute('SELECT user_id, data FROM users').fetchall()
+        migrated = 0
+        
+        with self.conn:
+            for user_id, data in rows:
+                user_data = json.loads(data) if data else {}
+                bots = user_data.pop('bots', [])
+                
+                # Legacy single-bot format kept the settings at the top level
+                legacy_bot = {key: user_data.pop(key) for key in LEGACY_BOT_KEYS if key in user_data}
+                if not any(bots) and legacy_bot:
+                    bots = [legacy_bot]
+                
+                for slot, bot_data in enumerate(bots):
+                    if bot_data:
+                        self._write_bot(user_id, slot, bot_data)
+                        migrated += 1
+                
+                self.conn.execute(
+                    'UPDATE users SET data = ? WHERE user_id = ?',
+                    (json.dumps(user_data), user_id)
+                )
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         
-        conn.commit()
-        conn.close()
+        if migrated:
+            logger.info(f"Перенесено ботов в новую схему базы: {migrated}")
+
+    def _write_bot(self, user_id: int, slot: int, bot_data: dict):
+        """Write a bot row and its cursor (must be called inside a transaction)"""
+        self.conn.execute(
+            '''
+            INSERT OR REPLACE INTO bots (user_id, slot, vk_token, vk_group_id, tg_bot_token, tg_channel)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''',
+            (user_id, slot, *(bot_data.get(key) for key in BOT_SETTINGS))
+        )
+        if 'last_post_id' in bot_data:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO cursors (user_id, slot, last_post_id) VALUES (?, ?, ?)',
+                (user_id, slot, bot_data['last_post_id'])
+            )
+
+    @staticmethod
+    def _bot_from_row(row: tuple) -> dict:
+        """Build a bot dict from (vk_token, vk_group_id, tg_bot_token, tg_channel, last_post_id)"""
+        bot = {key: value for key, value in zip(BOT_SETTINGS, row) if value is not None}
+        if row[4] is not None:
+            bot['last_post_id'] = row[4]
+        return bot
+
+    def sync(self) -> bool:
+        """Drop the cache if another process has committed to the database; returns True if it had"""
+        self.synced_at = time.monotonic()
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.data_version:
+            return False
+        self.data_version = version
+        self.cache.clear()
+        return True
+
+    def _load_user(self, user_id: int) -> dict:
+        """Get the cached user record, loading it from the database on a miss"""
+        if time.monotonic() - self.synced_at >= DB_SYNC_INTERVAL:
+            self.sync()
+        record = self.cache.get(user_id)
+        if record is not None:
+            self.cache.move_to_end(user_id)
+            self.cache_hits += 1
+            return record
+        
+        self.cache_misses += 1
+        result = self.conn.execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        rows = self.conn.execute(
+            '''
+            SELECT b.slot, b.vk_token, b.vk_group_id, b.tg_bot_token, b.tg_channel, c.last_post_id
+            FROM bots b LEFT JOIN cursors c ON c.user_id = b.user_id AND c.slot = b.slot
+            WHERE b.user_id = ?
+            ORDER BY b.slot
+            ''',
+            (user_id,)
+        ).fetchall()
+        
+        bots = [{} for _ in range(max([BOT_SLOTS] + [row[0] + 1 for row in rows]))]
+        for row in rows:
+            bots[row[0]] = self._bot_from_row(row[1:])
+        
+        record = {
+            'data': json.loads(result[0]) if result and result[0] else {},
+            'bots': bots
+        }
+        if self.cache_size > 0:
+            self.cache[user_id] = record
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return record
+
+    def _cached_bot(self, user_id: int, slot: int):
+        """Get the cached bot dict for a slot without touching the database (or None)"""
+        record = self.cache.get(user_id)
+        if record is None:
+            return None
+        bots = record['bots']
+        while len(bots) <= slot:
+            bots.append({})
+        return bots[slot]
+
+    def cache_stats(self) -> dict:
+        """Cache hit/miss counters"""
+        return {
+            'size': len(self.cache),
+            'hits': self.cache_hits,
+            'misses': self.cache_misses
+        }
 
     def get_user_data(self, user_id: int) -> dict:
         """Get user data from database"""
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        return dict(self._load_user(user_id)['data'])
+
+    def update_user_data(self, user_id: int, key: str, value):
+        """Update user data in database"""
+        user_data = self.get_user_data(user_id)
+        user_data[key] = value
+        with self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)',
+                (user_id, json.dumps(user_data))
+            )
+        if user_id in self.cache:
+            self.cache[user_id]['data'] = user_data
+
+    def get_bots(self, user_id: int) -> list:
+        """Get all bot configurations for a user (empty dict for an unused slot)"""
+        return [dict(bot) for bot in self._load_user(user_id)['bots']]
+
+    def get_bot(self, user_id: int, bot_index: int) -> dict:
+        """Get specific bot configuration by index (0-2)"""
+        bots = self._load_user(user_id)['bots']
+        if 0 <= bot_index < len(bots):
+            return dict(bots[bot_index])
+        return {}
+
+    def get_active_bots(self) -> list:
+        """Get (user_id, slot, bot) for every fully configured bot"""
+        rows = self.conn.execute(
+            '''
+            SELECT b.user_id, b.slot, b.vk_token, b.vk_group_id, b.tg_bot_token, b.tg_channel, c.last_post_id
+            FROM bots b LEFT JOIN cursors c ON c.user_id = b.user_id AND c.slot = b.slot
+            WHERE b.vk_token IS NOT NULL AND b.vk_group_id IS NOT NULL
+              AND b.tg_bot_token IS NOT NULL AND b.tg_channel IS NOT NULL
+            ORDER BY b.user_id, b.slot
+            '''
+        ).fetchall()
+        
+        return [(row[0], row[1], self._bot_from_row(row[2:])) for row in rows]
+
+    def update_bot(self, user_id: int, bot_index: int, bot_data: dict):
+        """Update specific bot configuration"""
+        if not bot_data:
+            self.delete_bot(user_id, bot_index)
+            return
+        with self.conn:
+            self._write_bot(user_id, bot_index, bot_data)
+        
+        cached = self._cached_bot(user_id, bot_index)
+        if cached is not None:
+            last_post_id = cached.get('last_post_id')
+            cached.clear()
+            cached.update({key: value for key, value in bot_data.items() if value is not None})
+            if 'last_post_id' not in cached and last_post_id is not None:
+                cached['last_post_id'] = last_post_id
+
+    def update_bot_setting(self, user_id: int, bot_index: int, key: str, value: str):
+        """Update a single setting of a bot, creating the slot if needed"""
+        if key not in BOT_SETTINGS:
+            raise ValueError(f"Unknown bot setting: {key}")
+        with self.conn:
+            self.conn.execute(
+                f'''
+                INSERT INTO bots (user_id, slot, {key}) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, slot) DO UPDATE SET {key} = excluded.{key}
+                ''',
+                (user_id, bot_index, value)
+            )
+        
+        cached = self._cached_bot(user_id, bot_index)
+        if cached is not None:
+            cached[key] = value
+
+    def delete_bot(self, user_id: int, bot_index: int):
+        """Delete specific bot configuration"""
+        with self.conn:
+            self.conn.execute('DELETE FROM bots WHERE user_id = ? AND slot = ?', (user_id, bot_index))
+            self.conn.execute('DELETE FROM cursors WHERE user_id = ? AND slot = ?', (user_id, bot_index))
+        
+        cached = self._cached_bot(user_id, bot_index)
+        if cached is not None:
+            cached.clear()
+
+    def get_last_post_id(self, user_id: int, bot_index: int = 0) -> int:
+        """Get last post ID for specific bot"""
+        result = self.conn.execute(
+            'SELECT last_post_id FROM cursors WHERE user_id = ? AND slot = ?',
+            (user_id, bot_index)
+        ).fetchone()
+        return result[0] if result else 0
+
+    def set_last_post_id(self, user_id: int, bot_index: int, post_id: int):
+        """Set last post ID for specific bot (written through; unlike commit_cursor it can move back)"""
+        with self.conn:
+            self.conn.execute(
+                '''
+                INSERT INTO cursors (user_id, slot, last_post_id) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, slot) DO UPDATE SET last_post_id = excluded.last_post_id
+                ''',
+                (user_id, bot_index, post_id)
+            )
         
-        cursor.execute('SELECT data FROM users WHERE user_id = ?', (user_id,))
-        result = cursor.fetchone()
+        cached = self._cached_bot(user_id, bot_index)
+        if cached:
+            cached['last_post_id'] = post_id
+
+    def commit_cursor(self, user_id: int, bot_index: int, post_id: int, in_transaction=None):
+        """Write a cursor immediately, optionally with other statements in the same transaction.
+        
+        in_transaction(conn) is called inside the transaction before the cursor is written.
+        The cursor only moves forward, so a process that read an older cursor cannot roll it back.
+        """
+        with self.conn:
+            if in_transaction is not None:
+                in_transaction(self.conn)
+            self.conn.execute(
+                '''
+                INSERT INTO cursors (user_id, slot, last_post_id) VALUES (?, ?, ?)
+                ON CONFLICT (user_id, slot) DO UPDATE SET last_post_id = MAX(last_post_id, excluded.last_post_id)
+                ''',
+                (user_id, bot_index, post_id)
+            )
+        
+        cached = self._cached_bot(user_id, bot_index)
+        if cached:
+            cached['last_post_id'] = max(cached.get('last_post_id') or 0, post_id)
+
+class Outbox:
+    """Durable SQLite queue of posts waiting to be delivered to Telegram.
+    
+    Posts are stored together with the new cursor in one transaction, so a post is
+    never lost between VK and Telegram. Rows of one channel are delivered strictly
+    in order: only the oldest undelivered row of a channel can be claimed.
+    """
+    def __init__(self, user_config: UserConfig):
+        self.user_config = user_config
+        self.conn = user_config.conn
+        self.init_db()
+
+    def init_db(self):
+        """Create the outbox table"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    slot INTEGER NOT NULL,
+                    channel TEXT NOT NULL,
+                    post_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    claimed_at REAL,
+                    last_error TEXT,
+                    created_at REAL NOT NULL,
+                    UNIQUE (user_id, slot, post_id)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_channel ON outbox (channel, id)
+                WHERE status IN ('pending', 'sending')
+            ''')
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)
+            ''')
+
+    def enqueue(self, user_id: int, bot_index: int, channel: str, posts: list, last_post_id: int) -> int:
+        """Queue posts for delivery and advance the cursor in the same transaction"""
+        now = time.time()
+        rows = [
+            (user_id, bot_index, str(channel), post['id'], json.dumps(post, ensure_ascii=False), now)
+            for post in posts
+        ]
         
-        conn.close()
+        def insert_rows(conn):
+            conn.executemany(
+                '''
+                INSERT OR IGNORE INTO outbox (user_id, slot, channel, post_id, payload, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ''',
+                rows
+            )
         
-        if result:
-            return json.loads(result[0])
-        return {}
+        self.user_config.commit_cursor(user_id, bot_index, last_post_id, insert_rows)
+        return len(rows)
+
+    def claim(self, user_id: int = None, bot_index: int = None):
+        """Claim the next deliverable row (optionally only for one bot), or None"""
+        now = time.time()
+        query = '''
+            SELECT o.id, o.user_id, o.slot, o.channel, o.post_id, o.payload, o.attempts
+            FROM outbox o
+            WHERE o.status = 'pending' AND o.next_attempt_at <= ?
+              AND NOT EXISTS (
+                  SELECT 1 FROM outbox p
+                  WHERE p.channel = o.channel AND p.id < o.id AND p.status IN ('pending', 'sending')
+              )
+        '''
+        params = [now]
+        if user_id is not None:
+            query += ' AND o.user_id = ? AND o.slot = ?'
+            params += [user_id, bot_index]
+        query += ' ORDER BY o.id LIMIT 10'
+        
+        for row in self.conn.execute(query, params).fetchall():
+            # Another worker (or process) may have claimed the row in the meantime
+            with self.conn:
+                claimed = self.conn.execute(
+                    "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ? AND status = 'pending'",
+                    (now, row[0])
+                ).rowcount
+            if claimed:
+                return {
+                    'id': row[0],
+                    'user_id': row[1],
+                    'slot': row[2],
+                    'channel': row[3],
+                    'post_id': row[4],
+                    'post': json.loads(row[5]),
+                    'attempts': row[6]
+                }
+        return None
+
+    def mark_delivered(self, row_id: int):
+        """Remove a delivered row"""
+        with self.conn:
+            self.conn.execute('DELETE FROM outbox WHERE id = ?', (row_id,))
+
+    def mark_failed(self, row: dict, error: str, permanent: bool = False) -> bool:
+        """Schedule a retry with exponential backoff; returns True if the row went to dead-letter"""
+        attempts = row['attempts'] + 1
+        dead = permanent or attempts >= OUTBOX_MAX_ATTEMPTS
+        delay = min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+        with self.conn:
+            self.conn.execute(
+                '''
+                UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_at = NULL
+                WHERE id = ?
+                ''',
+                ('dead' if dead else 'pending', attempts, time.time() + delay, error[:1000], row['id'])
+            )
+        return dead
+
+    def release(self, row_id: int):
+        """Return a claimed row to the queue without counting an attempt"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE outbox SET status = 'pending', claimed_at = NULL WHERE id = ? AND status = 'sending'",
+                (row_id,)
+            )
+
+    def requeue_stale(self) -> int:
+        """Return rows stuck in 'sending' (worker crashed mid-delivery) to the queue"""
+        with self.conn:
+            return self.conn.execute(
+                "UPDATE outbox SET status = 'pending', claimed_at = NULL WHERE status = 'sending' AND claimed_at < ?",
+                (time.time() - OUTBOX_CLAIM_TIMEOUT,)
+            ).rowcount
+
+    def status_counts(self) -> dict:
+        """Number of rows per status"""
+        counts = {'pending': 0, 'sending': 0, 'dead': 0}
+        counts.update(self.conn.execute('SELECT status, COUNT(*) FROM outbox GROUP BY status').fetchall())
+        return counts
+
+    def oldest_pending(self) -> dict:
+        """(user_id, slot) -> VK date of the oldest undelivered post (queue time if the post has no date)"""
+        rows = self.conn.execute(
+            '''
+            SELECT user_id, slot, MIN(COALESCE(json_extract(payload, '$.date'), created_at))
+            FROM outbox WHERE status IN ('pending', 'sending')
+            GROUP BY user_id, slot
+            '''
+        ).fetchall()
+        return {(user_id, slot): oldest for user_id, slot, oldest in rows}
+
+    def pending_count(self, user_id: int, bot_index: int) -> int:
+        """Number of undelivered rows for a bot"""
+        return self.conn.execute(
+            "SELECT COUNT(*) FROM outbox WHERE user_id = ? AND slot = ? AND status IN ('pending', 'sending')",
+            (user_id, bot_index)
+        ).fetchone()[0]
+
+class BloomFilter:
+    """Bloom filter over string keys: no false negatives, rare false positives"""
+    def __init__(self, bits: int = LEDGER_BLOOM_BITS, hashes: int = LEDGER_BLOOM_HASHES):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits // 8 + 1)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class DeliveryLedger:
+    """Index of posts already published, keyed by (channel, owner_id, post_id).
+    
+    A Bloom filter in memory answers "definitely not published" without touching the
+    database; only possible hits are confirmed with a primary key lookup.
+    
+    A post can take several Telegram messages (albums, text chunks, polls). Until the
+    last one is sent, the number of parts already sent is kept in delivery_progress,
+    so a retry resumes from the failed part instead of repeating the whole post.
+    
+    Before each part is sent it is marked as 'sending'. The mark is cleared when Telegram
+    answers, so a mark left behind means the outcome is unknown: the process crashed or
+    the request timed out after the part may have been published.
+    """
+    def __init__(self, user_config: UserConfig):
+        self.conn = user_config.conn
+        self.init_db()
+        # Own data_version mark: UserConfig.sync() on the same connection must not hide other processes' records
+        self.data_version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        self.loaded_until = time.time()
+        self.bloom = self._build_bloom()
+
+    def init_db(self):
+        """Create the delivered posts table"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS delivered (
+                    channel TEXT NOT NULL,
+                    owner_id INTEGER NOT NULL,
+                    post_id INTEGER NOT NULL,
+                    message_id INTEGER,
+                    delivered_at REAL NOT NULL,
+                    PRIMARY KEY (channel, owner_id, post_id)
+                ) WITHOUT ROWID
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_delivered_at ON delivered (delivered_at)')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS delivery_progress (
+                    channel TEXT NOT NULL,
+                    owner_id INTEGER NOT NULL,
+                    post_id INTEGER NOT NULL,
+                    parts_sent INTEGER NOT NULL,
+                    sending INTEGER,
+                    message_id INTEGER,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (channel, owner_id, post_id)
+                ) WITHOUT ROWID
+            ''')
+
+    @staticmethod
+    def _key(channel: str, owner_id: int, post_id: int) -> str:
+        return f"{channel}|{owner_id}|{post_id}"
+
+    def _build_bloom(self) -> BloomFilter:
+        bloom = BloomFilter()
+        for row in self.conn.execute('SELECT channel, owner_id, post_id FROM delivered'):
+            bloom.add(self._key(*row))
+        return bloom
+
+    def refresh(self) -> int:
+        """Add entries recorded by other processes to the Bloom filter"""
+        now = time.time()
+        rows = self.conn.execute(
+            'SELECT channel, owner_id, post_id FROM delivered WHERE delivered_at > ?',
+            (self.loaded_until - LEDGER_SYNC_SLACK,)
+        ).fetchall()
+        for row in rows:
+            self.bloom.add(self._key(*row))
+        self.loaded_until = now
+        return len(rows)
+
+    def sync(self) -> bool:
+        """Pick up entries if another process has committed to the database; returns True if it had"""
+        version = self.conn.execute('PRAGMA data_version').fetchone()[0]
+        if version == self.data_version:
+            return False
+        self.data_version = version
+        self.refresh()
+        return True
+
+    def is_delivered(self, channel: str, owner_id: int, post_id: int) -> bool:
+        """Check whether the post was already published to the channel (including by other processes)"""
+        self.sync()
+        if self._key(str(channel), owner_id, post_id) not in self.bloom:
+            return False
+        return self.conn.execute(
+            'SELECT 1 FROM delivered WHERE channel = ? AND owner_id = ? AND post_id = ?',
+            (str(channel), owner_id, post_id)
+        ).fetchone() is not None
+
+    def progress(self, channel: str, owner_id: int, post_id: int) -> dict:
+        """Parts of a partly published post: {'parts_sent', 'sending', 'message_id'}.
+        
+        sending is the index of a part whose outcome is unknown, or None.
+        """
+        row = self.conn.execute(
+            '''
+            SELECT parts_sent, sending, message_id FROM delivery_progress
+            WHERE channel = ? AND owner_id = ? AND post_id = ?
+            ''',
+            (str(channel), owner_id, post_id)
+        ).fetchone()
+        if row is None:
+            return {'parts_sent': 0, 'sending': None, 'message_id': None}
+        return {'parts_sent': row[0], 'sending': row[1], 'message_id': row[2]}
+
+    def part_sending(self, channel: str, owner_id: int, post_id: int, index: int):
+        """Mark a part as being sent, right before the HTTP request goes to Telegram"""
+        with self.conn:
+            self.conn.execute(
+                '''
+                INSERT INTO delivery_progress (channel, owner_id, post_id, parts_sent, sending, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (channel, owner_id, post_id) DO UPDATE SET
+                    sending = excluded.sending,
+                    updated_at = excluded.updated_at
+                ''',
+                (str(channel), owner_id, post_id, index, index, time.time())
+            )
+
+    def part_failed(self, channel: str, owner_id: int, post_id: int):
+        """Clear the sending mark: Telegram rejected the part or the request was never sent"""
+        with self.conn:
+            self.conn.execute(
+                'UPDATE delivery_progress SET sending = NULL WHERE channel = ? AND owner_id = ? AND post_id = ?',
+                (str(channel), owner_id, post_id)
+            )
+
+    def part_sent(self, channel: str, owner_id: int, post_id: int, index: int, message_id: int = None):
+        """Remember that parts up to index are published (message_id of the first part is kept)"""
+        with self.conn:
+            self.conn.execute(
+                '''
+                INSERT INTO delivery_progress (channel, owner_id, post_id, parts_sent, message_id, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (channel, owner_id, post_id) DO UPDATE SET
+                    parts_sent = excluded.parts_sent,
+                    sending = NULL,
+                    message_id = COALESCE(delivery_progress.message_id, excluded.message_id),
+                    updated_at = excluded.updated_at
+                ''',
+                (str(channel), owner_id, post_id, index + 1, message_id, time.time())
+            )
+
+    def record(self, channel: str, owner_id: int, post_id: int, message_id: int = None):
+        """Remember a published post and its Telegram message_id"""
+        with self.conn:
+            self.conn.execute(
+                '''
+                INSERT OR REPLACE INTO delivered (channel, owner_id, post_id, message_id, delivered_at)
+                VALUES (?, ?, ?, ?, ?)
+                ''',
+                (str(channel), owner_id, post_id, message_id, time.time())
+            )
+            self.conn.execute(
+                'DELETE FROM delivery_progress WHERE channel = ? AND owner_id = ? AND post_id = ?',
+                (str(channel), owner_id, post_id)
+            )
+        self.bloom.add(self._key(str(channel), owner_id, post_id))
+
+    def purge(self, retention_days: float = LEDGER_RETENTION_DAYS) -> int:
+        """Delete entries older than the retention window and rebuild the Bloom filter"""
+        with self.conn:
+            deleted = self.conn.execute(
+                'DELETE FROM delivered WHERE delivered_at < ?',
+                (time.time() - retention_days * 86400,)
+            ).rowcount
+            # Progress of posts that were never finished (dead-letter, deleted bots)
+            self.conn.execute(
+                'DELETE FROM delivery_progress WHERE updated_at < ?',
+                (time.time() - retention_days * 86400,)
+            )
+        if deleted:
+            self.bloom = self._build_bloom()
+        return deleted
+
+class MediaCache:
+    """LRU cache of Telegram file_id for VK photos, keyed by (media_key, bot_id).
+    
+    A file_id is only guaranteed to work for the bot that received it, so entries are
+    stored per bot; get() can optionally return another bot's file_id as a best effort.
+    """
+    def __init__(self, user_config: UserConfig, max_size: int = MEDIA_CACHE_SIZE):
+        self.conn = user_config.conn
+        self.max_size = max_size
+        self.init_db()
+        self.size = self.conn.execute('SELECT COUNT(*) FROM media_cache').fetchone()[0]
+
+    def init_db(self):
+        """Create the media cache table"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS media_cache (
+                    media_key TEXT NOT NULL,
+                    bot_id TEXT NOT NULL,
+                    file_id TEXT NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (media_key, bot_id)
+                ) WITHOUT ROWID
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_media_cache_used_at ON media_cache (used_at)')
+
+    @staticmethod
+    def bot_id(bot_token: str) -> str:
+        """Bot id is the part of the token before the colon"""
+        return bot_token.split(':', 1)[0]
+
+    def get(self, media_key: str, bot_id: str, cross_bot: bool = MEDIA_CACHE_CROSS_BOT):
+        """Return (file_id, owned) for the photo or None; owned is False for another bot's file_id"""
+        row = self.conn.execute(
+            'SELECT file_id FROM media_cache WHERE media_key = ? AND bot_id = ?',
+            (media_key, bot_id)
+        ).fetchone()
+        if row is not None:
+            with self.conn:
+                self.conn.execute(
+                    'UPDATE media_cache SET used_at = ? WHERE media_key = ? AND bot_id = ?',
+                    (time.time(), media_key, bot_id)
+                )
+            return row[0], True
+        if cross_bot:
+            row = self.conn.execute(
+                'SELECT file_id FROM media_cache WHERE media_key = ? ORDER BY used_at DESC LIMIT 1',
+                (media_key,)
+            ).fetchone()
+            if row is not None:
+                return row[0], False
+        return None
+
+    def put(self, media_key: str, bot_id: str, file_id: str):
+        """Remember the file_id and evict the least recently used entries over the limit"""
+        with self.conn:
+            exists = self.conn.execute(
+                'SELECT 1 FROM media_cache WHERE media_key = ? AND bot_id = ?',
+                (media_key, bot_id)
+            ).fetchone() is not None
+            self.conn.execute(
+                '''
+                INSERT INTO media_cache (media_key, bot_id, file_id, used_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT (media_key, bot_id) DO UPDATE SET file_id = excluded.file_id, used_at = excluded.used_at
+                ''',
+                (media_key, bot_id, file_id, time.time())
+            )
+            if not exists:
+                self.size += 1
+            if self.size > self.max_size:
+                self.size -= self.conn.execute(
+                    '''
+                    DELETE FROM media_cache WHERE (media_key, bot_id) IN (
+                        SELECT media_key, bot_id FROM media_cache ORDER BY used_at LIMIT ?
+                    )
+                    ''',
+                    (self.size - self.max_size,)
+                ).rowcount
+
+    def forget(self, media_key: str, bot_id: str):
+        """Drop a file_id Telegram refused to accept"""
+        with self.conn:
+            self.size -= self.conn.execute(
+                'DELETE FROM media_cache WHERE media_key = ? AND bot_id = ?',
+                (media_key, bot_id)
+            ).rowcount
+
+class ShardLeases:
+    """Distribution of polling shards between worker processes through the database.
+    
+    VK groups are hashed into WORKER_SHARDS shards, so every subscriber of a group lands
+    in the same shard and the wall is still fetched once. Each worker renews a heartbeat
+    in `workers` and holds shards through `leases` rows that expire after LEASE_TTL. On
+    every heartbeat it takes free or expired shards up to its fair share (shards divided
+    by live workers, rounded up) and gives back the rest, so shards move when workers
+    join or leave.
+    """
+    def __init__(self, user_config: UserConfig, worker_id: str, shards: int = WORKER_SHARDS, ttl: float = LEASE_TTL):
+        self.conn = user_config.conn
+        self.worker_id = worker_id
+        self.shards = shards
+        self.ttl = ttl
+        self.init_db()
+
+    def init_db(self):
+        """Create the lease tables"""
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS workers (
+                    worker_id TEXT PRIMARY KEY,
+                    heartbeat_at REAL NOT NULL
+                ) WITHOUT ROWID
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS leases (
+                    shard INTEGER PRIMARY KEY,
+                    owner TEXT,
+                    expires_at REAL NOT NULL DEFAULT 0
+                )
+            ''')
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO leases (shard) VALUES (?)',
+                [(shard,) for shard in range(self.shards)]
+            )
+
+    @staticmethod
+    def shard_of(group_id: str, shards: int = WORKER_SHARDS) -> int:
+        """Shard of a VK group (stable across processes, unlike hash())"""
+        digest = hashlib.blake2b(str(group_id).encode(), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') % shards
+
+    def heartbeat(self) -> set:
+        """Renew the worker and its leases, rebalance, and return the shards it now owns"""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self.conn:
+            self.conn.execute(
+                '''
+                INSERT INTO workers (worker_id, heartbeat_at) VALUES (?, ?)
+                ON CONFLICT (worker_id) DO UPDATE SET heartbeat_at = excluded.heartbeat_at
+                ''',
+                (self.worker_id, now)
+            )
+            self.conn.execute('DELETE FROM workers WHERE heartbeat_at < ?', (now - self.ttl,))
+            live_workers = self.conn.execute('SELECT COUNT(*) FROM workers').fetchone()[0]
+            share = math.ceil(self.shards / max(live_workers, 1))
+            
+            self.conn.execute(
+                'UPDATE leases SET expires_at = ? WHERE owner = ? AND shard < ?',
+                (expires_at, self.worker_id, self.shards)
+            )
+            owned = [row[0] for row in self.conn.execute(
+                'SELECT shard FROM leases WHERE owner = ? AND shard < ? ORDER BY shard',
+                (self.worker_id, self.shards)
+            )]
+            
+            if len(owned) > share:
+                self.conn.executemany(
+                    'UPDATE leases SET owner = NULL, expires_at = 0 WHERE shard = ? AND owner = ?',
+                    [(shard, self.worker_id) for shard in owned[share:]]
+                )
+                owned = owned[:share]
+            elif len(owned) < share:
+                free = [row[0] for row in self.conn.execute(
+                    '''
+                    SELECT shard FROM leases
+                    WHERE (owner IS NULL OR expires_at < ?) AND shard < ?
+                    ORDER BY shard LIMIT ?
+                    ''',
+                    (now, self.shards, share - len(owned))
+                )]
+                for shard in free:
+                    # Conditional update: another worker may have taken the shard in the meantime
+                    taken = self.conn.execute(
+                        '''
+                        UPDATE leases SET owner = ?, expires_at = ?
+                        WHERE shard = ? AND (owner IS NULL OR expires_at < ?)
+                        ''',
+                        (self.worker_id, expires_at, shard, now)
+                    ).rowcount
+                    if taken:
+                        owned.append(shard)
+        return set(owned)
+
+    def release(self):
+        """Give back all shards on shutdown so other workers pick them up without waiting for the TTL"""
+        with self.conn:
+            self.conn.execute('UPDATE leases SET owner = NULL, expires_at = 0 WHERE owner = ?', (self.worker_id,))
+            self.conn.execute('DELETE FROM workers WHERE worker_id = ?', (self.worker_id,))
+
+class TelegramApiError(Exception):
+    """Ошибка, которую вернул Telegram Bot API"""
+    def __init__(self, method: str, result: dict):
+        self.method = method
+        self.error_code = result.get('error_code')
+        self.description = result.get('description', '')
+        super().__init__(f"{method}: [{self.error_code}] {self.description}")
+
+    @property
+    def permanent(self) -> bool:
+        """Повтор не поможет: неверный запрос, токен или нет прав в канале"""
+        return self.error_code in (400, 401, 403)
+
+    @property
+    def url_fetch_failed(self) -> bool:
+        """Telegram не смог скачать файл по переданной ссылке"""
+        description = self.description.lower()
+        return any(marker in description for marker in (
+            'failed to get http url content',
+            'wrong file identifier/http url specified',
+            'wrong type of the web page content',
+            'webpage_curl_failed',
+            'webpage_media_empty'
+        ))
+
+class MediaFetchError(Exception):
+    """Не удалось скачать файл из VK для загрузки в Telegram (в Telegram ничего не отправлено)"""
+    def __init__(self, url: str, error: Exception):
+        self.url = url
+        super().__init__(f"{url}: {error}")
+
+class VKMethodError(VkApiError):
+    """Ошибка, которую вернул метод VK API"""
+    def __init__(self, method: str, error: dict):
+        self.method = method
+        self.code = error.get('error_code')
+        self.error = error
+        super().__init__(f"[{self.code}] {error.get('error_msg')}")
+
+    @property
+    def permanent(self) -> bool:
+        """Отказ в авторизации или доступе, неверный параметр: повтор с тем же токеном не поможет.
+        
+        Лимиты (6, 9) и внутренние ошибки VK (10) временные.
+        """
+        return self.code in (5, 15, 27) or 100 <= (self.code or 0) < 200
+
+class VKApiClient:
+    """Асинхронный клиент VK API с общим пулом keep-alive соединений.
+    
+    Запросы long poll висят по VK_LONG_POLL_WAIT секунд, поэтому идут через отдельную
+    сессию и не занимают соединения пула, через который работает опрос wall.get.
+    """
+    def __init__(self, api_url: str = VK_API_URL, timeout: float = VK_API_TIMEOUT, pool_size: int = VK_POOL_SIZE):
+        self.api_url = api_url
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.pool_size = pool_size
+        self.session = None
+        self.long_poll_session = None
+
+    async def start(self):
+        """Создание сессии (вызывается при старте приложения или при первом запросе)"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+
+    async def close(self):
+        for session in (self.session, self.long_poll_session):
+            if session is not None and not session.closed:
+                await session.close()
+        self.session = None
+        self.long_poll_session = None
+
+    async def method(self, method: str, token: str, **params) -> dict:
+        """Вызов метода VK API. При ошибке VK выбрасывает VKMethodError"""
+        await self.start()
+        params.setdefault('v', VK_API_VERSION)
+        params['access_token'] = token
+        data = {key: str(value) for key, value in params.items()}
+        
+        with VK_REQUEST_SECONDS.time(method=method):
+            async with self.session.post(f"{self.api_url}/{method}", data=data) as response:
+                result = await response.json(content_type=None)
+        
+        if 'error' in result:
+            raise VKMethodError(method, result['error'])
+        return result['response']
+
+    async def long_poll(self, server: dict, ts: str, wait: int = VK_LONG_POLL_WAIT) -> dict:
+        """Один запрос к серверу Bots Long Poll (server - ответ groups.getLongPollServer)"""
+        if self.long_poll_session is None or self.long_poll_session.closed:
+            # Без ограничения: каждая группа на long poll держит ровно одно соединение
+            connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=300)
+            self.long_poll_session = aiohttp.ClientSession(connector=connector)
+        params = {'act': 'a_check', 'key': server['key'], 'ts': ts, 'wait': wait}
+        timeout = aiohttp.ClientTimeout(total=wait + VK_API_TIMEOUT)
+        async with self.long_poll_session.get(server['server'], params=params, timeout=timeout) as response:
+            return await response.json(content_type=None)
+
+class VKLongPoll:
+    """Получение новых постов группы через Bots Long Poll API.
+    
+    Работает с токеном сообщества, у которого включён Long Poll с событием wall_post_new.
+    on_posts(posts) получает новые посты; on_posts(None) означает, что события могли
+    потеряться и стену нужно перечитать. Как и при опросе (wall.get с filter=owner),
+    пересылаются только посты самого сообщества: предложенные записи и посты
+    пользователей на открытой стене пропускаются.
+    """
+    def __init__(self, client: VKApiClient, token: str, group_id: str, on_posts):
+        self.client = client
+        self.token = token
+        self.group_id = group_id
+        self.on_posts = on_posts
+
+    def is_owner_post(self, post: dict) -> bool:
+        """Опубликованный пост от имени сообщества"""
+        return post.get('post_type', 'post') == 'post' and post.get('from_id') == int(self.group_id)
+
+    async def connect(self) -> dict:
+        """Адрес и ключ сервера; VKMethodError, если токен не даёт доступа к long poll группы"""
+        return await self.client.method('groups.getLongPollServer', self.token, group_id=abs(int(self.group_id)))
+
+    async def run(self, server: dict):
+        """Цикл запросов к серверу long poll; выходит только с исключением"""
+        ts = server['ts']
+        while True:
+            data = await self.client.long_poll(server, ts)
+            failed = data.get('failed')
+            if failed == 1:
+                # История событий устарела: часть постов могла потеряться
+                ts = data['ts']
+                await self.on_posts(None)
+                continue
+            if failed in (2, 3):
+                # Истёк ключ (2) или потеряна информация (3) - получаем сервер заново
+                server = await self.connect()
+                if failed == 3:
+                    ts = server['ts']
+                    await self.on_posts(None)
+                continue
+            
+            ts = data['ts']
+            posts = [
+                update['object'] for update in data.get('updates', [])
+                if update.get('type') == 'wall_post_new' and self.is_owner_post(update.get('object', {}))
+            ]
+            if posts:
+                await self.on_posts(posts)
+
+class VKParser:
+    def __init__(self, token: str, group_id: str, client: VKApiClient):
+        self.token = token
+        self.client = client
+        self.group_id = group_id
+        self.api_version = VK_API_VERSION
+
+    @staticmethod
+    def filter_new_posts(items: list, last_checked_id: int) -> tuple[list, int]:
+        """Отбор новых постов из ответа wall.get, от старых к новым.
+        
+        Новому подписчику (last_checked_id == 0) достаются только VK_POLL_COUNT последних постов.
+        """
+        new_posts = []
+        current_max_id = last_checked_id
+        
+        # Сортируем посты по ID (от старых к новым)
+        sorted_posts = sorted(items, key=lambda x: x['id'])
+        
+        for post in sorted_posts:
+            # Пропускаем закрепленный пост и рекламу
+            if post.get('is_pinned') or post.get('marked_as_ads'):
+                continue
+                
+            # Проверяем, является ли пост новым (при сдвиге страниц один пост может прийти дважды)
+            if post['id'] > current_max_id:
+                new_posts.append(post)
+                current_max_id = post['id']
+        
+        if last_checked_id == 0:
+            new_posts = new_posts[-VK_POLL_COUNT:]
+        return new_posts, current_max_id
+
+    async def iter_pages(self, last_checked_id: int, first_page: list = None):
+        """Страницы стены от новых постов к старым, пока не дойдём до last_checked_id.
+        
+        first_page - уже загруженная первая страница (например, из пакетного опроса).
+        При первой проверке (last_checked_id == 0) загружается только первая страница,
+        а догрузка ограничена VK_BACKLOG_LIMIT постами.
+        """
+        offset = 0
+        count = VK_POLL_COUNT
+        page = first_page
+        while True:
+            if page is None:
+                response = await self.client.method(
+                    'wall.get',
+                    self.token,
+                    owner_id=self.group_id,
+                    offset=offset,
+                    count=count,
+                    filter='owner',
+                    v=self.api_version
+                )
+                page = response['items']
+            
+            yield page
+            
+            # Закреплённый пост стоит первым независимо от даты, его ID не показателен
+            ids = [post['id'] for post in page if not post.get('is_pinned')]
+            offset += len(page)
+            if not ids or len(page) < count or last_checked_id == 0 or min(ids) <= last_checked_id + 1:
+                return
+            if offset >= VK_BACKLOG_LIMIT:
+                logger.warning(
+                    f"Группа {self.group_id}: пропущено больше {VK_BACKLOG_LIMIT} постов, "
+                    f"более старые посты после ID {last_checked_id} не будут опубликованы"
+                )
+                return
+            
+            count = min(VK_PAGE_SIZE, VK_BACKLOG_LIMIT - offset)
+            page = None
+
+    async def fetch_pages(self, last_checked_id: int, first_page: list = None) -> list:
+        """Посты стены новее last_checked_id и вся первая страница (её получают новые подписчики).
+        
+        Страницы обрабатываются по мере загрузки: от более старых постов остаётся только то,
+        что может быть опубликовано. Ошибки VK API и сети пробрасываются наружу.
+        """
+        items = []
+        first = True
+        async for page in self.iter_pages(last_checked_id, first_page):
+            items.extend(page if first else (post for post in page if post['id'] > last_checked_id))
+            first = False
+        return items
+
+    async def fetch_new_posts(self, last_checked_id: int, first_page: list = None) -> tuple[list, int]:
+        """Получение всех новых постов после last_checked_id. Ошибки VK API и сети пробрасываются наружу"""
+        items = await self.fetch_pages(last_checked_id, first_page)
+        
+        new_posts, current_max_id = self.filter_new_posts(items, last_checked_id)
+        
+        if new_posts:
+            logger.info(f"Найдены новые посты: {len(new_posts)}. Максимальный ID: {current_max_id}")
+        else:
+            logger.info(f"Новых постов не найдено. Последний ID: {last_checked_id}")
+        
+        return new_posts, current_max_id
+
+    @staticmethod
+    async def fetch_walls(client: VKApiClient, token: str, group_ids: list) -> dict:
+        """Последние посты нескольких групп одним запросом execute (не больше VK_EXECUTE_BATCH групп).
+        
+        Возвращает {group_id: items}; группы, для которых VK вернул ошибку, в результат не попадают.
+        """
+        calls = ', '.join(
+            'API.wall.get(' + json.dumps({'owner_id': int(group_id), 'count': VK_POLL_COUNT, 'filter': 'owner'}) + ')'
+            for group_id in group_ids
+        )
+        response = await client.method('execute', token, code=f'return [{calls}];')
+        
+        walls = {}
+        for group_id, wall in zip(group_ids, response):
+            # Неудачный вызов внутри execute возвращает false
+            if isinstance(wall, dict):
+                walls[group_id] = wall['items']
+        return walls
+
+    async def get_new_posts(self, last_checked_id: int) -> tuple[list, int]:
+        try:
+            return await self.fetch_new_posts(last_checked_id)
+        except VkApiError as e:
+            logger.error(f"Ошибка VK API: {e}")
+            return [], last_checked_id
+        except Exception as e:
+            logger.error(f"Неизвестная ошибка при получении постов: {e}", exc_info=True)
+            return [], last_checked_id
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity в запасе"""
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def reserve(self, cost: float, now: float) -> float:
+        """Резервирует cost токенов и возвращает, сколько секунд нужно подождать"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= cost
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, seconds: float, now: float):
+        """Запрет отправки на заданное время (retry_after из ответа 429)"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+class TelegramRateLimiter:
+    """Ограничение скорости отправки: общий лимит на токен и отдельный лимит на каждый канал"""
+    def __init__(self, global_rate: float = TG_GLOBAL_RATE, chat_rate: float = TG_CHAT_RATE,
+                 chat_burst: float = TG_CHAT_BURST):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.global_buckets = {}
+        self.chat_buckets = {}
+
+    def _buckets(self, bot_token: str, chat_id) -> tuple[TokenBucket, TokenBucket]:
+        global_bucket = self.global_buckets.get(bot_token)
+        if global_bucket is None:
+            global_bucket = self.global_buckets[bot_token] = TokenBucket(self.global_rate, self.global_rate)
+        
+        key = (bot_token, str(chat_id))
+        chat_bucket = self.chat_buckets.get(key)
+        if chat_bucket is None:
+            chat_bucket = self.chat_buckets[key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return global_bucket, chat_bucket
+
+    async def acquire(self, bot_token: str, chat_id, cost: float = 1):
+        """Ждёт, пока отправка cost сообщений в chat_id не нарушит лимиты"""
+        global_bucket, chat_bucket = self._buckets(bot_token, chat_id)
+        now = time.monotonic()
+        wait = max(global_bucket.reserve(cost, now), chat_bucket.reserve(cost, now))
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def penalize(self, bot_token: str, chat_id, retry_after: float):
+        """Учитывает retry_after из ответа 429 для канала"""
+        _, chat_bucket = self._buckets(bot_token, chat_id)
+        chat_bucket.block(retry_after, time.monotonic())
+
+class TelegramApiClient:
+    """Асинхронный клиент Telegram Bot API: отдельный пул keep-alive соединений на каждый токен"""
+    # on_request(True) вызывается прямо перед HTTP-запросом метода send* (после ожидания лимитов),
+    # on_request(False) - когда Telegram ответил ошибкой и ничего не опубликовал. Задаётся на время
+    # отправки одной части поста и видна только задаче, которая её отправляет
+    on_request = contextvars.ContextVar('telegram_on_request', default=None)
+
+    def __init__(self, api_url: str = TELEGRAM_API_URL, connect_timeout: float = TG_CONNECT_TIMEOUT,
+                 read_timeout: float = TG_READ_TIMEOUT, pool_size: int = TG_POOL_SIZE,
+                 rate_limiter: TelegramRateLimiter = None):
+        self.api_url = api_url
+        self.timeout = aiohttp.ClientTimeout(connect=connect_timeout, sock_read=read_timeout)
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        self.sessions = {}
+        self.running = False
+
+    async def start(self):
+        self.running = True
+
+    async def close(self):
+        """Закрытие всех пулов соединений"""
+        self.running = False
+        sessions = list(self.sessions.values())
+        self.sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    def _get_session(self, bot_token: str) -> aiohttp.ClientSession:
+        session = self.sessions.get(bot_token)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+            self.sessions[bot_token] = session
+        return session
+
+    @staticmethod
+    async def _iter_file(file):
+        """Чтение файла блоками, чтобы не держать его целиком в памяти при отправке"""
+        while True:
+            chunk = file.read(MEDIA_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+    def _build_form(self, payload: dict, files: dict) -> aiohttp.FormData:
+        """multipart/form-data с файлами, которые передаются потоком"""
+        form = aiohttp.FormData()
+        for key, value in payload.items():
+            form.add_field(key, value if isinstance(value, str) else json.dumps(value, ensure_ascii=False))
+        for name, file in files.items():
+            file.seek(0)
+            form.add_field(name, self._iter_file(file), filename=name, content_type='application/octet-stream')
+        return form
+
+    async def call(self, bot_token: str, method: str, payload: dict, files: dict = None) -> dict:
+        """Вызов метода Bot API, возвращает разобранный JSON-ответ.
+        
+        files - {имя поля: файловый объект} для загрузки файлов через multipart/form-data.
+        """
+        if not self.running:
+            raise RuntimeError("TelegramApiClient не запущен")
+        
+        # Лимиты считаются только для методов, которые публикуют сообщения
+        chat_id = payload.get('chat_id')
+        limited = self.rate_limiter is not None and chat_id is not None and method.startswith('send')
+        cost = len(payload['media']) if method == 'sendMediaGroup' else 1
+        
+        session = self._get_session(bot_token)
+        on_request = self.on_request.get() if method.startswith('send') else None
+        for attempt in range(TG_MAX_RETRIES + 1):
+            if limited:
+                await self.rate_limiter.acquire(bot_token, chat_id, cost)
+            
+            if on_request is not None:
+                on_request(True)
+            url = f"{self.api_url}/bot{bot_token}/{method}"
+            if files:
+                request = session.post(url, data=self._build_form(payload, files))
+            else:
+                request = session.post(url, json=payload)
+            with TG_REQUEST_SECONDS.time(method=method):
+                async with request as response:
+                    result = await response.json(content_type=None)
+            if on_request is not None and not result.get('ok'):
+                on_request(False)
+            
+            retry_after = result.get('parameters', {}).get('retry_after')
+            if result.get('error_code') != 429 or not retry_after or attempt == TG_MAX_RETRIES:
+                return result
+            
+            logger.warning(f"Telegram просит подождать {retry_after} с перед отправкой в {chat_id}")
+            if limited:
+                self.rate_limiter.penalize(bot_token, chat_id, retry_after)
+            else:
+                await asyncio.sleep(retry_after)
+        return result
+
+class MediaFetcher:
+    """Скачивание фото из VK для отправки в Telegram байтами.
+    
+    Файлы скачиваются параллельно (не больше MEDIA_FETCH_CONCURRENCY одновременно) во
+    временные файлы. Ограничения общие для всех воркеров отправки: скачанными и ещё не
+    загруженными могут быть не больше MEDIA_BUFFER_FILES файлов, а в памяти они держат
+    не больше MEDIA_MEMORY_BUDGET байт вместе (и MEDIA_SPOOL_SIZE каждый), остальное - на диске.
+    """
+    def __init__(self, concurrency: int = MEDIA_FETCH_CONCURRENCY, spool_size: int = MEDIA_SPOOL_SIZE,
+                 max_file_size: int = MEDIA_MAX_FILE_SIZE, memory_budget: int = MEDIA_MEMORY_BUDGET,
+                 max_files: int = MEDIA_BUFFER_FILES):
+        self.concurrency = concurrency
+        self.spool_size = spool_size
+        self.max_file_size = max_file_size
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.max_files = max_files
+        self.files_held = 0
+        self.session = None
+        self.init_primitives()
+
+    def init_primitives(self):
+        """Семафор и условие заново: вызывается в цикле событий, в котором идут загрузки"""
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.files_released = asyncio.Condition()
+
+    async def start(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=MEDIA_FETCH_TIMEOUT))
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    def _open_spool(self):
+        """Временный файл, которому досталась часть общего бюджета памяти (возможно, нулевая)"""
+        memory = max(0, min(self.spool_size, self.memory_budget - self.memory_used))
+        self.memory_used += memory
+        spool = tempfile.SpooledTemporaryFile(max_size=memory)
+        if not memory:
+            # max_size=0 значит "никогда не переносить на диск", поэтому без бюджета файл сразу на диске
+            spool.rollover()
+        spool.memory = memory
+        return spool
+
+    def _close_spool(self, spool):
+        spool.close()
+        self.memory_used -= spool.memory
+
+    async def fetch(self, url: str, max_file_size: int = None):
+        """Скачивание одного файла во временный файл (закрывается через release)"""
+        max_file_size = max_file_size or self.max_file_size
+        await self.start()
+        async with self.semaphore:
+            spool = self._open_spool()
+            try:
+                async with self.session.get(url) as response:
+                    response.raise_for_status()
+                    if (response.content_length or 0) > max_file_size:
+                        raise ValueError(f"Файл больше {max_file_size} байт: {url}")
+                    size = 0
+                    async for chunk in response.content.iter_chunked(MEDIA_CHUNK_SIZE):
+                        size += len(chunk)
+                        if size > max_file_size:
+                            raise ValueError(f"Файл больше {max_file_size} байт: {url}")
+                        spool.write(chunk)
+            except BaseException:
+                self._close_spool(spool)
+                raise
+            spool.seek(0)
+            return spool
+
+    async def _reserve(self, count: int):
+        """Места под count файлов сразу: альбомы не могут заблокировать друг друга, заняв их по частям"""
+        async with self.files_released:
+            await self.files_released.wait_for(
+                lambda: self.files_held + count <= self.max_files or self.files_held == 0
+            )
+            self.files_held += count
+
+    async def _release(self, count: int):
+        async with self.files_released:
+            self.files_held -= count
+            self.files_released.notify_all()
+
+    @asynccontextmanager
+    async def fetched(self, urls: list, max_file_size: int = None):
+        """Параллельное скачивание нескольких файлов на время блока async with.
+        
+        При выходе из блока (и при ошибке скачивания) временные файлы закрываются.
+        Ошибки скачивания выбрасываются как MediaFetchError.
+        """
+        await self._reserve(len(urls))
+        try:
+            results = await asyncio.gather(*(self.fetch(url, max_file_size) for url in urls), return_exceptions=True)
+            files = [result for result in results if not isinstance(result, BaseException)]
+            try:
+                for url, result in zip(urls, results):
+                    if isinstance(result, (aiohttp.ClientError, asyncio.TimeoutError, ValueError)):
+                        raise MediaFetchError(url, result) from result
+                    if isinstance(result, BaseException):
+                        raise result
+                yield files
+            finally:
+                for file in files:
+                    self._close_spool(file)
+        finally:
+            await self._release(len(urls))
+
+class CredentialValidator:
+    """Асинхронная проверка токенов VK и Telegram, доступа к группе и каналу.
+    
+    Каждая проверка ограничена VALIDATION_TIMEOUT, а её результат (None - всё в порядке,
+    иначе текст отказа) запоминается на VALIDATION_CACHE_TTL секунд. Отказом считаются только
+    ошибки авторизации и доступа; временные ошибки (лимиты запросов, 5xx), сетевые ошибки и
+    таймауты не кэшируются и выбрасываются наружу (VKMethodError, TelegramApiError).
+    """
+    def __init__(self, vk_client: VKApiClient, api_url: str = TELEGRAM_API_URL,
+                 timeout: float = VALIDATION_TIMEOUT, ttl: float = VALIDATION_CACHE_TTL,
+                 max_size: int = VALIDATION_CACHE_SIZE):
+        self.vk_client = vk_client
+        self.api_url = api_url
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_size = max_size
+        self.cache = OrderedDict()  # (проверка, токен, объект) -> (истекает, результат)
+        self.session = None
+
+    async def start(self):
+        """Одна сессия на все токены: токен Telegram передаётся в адресе запроса"""
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def close(self):
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+    async def _cached(self, key: tuple, check) -> str:
+        """Результат проверки из кэша или выполнение check() с таймаутом"""
+        now = time.monotonic()
+        cached = self.cache.get(key)
+        if cached is not None and cached[0] > now:
+            self.cache.move_to_end(key)
+            return cached[1]
+        
+        result = await asyncio.wait_for(check(), self.timeout)
+        self.cache[key] = (time.monotonic() + self.ttl, result)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+        return result
+
+    async def _vk_check(self, method: str, token: str, **params) -> str:
+        try:
+            await self.vk_client.method(method, token, **params)
+        except VKMethodError as e:
+            if not e.permanent:
+                raise
+            return str(e)
+        return None
+
+    async def _tg_check(self, bot_token: str, method: str, payload: dict) -> str:
+        await self.start()
+        async with self.session.post(f"{self.api_url}/bot{bot_token}/{method}", json=payload) as response:
+            result = await response.json(content_type=None)
+        if not result.get('ok'):
+            error = TelegramApiError(method, result)
+            # 404 Telegram возвращает на токен неверного формата
+            rejected = error.error_code in (401, 403, 404) or (
+                error.error_code == 400 and 'chat not found' in error.description.lower()
+            )
+            if not rejected:
+                raise error
+            return error.description or f"ошибка {error.error_code}"
+        return None
+
+    async def check_vk_token(self, token: str) -> str:
+        return await self._cached(('vk_token', token, None), lambda: self._vk_check('groups.getById', token, group_id=1))
+
+    async def check_vk_group(self, token: str, group_id: str) -> str:
+        """Токен может читать стену группы"""
+        return await self._cached(('vk_group', token, group_id),
+                                  lambda: self._vk_check('wall.get', token, owner_id=group_id, count=1))
+
+    async def check_tg_token(self, bot_token: str) -> str:
+        return await self._cached(('tg_token', bot_token, None), lambda: self._tg_check(bot_token, 'getMe', {}))
+
+    async def check_tg_channel(self, bot_token: str, channel: str) -> str:
+        """Бот видит канал"""
+        return await self._cached(('tg_channel', bot_token, channel),
+                                  lambda: self._tg_check(bot_token, 'getChat', {'chat_id': channel}))
+
+class PhotoSizePolicy:
+    """Выбор варианта фото из photo['sizes'] VK.
+    
+    Политики регистрируются в POLICIES через PhotoSizePolicy.register и получают список
+    размеров и целевую длинную сторону.
+    """
+    POLICIES = {}
+
+    def __init__(self, name: str = PHOTO_SIZE_POLICY, target_side: int = PHOTO_TARGET_SIDE):
+        if name not in self.POLICIES:
+            raise ValueError(f"Неизвестная политика выбора размера фото: {name}")
+        self.name = name
+        self.target_side = target_side
+
+    @classmethod
+    def register(cls, name: str):
+        """Декоратор для добавления политики"""
+        def decorator(func):
+            cls.POLICIES[name] = func
+            return func
+        return decorator
+
+    @classmethod
+    def for_channel(cls, channel: str = None) -> 'PhotoSizePolicy':
+        """Политика канала из PHOTO_SIZE_POLICY_BY_CHANNEL или глобальная"""
+        settings = PHOTO_SIZE_POLICY_BY_CHANNEL.get(str(channel), {}) if channel is not None else {}
+        return cls(settings.get('policy', PHOTO_SIZE_POLICY), settings.get('target_side', PHOTO_TARGET_SIDE))
+
+    def select(self, sizes: list) -> dict:
+        return self.POLICIES[self.name](sizes, self.target_side)
+
+@PhotoSizePolicy.register('max')
+def _largest_photo_size(sizes: list, target_side: int) -> dict:
+    return max(sizes, key=lambda x: x['width'] * x['height'])
+
+@PhotoSizePolicy.register('target')
+def _target_photo_size(sizes: list, target_side: int) -> dict:
+    # Наименьший вариант, длинная сторона которого не меньше целевой; если такого нет - самый большой
+    suitable = [size for size in sizes if max(size['width'], size['height']) >= target_side]
+    if not suitable:
+        return _largest_photo_size(sizes, target_side)
+    return min(suitable, key=lambda x: x['width'] * x['height'])
+
+class TextRenderer:
+    """Перевод текста поста VK в HTML для Telegram с разбиением на части.
+    
+    Текст экранируется, вики-ссылки VK вида [id1|Имя] и [https://...|текст] становятся
+    тегами <a>. Длинный текст делится по абзацам, а слишком длинные абзацы - по словам;
+    ссылки не разрываются. Всё делается за один проход по тексту.
+    """
+    WIKI_LINK = re.compile(r'\[((?:id|club|public|event)\d+|https?://[^|\]\s]+)\|([^\]\n]+)\]')
+    PARAGRAPH = re.compile(r'\n\s*\n')
+    WORD = re.compile(r'\s+|\S+')
+
+    @staticmethod
+    def visible_length(text: str) -> int:
+        """Длина в единицах UTF-16, как считает Telegram"""
+        return len(text.encode('utf-16-le')) // 2
+
+    @classmethod
+    def _link(cls, match) -> str:
+        target, label = match.groups()
+        href = target if target.startswith('http') else f"https://vk.com/{target}"
+        return f'<a href="{html.escape(href)}">{html.escape(label, quote=False)}</a>'
+
+    @classmethod
+    def _paragraph(cls, paragraph: str) -> tuple[str, int]:
+        """HTML абзаца целиком и его видимая длина"""
+        markup = []
+        position = 0
+        for match in cls.WIKI_LINK.finditer(paragraph):
+            markup.append(html.escape(paragraph[position:match.start()], quote=False))
+            markup.append(cls._link(match))
+            position = match.end()
+        markup.append(html.escape(paragraph[position:], quote=False))
+        return ''.join(markup), cls.visible_length(cls.WIKI_LINK.sub(r'\2', paragraph))
+
+    @classmethod
+    def _atoms(cls, paragraph: str) -> list:
+        """Неделимые части абзаца: (видимый текст, HTML, видимая длина)"""
+        atoms = []
+        position = 0
+        for match in cls.WIKI_LINK.finditer(paragraph):
+            atoms += cls._text_atoms(paragraph[position:match.start()])
+            label = match.group(2)
+            atoms.append((label, cls._link(match), cls.visible_length(label)))
+            position = match.end()
+        atoms += cls._text_atoms(paragraph[position:])
+        return atoms
+
+    @classmethod
+    def _text_atoms(cls, text: str) -> list:
+        return [
+            (word, html.escape(word, quote=False), cls.visible_length(word))
+            for word in cls.WORD.findall(text)
+        ]
+
+    @classmethod
+    def render(cls, text: str, first_limit: int = TG_MESSAGE_LIMIT, limit: int = TG_MESSAGE_LIMIT) -> list:
+        """Список HTML-частей: первая не длиннее first_limit (подпись), остальные не длиннее limit"""
+        chunks = []
+        current = []
+        size = 0
+
+        def capacity() -> int:
+            return first_limit if not chunks else limit
+
+        def flush():
+            nonlocal current, size
+            chunk = ''.join(current).strip()
+            if chunk or not chunks:
+                chunks.append(chunk)
+            current = []
+            size = 0
+
+        for paragraph in cls.PARAGRAPH.split(text):
+            paragraph = paragraph.strip()
+            if not paragraph:
+                continue
+            markup, total = cls._paragraph(paragraph)
+            separator = 2 if current else 0
+            
+            # Абзац целиком помещается в текущую часть или в новую
+            if size + separator + total > capacity() and current and total <= limit:
+                flush()
+                separator = 0
+            if size + separator + total <= capacity():
+                if separator:
+                    current.append('\n\n')
+                current.append(markup)
+                size += separator + total
+                continue
+            
+            # Абзац длиннее части - делим по словам
+            if separator and size + separator < capacity():
+                current.append('\n\n')
+                size += separator
+            for raw, markup, length in cls._atoms(paragraph):
+                if size + length > capacity() and current:
+                    flush()
+                    if raw.isspace():
+                        continue
+                if length <= capacity():
+                    current.append(markup)
+                    size += length
+                    continue
+                # Слово длиннее части (или ссылка с огромным текстом) - режем по символам, ссылка теряется
+                for char in raw:
+                    char_length = cls.visible_length(char)
+                    if size + char_length > capacity() and current:
+                        flush()
+                    current.append(html.escape(char, quote=False))
+                    size += char_length
+        
+        if current or not chunks:
+            flush()
+        return chunks
+
+class PollState:
+    """Оценка частоты постов группы и интервал её проверки"""
+    def __init__(self):
+        self.mean_gap = None  # средний промежуток между постами, секунд
+        self.last_post_date = None
+        self.empty_polls = 0
+        self.interval = POLL_MIN_INTERVAL
 
-    def update_user_data(self, user_id: int, key: str, value):
-        """Update user data in database"""
-        # Get current user data
-        user_data = self.get_user_data(user_id)
-        user_data[key] = value
-        
-        # Save updated data
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, data) 
-            VALUES (?, ?)
-        ''', (user_id, json.dumps(user_data)))
+    def record(self, posts: list) -> float:
+        """Учитывает результат проверки и возвращает интервал до следующей"""
+        if posts:
+            for post in posts:
+                date = post.get('date')
+                if date is None:
+                    continue
+                if self.last_post_date is not None and date > self.last_post_date:
+                    gap = date - self.last_post_date
+                    if self.mean_gap is None:
+                        self.mean_gap = gap
+                    else:
+                        self.mean_gap += POLL_RATE_SMOOTHING * (gap - self.mean_gap)
+                if self.last_post_date is None or date > self.last_post_date:
+                    self.last_post_date = date
+            self.empty_polls = 0
+        else:
+            self.empty_polls += 1
         
-        conn.commit()
-        conn.close()
+        base = POLL_MIN_INTERVAL if self.mean_gap is None else self.mean_gap * POLL_GAP_FRACTION
+        base = min(max(base, POLL_MIN_INTERVAL), POLL_MAX_INTERVAL)
+        self.interval = min(base * POLL_BACKOFF ** self.empty_polls, POLL_MAX_INTERVAL)
+        return self.interval
 
-    def get_bots(self, user_id: int) -> list:
-        """Get all bot configurations for a user"""
-        user_data = self.get_user_data(user_id)
-        return user_data.get('bots', [])
+class CheckScheduler:
+    """Параллельная проверка источников с ограничением числа воркеров.
+    
+    Источники (user_id, bot_index) группируются по vk_group_id: стена каждой группы
+    запрашивается один раз за проход, а результат раздаётся всем подписанным ботам.
+    Группы лежат в очереди с приоритетом по времени следующей проверки, интервал
+    подстраивается под частоту постов группы (PollState). Список источников разбирается
+    по группам только когда он меняется, а на каждом тике из кучи достаются лишь группы,
+    которым пора.
+    """
+    def __init__(self, max_workers: int = MAX_CONCURRENT_CHECKS):
+        self.max_workers = max_workers
+        self.init_primitives()
+        self.due_queue = []  # куча (время следующей проверки, group_id)
+        self.next_due = {}
+        self.poll_states = {}
+        self.pushed = set()  # группы, новые посты которых приходят через long poll
+        self.sources = None  # список источников, по которому построен groups
+        self.groups = {}
 
-    def get_bot(self, user_id: int, bot_index: int) -> dict:
-        """Get specific bot configuration by index (0-2)"""
-        bots = self.get_bots(user_id)
-        if 0 <= bot_index < len(bots):
-            return bots[bot_index]
-        return {}
+    def init_primitives(self):
+        """Семафор и блокировки заново: вызывается в цикле событий, в котором идут проверки"""
+        self.semaphore = asyncio.Semaphore(self.max_workers)
+        self.source_locks = {}
+        self.pass_lock = asyncio.Lock()
 
-    def update_bot(self, user_id: int, bot_index: int, bot_data: dict):
-        """Update specific bot configuration"""
-        # Get current user data
-        user_data = self.get_user_data(user_id)
-        
-        # Initialize bots list if it doesn't exist
-        if 'bots' not in user_data:
-            user_data['bots'] = [{}, {}, {}]  # Initialize with 3 empty slots
-        
-        # Ensure we have enough slots
-        while len(user_data['bots']) <= bot_index:
-            user_data['bots'].append({})
+    def get_lock(self, user_id: int, bot_index: int) -> asyncio.Lock:
+        """Блокировка источника, чтобы один бот не проверялся дважды одновременно"""
+        key = (user_id, bot_index)
+        if key not in self.source_locks:
+            self.source_locks[key] = asyncio.Lock()
+        return self.source_locks[key]
+
+    @staticmethod
+    def group_sources(sources: list) -> dict:
+        """Группировка источников (user_id, bot_index, bot) по vk_group_id"""
+        groups = {}
+        for user_id, bot_index, bot in sources:
+            groups.setdefault(str(bot['vk_group_id']), []).append((user_id, bot_index, bot))
+        return groups
+
+    def schedule(self, group_id: str, due: float):
+        self.next_due[group_id] = due
+        heapq.heappush(self.due_queue, (due, group_id))
+
+    def update_sources(self, sources: list) -> dict:
+        """Источники по группам; пересчитываются, только если пришёл другой список источников.
+        
+        Новые группы ставятся в очередь на сейчас, удалённые забываются, когда их запись всплывёт в куче.
+        """
+        if sources is not self.sources:
+            self.sources = sources
+            self.groups = self.group_sources(sources)
+            now = time.monotonic()
+            for group_id in self.groups:
+                if group_id not in self.next_due:
+                    self.poll_states[group_id] = PollState()
+                    self.schedule(group_id, now)
+        return self.groups
+
+    def pop_due(self, now: float) -> list:
+        """Группы, которые пора проверить: из кучи достаются только записи со сроком не позже now"""
+        groups = self.groups
+        
+        due = []
+        overdue = 0.0
+        while self.due_queue and self.due_queue[0][0] <= now:
+            due_time, group_id = heapq.heappop(self.due_queue)
+            # Устаревшая запись кучи (группу уже перепланировали)
+            if self.next_due.get(group_id) != due_time:
+                continue
+            if group_id not in groups:
+                del self.next_due[group_id]
+                self.poll_states.pop(group_id, None)
+                continue
+            due.append(group_id)
+            overdue = max(overdue, now - due_time)
+        POLL_OVERDUE_SECONDS.set(overdue)
+        return due
+
+    def reschedule(self, group_id: str, posts: list):
+        """Планирует следующую проверку группы по результату текущей"""
+        interval = self.poll_states.setdefault(group_id, PollState()).record(posts or [])
+        if group_id in self.pushed:
+            # Посты приходят через long poll, wall.get нужен только на случай потерянных событий
+            interval = max(interval, VK_LONG_POLL_RECONCILE)
+        self.schedule(group_id, time.monotonic() + interval)
+
+    async def run_pass(self, sources: list, check_group, prefetch=None) -> bool:
+        """Проход по группам, которые пора проверить. Новый проход не начинается, пока не закончен предыдущий.
+        
+        check_group(group_id, sources, items) возвращает новые посты группы (или None при ошибке).
+        prefetch(groups) может заранее загрузить стены сразу многих групп; check_group получает
+        загруженные посты группы или None, если группу нужно запросить отдельно.
+        """
+        if self.pass_lock.locked():
+            logger.warning("Предыдущий проход ещё не завершён, пропускаем запуск")
+            return False
+        
+        async with self.pass_lock:
+            started = time.monotonic()
+            all_groups = self.update_sources(sources)
+            groups = {group_id: all_groups[group_id] for group_id in self.pop_due(started)}
+            if not groups:
+                return True
             
-        user_data['bots'][bot_index] = bot_data
-        
-        # Save updated data
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (user_id, data) 
-            VALUES (?, ?)
-        ''', (user_id, json.dumps(user_data)))
-        
-        conn.commit()
-        conn.close()
+            prefetched = await prefetch(groups) if prefetch else {}
+            await asyncio.gather(*(
+                self._run_group(group_id, group_sources, check_group, prefetched.get(group_id))
+                for group_id, group_sources in groups.items()
+            ))
+            PASS_SECONDS.observe(time.monotonic() - started)
+            checked_sources = sum(len(group_sources) for group_sources in groups.values())
+            dedup_ratio = checked_sources / len(groups)
+            logger.info(
+                f"Проход завершён: источников {checked_sources}, групп VK {len(groups)} "
+                f"из {len(all_groups)}, дедупликация {dedup_ratio:.2f}x, время {time.monotonic() - started:.1f} с"
+            )
+        return True
 
-    def delete_bot(self, user_id: int, bot_index: int):
-        """Delete specific bot configuration"""
-        # Get current user data
-        user_data = self.get_user_data(user_id)
+    async def run_group(self, group_id: str, sources: list, check_group, items: list = None):
+        """Внеочередная проверка одной группы (например, по событию long poll).
         
-        # Check if user has bots data
-        if 'bots' in user_data:
-            if 0 <= bot_index < len(user_data['bots']):
-                user_data['bots'][bot_index] = {}
-                
-                # Save updated data
-                conn = sqlite3.connect(DB_FILE)
-                cursor = conn.cursor()
-                
-                cursor.execute('''
-                    INSERT OR REPLACE INTO users (user_id, data) 
-                    VALUES (?, ?)
-                ''', (user_id, json.dumps(user_data)))
+        Занятых ботов не пропускаем, а ждём: иначе присланные посты дошли бы до них
+        только со страховочным wall.get через VK_LONG_POLL_RECONCILE.
+        """
+        await self._run_group(group_id, sources, check_group, items, wait=True)
+
+    async def _run_group(self, group_id: str, sources: list, check_group, items: list = None, wait: bool = False):
+        posts = None
+        try:
+            async with self.semaphore:
+                # Боты, которые сейчас проверяются вручную, пропускаем (кроме wait)
+                free_sources = []
+                for user_id, bot_index, bot in sources:
+                    if not wait and self.get_lock(user_id, bot_index).locked():
+                        logger.info(f"Бот #{bot_index+1} пользователя {user_id} уже проверяется, пропускаем")
+                    else:
+                        free_sources.append((user_id, bot_index, bot))
+                if not free_sources:
+                    return
                 
-                conn.commit()
-                conn.close()
+                locks = [self.get_lock(user_id, bot_index) for user_id, bot_index, _ in free_sources]
+                for lock in locks:
+                    await lock.acquire()
+                try:
+                    posts = await check_group(group_id, free_sources, items)
+                except Exception as e:
+                    logger.error(f"Неизвестная ошибка для группы {group_id}: {e}", exc_info=True)
+                finally:
+                    for lock in locks:
+                        lock.release()
+        finally:
+            self.reschedule(group_id, posts)
 
-    def get_last_post_id(self, user_id: int, bot_index: int = 0) -> int:
-        """Get last post ID for specific bot"""
-        user_data = self.get_user_data(user_id)
-        bots = user_data.get('bots', [])
-        if 0 <= bot_index < len(bots) and bots[bot_index]:
-            return bots[bot_index].get('last_post_id', 0)
-        return 0
+class ProgressReporter:
+    """Сообщение о ходе ручной проверки, которое правится не чаще раза в interval секунд.
+    
+    Каждый слот бота пишет свою строку через set(); изменения между правками сливаются,
+    и в сообщение попадает только последнее состояние всех строк.
+    """
+    def __init__(self, message, header: str, interval: float = PROGRESS_EDIT_INTERVAL):
+        self.message = message
+        self.header = header
+        self.interval = interval
+        self.lines = {}  # слот -> строка
+        self.edited_at = time.monotonic()  # сообщение только что отправлено
+        self.shown = None
+        self.dirty = False
+        self.task = None
 
-    def set_last_post_id(self, user_id: int, bot_index: int, post_id: int):
-        """Set last post ID for specific bot"""
-        # Get current bots data
-        bots = self.get_bots(user_id)
-        
-        # Ensure we have enough slots
-        while len(bots) <= bot_index:
-            bots.append({})
-        
-        # Initialize bot data if empty
-        if not bots[bot_index]:
-            bots[bot_index] = {}
-            
-        # Set the last post ID
-        bots[bot_index]['last_post_id'] = post_id
-        
-        # Update the bot data in database
-        self.update_bot(user_id, bot_index, bots[bot_index])
+    def render(self) -> str:
+        return self.header + "\n\n" + "\n".join(self.lines[slot] for slot in sorted(self.lines))
 
-class VKParser:
-    def __init__(self, token: str, group_id: str):
-        self.vk_session = VkApi(token=token)
-        self.vk = self.vk_session.get_api()
-        self.group_id = group_id
-        self.api_version = '5.131'
+    def set(self, slot: int, line: str):
+        """Новая строка слота; правка сообщения откладывается до конца интервала"""
+        self.lines[slot] = line
+        self.dirty = True
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._flush())
 
-    def get_new_posts(self, last_checked_id: int) -> tuple[list, int]:
-        try:
-            # Получаем 10 последних постов для лучшего обнаружения
-            response = self.vk.wall.get(
-                owner_id=self.group_id,
-                count=10,
-                filter='owner',
-                v=self.api_version
-            )
-            
-            new_posts = []
-            current_max_id = last_checked_id
-            
-            # Сортируем посты по ID (от старых к новым)
-            sorted_posts = sorted(response['items'], key=lambda x: x['id'])
-            
-            for post in sorted_posts:
-                # Пропускаем закрепленный пост и рекламу
-                if post.get('is_pinned') or post.get('marked_as_ads'):
-                    continue
-                    
-                # Проверяем, является ли пост новым
-                if post['id'] > last_checked_id:
-                    new_posts.append(post)
-                    if post['id'] > current_max_id:
-                        current_max_id = post['id']
-            
-            # Сортируем новые посты по ID (от старых к новым) для правильного порядка публикации
-            new_posts.sort(key=lambda x: x['id'])
-            
-            if new_posts:
-                logger.info(f"Найдены новые посты: {len(new_posts)}. Максимальный ID: {current_max_id}")
-            else:
-                logger.info(f"Новых постов не найдено. Последний ID: {last_checked_id}")
-            
-            return new_posts, current_max_id
-            
-        except VkApiError as e:
-            logger.error(f"Ошибка VK API: {e}")
-            return [], last_checked_id
-        except Exception as e:
-            logger.error(f"Неизвестная ошибка при получении постов: {e}", exc_info=True)
-            return [], last_checked_id
+    async def _flush(self):
+        while self.dirty:
+            await asyncio.sleep(max(0.0, self.edited_at + self.interval - time.monotonic()))
+            self.dirty = False
+            text = self.render()
+            if text == self.shown:
+                continue
+            try:
+                await self.message.edit_text(text, parse_mode='HTML')
+                self.shown = text
+            except RetryAfter as e:
+                # Лимит правок исчерпан: следующая попытка после паузы, которую назвал Telegram
+                retry_after = e.retry_after
+                if isinstance(retry_after, timedelta):
+                    retry_after = retry_after.total_seconds()
+                self.dirty = True
+                self.edited_at = time.monotonic() + retry_after - self.interval
+                continue
+            except TelegramError as e:
+                logger.debug(f"Не удалось обновить сообщение о прогрессе: {e}")
+            self.edited_at = time.monotonic()
+
+    async def close(self):
+        """Отмена отложенной правки перед итоговым сообщением"""
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
 
 class TelegramBot:
     def __init__(self, token: str):
         self.token = token
         self.user_config = UserConfig()
+        self.outbox = Outbox(self.user_config)
+        self.ledger = DeliveryLedger(self.user_config)
+        self.media_cache = MediaCache(self.user_config)
+        self.scheduler = CheckScheduler()
+        self.vk_client = VKApiClient()
+        self.tg_client = TelegramApiClient(rate_limiter=TelegramRateLimiter())
+        self.media_fetcher = MediaFetcher()
+        self.validator = CredentialValidator(self.vk_client)
+        self.sources = []
+        self.sources_loaded_at = None
+        self.delivery_event = asyncio.Event()
+        self.delivery_tasks = []
+        self.role = 'all'
+        self.leases = None  # ShardLeases в режиме воркера
+        self.shards = None  # шарды, которые опрашивает этот процесс (None - все)
+        self.lease_renewed_at = None
+        self.long_polls = {}  # group_id -> задача long poll
+        self.long_poll_failed = {}  # group_id -> когда не удалось подключить long poll (monotonic)
+        self.long_poll_groups = None  # группы, по которым последний раз сверялись задачи long poll
+        self.shard_sources = None  # (источники, шарды, источники этих шардов)
+        self.failed_sources = {}  # (user_id, slot) -> почему собственный токен VK не читает группу
+        self.metrics_server = MetricsServer(metrics)
+        metrics.add_collector(self._collect_metrics)
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Главное меню с красивым дизайном для управления несколькими ботами"""
         user = update.effective_user
         user_id = user.id
-        user_data = self.user_config.get_user_data(user_id)
+        # Старый формат с одним ботом переносится в новую схему при запуске (UserConfig.migrate_json_data)
         bots = self.user_config.get_bots(user_id)
         
-        # Проверяем, есть ли у пользователя старая конфигурация (один бот)
-        # Если да, то переносим её в новую систему
-        if not bots and any(k in user_data for k in ['vk_token', 'vk_group_id', 'tg_bot_token', 'tg_channel']):
-            # Создаем новый бот с данными старого
-            old_bot = {}
-            for key in ['vk_token', 'vk_group_id', 'tg_bot_token', 'tg_channel']:
-                if key in user_data:
-                    old_bot[key] = user_data[key]
-            
-            # Добавляем last_post_id если он есть
-            if 'last_post_id' in user_data:
-                old_bot['last_post_id'] = user_data['last_post_id']
-            
-            # Сохраняем старый бот как первый бот в новой системе
-            bots = [old_bot, {}, {}]
-            # Обновляем данные пользователя
-            for i, bot in enumerate(bots):
-                if bot:  # Только если бот не пустой
-                    self.user_config.update_bot(user_id, i, bot)
-            
-            # Удаляем старые данные
-            for key in ['vk_token', 'vk_group_id', 'tg_bot_token', 'tg_channel', 'last_post_id']:
-                if key in user_data:
-                    user_data.pop(key)
-            self.user_config.data[str(user_id)] = user_data
-            self.user_config.save()
-        else:
-            # Убедимся, что у нас всегда 3 слота для ботов
-            while len(bots) < 3:
-                bots.append({})
-        
         text = (
             f"✨ <b>Добро пожаловать, {user.first_name}!</b> ✨\n\n"
             "🚀 <i>Это профессиональный инструмент для автоматической публикации "
@@ -416,6 +2469,43 @@ class TelegramBot:
         # Сохраняем информацию о том, какие настройки мы ожидаем и для какого бота
         self.user_config.update_user_data(update.effective_user.id, 'awaiting_input', f"{setting_type}_{bot_index}")
 
+    VALIDATION_WARNINGS = {
+        'vk_group': "Нет доступа к стене группы VK",
+        'tg_channel': "Бот не видит канал (добавьте его администратором)"
+    }
+    VALIDATION_SUBJECTS = {
+        'vk_token': "токен VK",
+        'vk_group': "доступ к группе VK",
+        'tg_token': "токен бота",
+        'tg_channel': "доступ к каналу"
+    }
+
+    async def _validate_setting(self, user_id: int, bot_index: int, setting_type: str, value: str) -> dict:
+        """Проверка новой настройки вместе с уже сохранёнными.
+        
+        Возвращает {проверка: результат}, где результат None - всё в порядке, строка - отказ
+        VK или Telegram, исключение - проверить не удалось (таймаут или сеть).
+        """
+        settings = {**self.user_config.get_bot(user_id, bot_index), setting_type: value}
+        vk_token, group_id = settings.get('vk_token'), settings.get('vk_group_id')
+        bot_token, channel = settings.get('tg_bot_token'), settings.get('tg_channel')
+        
+        checks = {}
+        if setting_type == 'vk_token':
+            checks['vk_token'] = self.validator.check_vk_token(vk_token)
+        if setting_type in ('vk_token', 'vk_group_id') and vk_token and group_id:
+            checks['vk_group'] = self.validator.check_vk_group(vk_token, group_id)
+        if setting_type == 'tg_bot_token':
+            checks['tg_token'] = self.validator.check_tg_token(bot_token)
+        if setting_type in ('tg_bot_token', 'tg_channel') and bot_token and channel:
+            checks['tg_channel'] = self.validator.check_tg_channel(bot_token, channel)
+        
+        results = await asyncio.gather(*checks.values(), return_exceptions=True)
+        for check, result in zip(checks, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Не удалось выполнить проверку {check} для пользователя {user_id}: {result!r}")
+        return dict(zip(checks, results))
+
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработка введенных данных для конкретного бота"""
         user_id = update.effective_user.id
@@ -447,35 +2537,27 @@ class TelegramBot:
                 if not value.startswith('-') and int(value) != 0:
                     value = f"-{value.lstrip('-')}"
             
-            # Для токена VK делаем проверку
-            if setting_type == 'vk_token':
-                try:
-                    test_vk = VkApi(token=value)
-                    test_vk.method('groups.getById', {'group_id': '1', 'v': '5.131'})
-                except Exception as e:
-                    await update.message.reply_text(f"❌ Неверный токен VK: {e}\nПожалуйста, попробуйте еще раз")
-                    return
+            # Проверяем токены, доступ к группе и каналу параллельно
+            results = await self._validate_setting(user_id, bot_index, setting_type, value)
+            if isinstance(results.get('vk_token'), str):
+                await update.message.reply_text(f"❌ Неверный токен VK: {results['vk_token']}\nПожалуйста, попробуйте еще раз")
+                return
+            if isinstance(results.get('tg_token'), str):
+                await update.message.reply_text("❌ Неверный токен бота Telegram. Проверьте токен и попробуйте снова.")
+                return
             
-            # Для токена бота Telegram делаем проверку
-            if setting_type == 'tg_bot_token':
-                try:
-                    test_url = f"https://api.telegram.org/bot{value}/getMe"
-                    response = requests.get(test_url, timeout=10)
-                    if not response.json().get('ok'):
-                        await update.message.reply_text("❌ Неверный токен бота Telegram. Проверьте токен и попробуйте снова.")
-                        return
-                except Exception as e:
-                    await update.message.reply_text(f"❌ Ошибка проверки токена бота: {e}")
-                    return
-                
-            # Получаем текущие данные бота
-            bot_data = self.user_config.get_bot(user_id, bot_index)
-            if not bot_data:
-                bot_data = {}
+            warnings = []
+            for check, result in results.items():
+                if isinstance(result, str):
+                    warnings.append(f"⚠️ {self.VALIDATION_WARNINGS[check]}: {result}")
+                elif isinstance(result, Exception):
+                    warnings.append(f"⚠️ Не удалось проверить {self.VALIDATION_SUBJECTS[check]}, проверка будет при отправке")
+            if warnings:
+                await update.message.reply_text("\n".join(warnings))
             
             # Обновляем данные бота
-            bot_data[setting_type] = value
-            self.user_config.update_bot(user_id, bot_index, bot_data)
+            self.user_config.update_bot_setting(user_id, bot_index, setting_type, value)
+            self._invalidate_sources()
             self.user_config.update_user_data(user_id, 'awaiting_input', None)
             
             await update.message.reply_text(f"✅ {setting_type} успешно сохранен для Бота #{bot_index+1}!")
@@ -647,6 +2729,7 @@ class TelegramBot:
         
         # Удаляем бота
         self.user_config.delete_bot(user_id, bot_index)
+        self._invalidate_sources()
         
         text = f"✅ <b>Бот #{bot_index+1} успешно удален!</b>\n\nВсе настройки для этого бота были удалены."
         
@@ -673,48 +2756,23 @@ class TelegramBot:
             parse_mode='HTML'
         )
         
+        # Все настроенные боты проверяются одновременно, прогресс каждого - отдельной строкой
+        reporter = ProgressReporter(message, "🔍 <b>Проверка всех ботов...</b>")
         results = []
+        checks = []
         for i, bot in enumerate(bots):
             if bot and all(k in bot for k in ['vk_token', 'vk_group_id', 'tg_bot_token', 'tg_channel']):
-                try:
-                    last_post_id = self.user_config.get_last_post_id(user_id, i)
-                    logger.info(f"Проверка постов для бота #{i+1}, последний ID: {last_post_id}")
-                    vk_parser = VKParser(bot['vk_token'], bot['vk_group_id'])
-                    posts, new_last_post_id = vk_parser.get_new_posts(last_post_id)
-                    
-                    if posts:
-                        # Сохраняем новый last_post_id перед отправкой
-                        self.user_config.set_last_post_id(user_id, i, new_last_post_id)
-                        logger.info(f"Найдено {len(posts)} новых постов для бота #{i+1}, новый последний ID: {new_last_post_id}")
-                        
-                        # Отправляем посты
-                        sent_posts = 0
-                        failed_posts = 0
-                        for post in posts:
-                            try:
-                                await self._forward_post(post, bot['tg_bot_token'], bot['tg_channel'], context)
-                                sent_posts += 1
-                                logger.info(f"Пост #{post['id']} успешно отправлен для бота #{i+1}")
-                            except Exception as e:
-                                failed_posts += 1
-                                logger.error(f"Ошибка отправки поста #{post['id']} для бота #{i+1}: {e}")
-                            
-                            await asyncio.sleep(1)  # Задержка между постами
-                        
-                        results.append(f"✅ Бот #{i+1}: Опубликовано {sent_posts} постов, ошибок: {failed_posts}")
-                    else:
-                        results.append(f"🟢 Бот #{i+1}: Новых постов нет")
-                except VkApiError as e:
-                    logger.error(f"Ошибка VK API для бота #{i+1}: {e}")
-                    results.append(f"🔴 Бот #{i+1}: Ошибка VK API")
-                except Exception as e:
-                    logger.error(f"Неизвестная ошибка для бота #{i+1}: {e}", exc_info=True)
-                    results.append(f"🔴 Бот #{i+1}: Ошибка")
+                results.append(None)
+                checks.append(self._check_bot_slot(user_id, i, bot, reporter))
             elif bot:
                 results.append(f"🟡 Бот #{i+1}: Настройки не завершены")
             else:
                 results.append(f"🔴 Бот #{i+1}: Не настроен")
         
+        checked = iter(await asyncio.gather(*checks))
+        results = [result if result is not None else next(checked) for result in results]
+        await reporter.close()
+        
         # Формируем итоговое сообщение
         text = "📊 <b>Результаты проверки всех ботов:</b>\n\n" + "\n".join(results)
         
@@ -726,6 +2784,38 @@ class TelegramBot:
         
         await message.edit_text(text, reply_markup=reply_markup, parse_mode='HTML')
 
+    async def _check_bot_slot(self, user_id: int, i: int, bot: dict, reporter: ProgressReporter) -> str:
+        """Проверка одного бота для check_all_bots. Возвращает строку итога"""
+        reporter.set(i, f"⏳ Бот #{i+1}: Проверка...")
+        async with self.scheduler.get_lock(user_id, i):
+            try:
+                last_post_id = self.user_config.get_last_post_id(user_id, i)
+                logger.info(f"Проверка постов для бота #{i+1}, последний ID: {last_post_id}")
+                vk_parser = VKParser(bot['vk_token'], bot['vk_group_id'], self.vk_client)
+                posts, new_last_post_id = await vk_parser.get_new_posts(last_post_id)
+            
+                if posts:
+                    # Ставим посты в очередь вместе с новым last_post_id и сразу отправляем
+                    self.outbox.enqueue(user_id, i, bot['tg_channel'], posts, new_last_post_id)
+                    logger.info(f"Найдено {len(posts)} новых постов для бота #{i+1}, новый последний ID: {new_last_post_id}")
+                    total_posts = len(posts)
+                    
+                    async def show_progress(sent_posts: int, failed_posts: int, post_id: int):
+                        reporter.set(i, f"📤 Бот #{i+1}: Отправлено {sent_posts}/{total_posts}, ошибок: {failed_posts}")
+                    
+                    sent_posts, failed_posts = await self._deliver_bot_posts(user_id, i, show_progress)
+                    result = f"✅ Бот #{i+1}: Опубликовано {sent_posts} постов, ошибок: {failed_posts}"
+                else:
+                    result = f"🟢 Бот #{i+1}: Новых постов нет"
+            except VkApiError as e:
+                logger.error(f"Ошибка VK API для бота #{i+1}: {e}")
+                result = f"🔴 Бот #{i+1}: Ошибка VK API"
+            except Exception as e:
+                logger.error(f"Неизвестная ошибка для бота #{i+1}: {e}", exc_info=True)
+                result = f"🔴 Бот #{i+1}: Ошибка"
+        reporter.set(i, result)
+        return result
+
     async def check_now_bot(self, update: Update, context: ContextTypes.DEFAULT_TYPE, bot_index: int):
         """Проверка постов для конкретного бота"""
         user_id = update.effective_user.id
@@ -763,175 +2853,317 @@ class TelegramBot:
             parse_mode='HTML'
         )
         
-        try:
-            last_post_id = self.user_config.get_last_post_id(user_id, bot_index)
-            logger.info(f"Проверка постов для бота #{bot_index+1}, последний ID: {last_post_id}")
-            vk_parser = VKParser(bot['vk_token'], bot['vk_group_id'])
-            posts, new_last_post_id = vk_parser.get_new_posts(last_post_id)
+        # Не проверяем бота, если его уже проверяет автопроверка
+        async with self.scheduler.get_lock(user_id, bot_index):
+            try:
+                last_post_id = self.user_config.get_last_post_id(user_id, bot_index)
+                logger.info(f"Проверка постов для бота #{bot_index+1}, последний ID: {last_post_id}")
+                vk_parser = VKParser(bot['vk_token'], bot['vk_group_id'], self.vk_client)
+                posts, new_last_post_id = await vk_parser.get_new_posts(last_post_id)
             
-            if not posts:
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Проверить снова", callback_data=f'check_now_{bot_index}')],
-                    [InlineKeyboardButton("◀️ Назад", callback_data=f'edit_bot_{bot_index}')]
-                ]
-                await message.edit_text(
-                    f"🟢 <b>Новых постов не найдено для Бота #{bot_index+1}</b>\n\n"
-                    "Все актуальные посты уже опубликованы в вашем канале.\n\n"
-                    f"Последний проверенный ID: <code>{last_post_id}</code>",
-                    reply_markup=InlineKeyboardMarkup(keyboard),
-                    parse_mode='HTML'
-                )
-            else:
-                # Сохраняем новый last_post_id перед отправкой
-                self.user_config.set_last_post_id(user_id, bot_index, new_last_post_id)
-                logger.info(f"Найдено {len(posts)} новых постов для бота #{bot_index+1}, новый последний ID: {new_last_post_id}")
+                if not posts:
+                    keyboard = [
+                        [InlineKeyboardButton("🔄 Проверить снова", callback_data=f'check_now_{bot_index}')],
+                        [InlineKeyboardButton("◀️ Назад", callback_data=f'edit_bot_{bot_index}')]
+                    ]
+                    await message.edit_text(
+                        f"🟢 <b>Новых постов не найдено для Бота #{bot_index+1}</b>\n\n"
+                        "Все актуальные посты уже опубликованы в вашем канале.\n\n"
+                        f"Последний проверенный ID: <code>{last_post_id}</code>",
+                        reply_markup=InlineKeyboardMarkup(keyboard),
+                        parse_mode='HTML'
+                    )
+                else:
+                    # Ставим посты в очередь вместе с новым last_post_id
+                    self.outbox.enqueue(user_id, bot_index, bot['tg_channel'], posts, new_last_post_id)
+                    logger.info(f"Найдено {len(posts)} новых постов для бота #{bot_index+1}, новый последний ID: {new_last_post_id}")
                 
-                # Прогресс-бар отправки
-                total_posts = len(posts)
-                sent_posts = 0
-                failed_posts = 0
+                    # Прогресс-бар отправки (сообщение правится не чаще раза в PROGRESS_EDIT_INTERVAL)
+                    total_posts = len(posts)
+                    reporter = ProgressReporter(message, f"📤 <b>Публикация постов для Бота #{bot_index+1}...</b>")
+                    
+                    async def show_progress(sent_posts: int, failed_posts: int, post_id: int):
+                        reporter.set(
+                            bot_index,
+                            f"⏳ Отправлено: <b>{sent_posts}/{total_posts}</b>\n"
+                            f"❌ Ошибок: <b>{failed_posts}</b>\n"
+                            f"🔄 Обрабатываю пост #{post_id}"
+                        )
+                    
+                    try:
+                        sent_posts, failed_posts = await self._deliver_bot_posts(user_id, bot_index, show_progress)
+                    finally:
+                        await reporter.close()
+                    queued_posts = self.outbox.pending_count(user_id, bot_index)
                 
-                for i, post in enumerate(posts, 1):
+                    keyboard = [
+                        [InlineKeyboardButton("🔄 Проверить снова", callback_data=f'check_now_{bot_index}')],
+                        [InlineKeyboardButton("◀️ Назад", callback_data=f'edit_bot_{bot_index}')]
+                    ]
                     await message.edit_text(
-                        f"📤 <b>Публикация постов для Бота #{bot_index+1}...</b>\n\n"
-                        f"⏳ Отправлено: <b>{sent_posts}/{total_posts}</b>\n"
-                        f"❌ Ошибок: <b>{failed_posts}</b>\n"
-                        f"🔄 Обрабатываю пост #{post['id']}",
+                        f"✅ <b>Готово для Бота #{bot_index+1}!</b>\n\n"
+                        f"Успешно опубликовано: <b>{sent_posts}</b> постов\n"
+                        f"Ошибок: <b>{failed_posts}</b>\n"
+                        f"Ожидают повторной отправки: <b>{queued_posts}</b>\n\n"
+                        f"Канал: <b>{bot['tg_channel']}</b>\n"
+                        f"Последний обработанный ID: <code>{new_last_post_id}</code>",
+                        reply_markup=InlineKeyboardMarkup(keyboard),
                         parse_mode='HTML'
                     )
-                    try:
-                        await self._forward_post(post, bot['tg_bot_token'], bot['tg_channel'], context)
-                        sent_posts += 1
-                        logger.info(f"Пост #{post['id']} успешно отправлен для бота #{bot_index+1}")
-                    except Exception as e:
-                        failed_posts += 1
-                        logger.error(f"Ошибка отправки поста #{post['id']} для бота #{bot_index+1}: {e}")
-                    
-                    await asyncio.sleep(1)  # Задержка между постами
                 
+            except VkApiError as e:
+                logger.error(f"Ошибка VK API для бота #{bot_index+1}: {e}")
                 keyboard = [
-                    [InlineKeyboardButton("🔄 Проверить снова", callback_data=f'check_now_{bot_index}')],
-                    [InlineKeyboardButton("◀️ Назад", callback_data=f'edit_bot_{bot_index}')]
+                    [InlineKeyboardButton("⚙️ Проверить настройки", callback_data=f'edit_bot_{bot_index}')],
+                    [InlineKeyboardButton("❓ Помощь", callback_data='help')],
+                    [InlineKeyboardButton("◀️ Назад", callback_data='manage_bots')]
                 ]
                 await message.edit_text(
-                    f"✅ <b>Готово для Бота #{bot_index+1}!</b>\n\n"
-                    f"Успешно опубликовано: <b>{sent_posts}</b> постов\n"
-                    f"Ошибок: <b>{failed_posts}</b>\n\n"
-                    f"Канал: <b>{bot['tg_channel']}</b>\n"
-                    f"Последний обработанный ID: <code>{new_last_post_id}</code>",
+                    f"🔴 <b>Ошибка VK API для Бота #{bot_index+1}</b>\n\n"
+                    f"<code>{str(e)}</code>\n\n"
+                    "Проверьте правильность токена VK и ID группы.",
+                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    parse_mode='HTML'
+                )
+            except Exception as e:
+                logger.error(f"Неизвестная ошибка для бота #{bot_index+1}: {e}", exc_info=True)
+                keyboard = [
+                    [InlineKeyboardButton("❓ Помощь", callback_data='help')],
+                    [InlineKeyboardButton("◀️ Назад", callback_data='manage_bots')]
+                ]
+                await message.edit_text(
+                    f"🔴 <b>Критическая ошибка для Бота #{bot_index+1}</b>\n\n"
+                    f"<code>{str(e)}</code>\n\n"
+                    "Пожалуйста, попробуйте позже или обратитесь в поддержку.",
                     reply_markup=InlineKeyboardMarkup(keyboard),
                     parse_mode='HTML'
                 )
-                
-        except VkApiError as e:
-            logger.error(f"Ошибка VK API для бота #{bot_index+1}: {e}")
-            keyboard = [
-                [InlineKeyboardButton("⚙️ Проверить настройки", callback_data=f'edit_bot_{bot_index}')],
-                [InlineKeyboardButton("❓ Помощь", callback_data='help')],
-                [InlineKeyboardButton("◀️ Назад", callback_data='manage_bots')]
-            ]
-            await message.edit_text(
-                f"🔴 <b>Ошибка VK API для Бота #{bot_index+1}</b>\n\n"
-                f"<code>{str(e)}</code>\n\n"
-                "Проверьте правильность токена VK и ID группы.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='HTML'
-            )
-        except Exception as e:
-            logger.error(f"Неизвестная ошибка для бота #{bot_index+1}: {e}", exc_info=True)
-            keyboard = [
-                [InlineKeyboardButton("❓ Помощь", callback_data='help')],
-                [InlineKeyboardButton("◀️ Назад", callback_data='manage_bots')]
-            ]
-            await message.edit_text(
-                f"🔴 <b>Критическая ошибка для Бота #{bot_index+1}</b>\n\n"
-                f"<code>{str(e)}</code>\n\n"
-                "Пожалуйста, попробуйте позже или обратитесь в поддержку.",
-                reply_markup=InlineKeyboardMarkup(keyboard),
-                parse_mode='HTML'
-            )
 
     async def check_now(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Красивая страница проверки постов - перенаправляет в новое меню"""
         # Перенаправляем пользователя в новое меню управления ботами
         await self.manage_bots_menu(update, context)
 
-    async def _forward_post(self, post: dict, bot_token: str, channel: str, context: ContextTypes.DEFAULT_TYPE):
-        """Отправка поста через бота пользователя"""
-        try:
-            text = post.get('text', 'Новый пост')
-            
-            # Ограничиваем длину текста до 4096 символов (лимит Telegram)
-            if len(text) > 4096:
-                text = text[:4093] + "..."
-            
-            if post.get('attachments'):
-                media = []
-                for attach in post['attachments']:
-                    if attach['type'] == 'photo':
-                        photo = attach['photo']
-                        sizes = photo['sizes']
-                        max_size = max(sizes, key=lambda x: x['width'] * x['height'])
-                        media.append(max_size['url'])
-                
-                if media:
-                    if len(media) > 1:
-                        await self._send_media_group(text, media, bot_token, channel)
-                    else:
-                        await self._send_photo(text, media[0], bot_token, channel)
-                    return
-            
-            # Если нет вложений или не удалось их обработать
-            if text.strip():  # Отправляем только если есть текст
-                await self._send_message(text, bot_token, channel)
-            
-        except Exception as e:
-            logger.error(f"Ошибка отправки поста: {e}")
+    async def _forward_post(self, post: dict, bot_token: str, channel: str, context: ContextTypes.DEFAULT_TYPE = None):
+        """Отправка поста через бота пользователя. При ошибке Telegram выбрасывает TelegramApiError"""
+        owner_id = post.get('owner_id', 0)
+        if self.ledger.is_delivered(channel, owner_id, post['id']):
+            logger.info(f"Пост #{post['id']} уже опубликован в {channel}, пропускаем")
+            return
+        
+        content = self._convert_attachments(post, PhotoSizePolicy.for_channel(channel))
+        
+        # Текст, не поместившийся в подпись (1024 символа), уходит следующими сообщениями
+        has_media = bool(content['photos'] or content['documents'])
+        chunks = TextRenderer.render(content['text'], TG_CAPTION_LIMIT if has_media else TG_MESSAGE_LIMIT)
+        text, messages = (chunks[0], chunks[1:]) if has_media else ('', chunks)
+        
+        # Части поста по порядку; подпись получает только первая, остальные уходят следом без неё
+        parts = []
+        for media_type, items in (('photo', content['photos']), ('document', content['documents'])):
+            for start in range(0, len(items), MEDIA_GROUP_LIMIT):
+                batch = items[start:start + MEDIA_GROUP_LIMIT]
+                caption = '' if parts else text
+                urls = [url for url, _ in batch]
+                keys = [key for _, key in batch]
+                if len(batch) > 1:
+                    parts.append(lambda caption=caption, urls=urls, keys=keys, media_type=media_type:
+                                 self._send_media_group(caption, urls, bot_token, channel, keys, media_type))
+                elif media_type == 'photo':
+                    parts.append(lambda caption=caption, urls=urls, keys=keys:
+                                 self._send_photo(caption, urls[0], bot_token, channel, keys[0]))
+                else:
+                    parts.append(lambda caption=caption, urls=urls, keys=keys:
+                                 self._send_document(caption, urls[0], bot_token, channel, keys[0]))
+        
+        for message in messages:
+            if message.strip():  # Отправляем только если есть текст
+                parts.append(lambda message=message: self._send_message(message, bot_token, channel))
+        
+        for poll in content['polls']:
+            parts.append(lambda poll=poll: self._send_poll(poll, bot_token, channel))
+        
+        if not parts:
+            return
+        
+        # После ошибки в середине поста повтор продолжает с неотправленной части
+        progress = self.ledger.progress(channel, owner_id, post['id'])
+        message_id = progress['message_id']
+        start = progress['parts_sent']
+        if progress['sending'] is not None and not OUTBOX_RESEND_UNCERTAIN:
+            # Прошлая попытка оборвалась, когда часть могла уже уйти в канал: не дублируем её
+            logger.warning(
+                f"Пост #{post['id']}: неизвестно, опубликована ли часть {progress['sending']+1} из {len(parts)} "
+                f"в {channel}, считаем её отправленной"
+            )
+            start = progress['sending'] + 1
+            self.ledger.part_sent(channel, owner_id, post['id'], progress['sending'], message_id)
+        if start:
+            logger.info(f"Пост #{post['id']}: продолжаем отправку с части {start+1} из {len(parts)}")
+        
+        for index in range(start, len(parts)):
+            # Часть отмечается отправляемой только на время HTTP-запроса: ожидание лимитов
+            # и скачивание файлов ещё ничего не публикуют
+            in_flight = [False]
+
+            def on_request(sending: bool, index=index):
+                in_flight[0] = sending
+                if sending:
+                    self.ledger.part_sending(channel, owner_id, post['id'], index)
+                else:
+                    self.ledger.part_failed(channel, owner_id, post['id'])
+
+            hook = TelegramApiClient.on_request.set(on_request)
+            try:
+                result = await parts[index]()
+            except (TelegramApiError, MediaFetchError, aiohttp.ClientConnectorError):
+                # Telegram ответил ошибкой или запрос до него не дошёл - часть точно не опубликована
+                self.ledger.part_failed(channel, owner_id, post['id'])
+                raise
+            except BaseException:
+                # Отмена или ошибка до запроса - часть не ушла; оборванный запрос мог и дойти
+                if not in_flight[0]:
+                    self.ledger.part_failed(channel, owner_id, post['id'])
+                raise
+            finally:
+                TelegramApiClient.on_request.reset(hook)
+            if message_id is None:
+                message_id = self._message_id(result)
+            if index < len(parts) - 1:
+                self.ledger.part_sent(channel, owner_id, post['id'], index, message_id)
+        
+        self.ledger.record(channel, owner_id, post['id'], message_id)
+
+    @classmethod
+    def _convert_attachments(cls, post: dict, photo_policy: PhotoSizePolicy = None) -> dict:
+        """Разбор поста VK вместе с цепочкой репостов на части для отправки в Telegram.
+        
+        Фото и документы отправляются файлами, опросы - sendPoll, а видео, аудио и ссылки,
+        которые Telegram не может получить по ссылке VK, добавляются в текст.
+        """
+        photo_policy = photo_policy or PhotoSizePolicy()
+        content = {'text': '', 'photos': [], 'documents': [], 'polls': []}
+        texts = []
+        
+        def walk(item: dict):
+            if item.get('text'):
+                texts.append(item['text'])
+            lines = []
+            for attach in item.get('attachments', []):
+                kind = attach.get('type')
+                data = attach.get(kind) or {}
+                if kind == 'photo' and data.get('sizes'):
+                    size = photo_policy.select(data['sizes'])
+                    content['photos'].append((size['url'], cls._media_key(data, size['url'])))
+                elif kind == 'doc' and data.get('url'):
+                    key = f"doc{data['owner_id']}_{data['id']}" if 'owner_id' in data and 'id' in data else None
+                    content['documents'].append((data['url'], key))
+                elif kind == 'video':
+                    title = data.get('title') or 'Видео'
+                    lines.append(f"🎬 {title}: https://vk.com/video{data.get('owner_id')}_{data.get('id')}")
+                elif kind == 'audio':
+                    lines.append(f"🎵 {data.get('artist', '')} — {data.get('title', '')}".strip(' —'))
+                elif kind == 'link' and data.get('url'):
+                    title = data.get('title')
+                    lines.append(f"🔗 {title}: {data['url']}" if title else f"🔗 {data['url']}")
+                elif kind == 'poll' and len(data.get('answers', [])) >= 2:
+                    content['polls'].append(data)
+            if lines:
+                texts.append('\n'.join(lines))
+            # Репост: copy_history содержит исходный пост и, если он сам репост, всю цепочку
+            for repost in item.get('copy_history', []):
+                walk(repost)
+        
+        walk(post)
+        content['text'] = '\n\n'.join(texts) if texts else post.get('text', 'Новый пост')
+        return content
+
+    @staticmethod
+    def _media_key(photo: dict, url: str) -> str:
+        """Ключ фото для кэша file_id: id фото в VK, а если его нет - хеш ссылки"""
+        if 'owner_id' in photo and 'id' in photo:
+            return f"photo{photo['owner_id']}_{photo['id']}"
+        return 'url:' + hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+
+    @staticmethod
+    def _media_file_ids(result: dict) -> list:
+        """file_id каждого отправленного файла (для фото - самого большого размера) из ответа Bot API"""
+        messages = result.get('result')
+        if not isinstance(messages, list):
+            messages = [messages]
+        file_ids = []
+        for message in messages:
+            message = message if isinstance(message, dict) else {}
+            if message.get('photo'):
+                file_ids.append(message['photo'][-1]['file_id'])
+            else:
+                media = message.get('document') or message.get('animation') or message.get('video') or {}
+                file_ids.append(media.get('file_id'))
+        return file_ids
+
+    @staticmethod
+    def _message_id(result: dict):
+        """message_id из ответа Bot API (для медиагруппы - первого сообщения)"""
+        message = result.get('result')
+        if isinstance(message, list):
+            message = message[0] if message else None
+        return message.get('message_id') if isinstance(message, dict) else None
 
     async def _send_message(self, text: str, bot_token: str, channel: str):
         """Отправка текстового сообщения"""
-        url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
         payload = {
             'chat_id': channel,
             'text': text,
             'parse_mode': 'HTML'
         }
-        response = requests.post(url, json=payload)
-        if response.status_code != 200:
-            logger.error(f"Ошибка отправки сообщения: {response.text}")
-        return response
-
-    async def _send_photo(self, text: str, photo_url: str, bot_token: str, channel: str):
-        """Отправка фото"""
-        # Ограничиваем длину текста для подписи (лимит 1024 символа)
-        if len(text) > 1024:
-            text = text[:1021] + "..."
-            
-        url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+        result = await self.tg_client.call(bot_token, 'sendMessage', payload)
+        if not result.get('ok'):
+            logger.error(f"Ошибка отправки сообщения: {result}")
+            raise TelegramApiError('sendMessage', result)
+        return result
+
+    async def _send_poll(self, poll: dict, bot_token: str, channel: str):
+        """Отправка опроса (обрезается до лимитов Telegram: вопрос 300 символов, 10 вариантов по 100)"""
+        payload = {
+            'chat_id': channel,
+            'question': poll.get('question', '')[:300] or 'Опрос',
+            'options': [{'text': answer['text'][:100]} for answer in poll['answers'][:10]],
+            'allows_multiple_answers': bool(poll.get('multiple'))
+        }
+        result = await self.tg_client.call(bot_token, 'sendPoll', payload)
+        if not result.get('ok'):
+            logger.error(f"Ошибка отправки опроса: {result}")
+            raise TelegramApiError('sendPoll', result)
+        return result
+
+    async def _send_photo(self, text: str, photo_url: str, bot_token: str, channel: str, media_key: str = None):
+        """Отправка фото (text - готовый HTML не длиннее TG_CAPTION_LIMIT)"""
         payload = {
             'chat_id': channel,
             'photo': photo_url,
             'caption': text,
             'parse_mode': 'HTML'
         }
-        response = requests.post(url, json=payload)
-        if response.status_code != 200:
-            logger.error(f"Ошибка отправки фото: {response.text}")
-        return response
+        return await self._send_media(bot_token, 'sendPhoto', payload, [photo_url], "фото", [media_key])
 
-    async def _send_media_group(self, text: str, media_urls: list, bot_token: str, channel: str):
-        """Отправка медиагруппы"""
-        url = f"https://api.telegram.org/bot{bot_token}/sendMediaGroup"
-        
-        # Ограничиваем длину текста для подписи (лимит 1024 символа)
-        if len(text) > 1024:
-            text = text[:1021] + "..."
-        
-        # Ограничиваем количество медиа в группе до 10 (лимит Telegram)
-        media_urls = media_urls[:10]
+    async def _send_document(self, text: str, document_url: str, bot_token: str, channel: str, media_key: str = None):
+        """Отправка документа (text - готовый HTML не длиннее TG_CAPTION_LIMIT)"""
+        payload = {
+            'chat_id': channel,
+            'document': document_url,
+            'caption': text,
+            'parse_mode': 'HTML'
+        }
+        return await self._send_media(bot_token, 'sendDocument', payload, [document_url], "документа", [media_key])
+
+    async def _send_media_group(self, text: str, media_urls: list, bot_token: str, channel: str,
+                                media_keys: list = None, media_type: str = 'photo'):
+        """Отправка медиагруппы (до MEDIA_GROUP_LIMIT фото или документов)"""
+        media_urls = media_urls[:MEDIA_GROUP_LIMIT]
+        media_keys = (media_keys or [None] * len(media_urls))[:MEDIA_GROUP_LIMIT]
         
         media = [{
-            'type': 'photo',
+            'type': media_type,
             'media': url,
             'caption': text if i == 0 else '',
             'parse_mode': 'HTML'
@@ -941,70 +3173,641 @@ class TelegramBot:
             'chat_id': channel,
             'media': media  # Передаем список напрямую, а не как JSON строку
         }
-        response = requests.post(url, json=payload)
-        if response.status_code != 200:
-            logger.error(f"Ошибка отправки медиагруппы: {response.text}")
-        return response
+        return await self._send_media(bot_token, 'sendMediaGroup', payload, media_urls, "медиагруппы", media_keys)
+
+    @staticmethod
+    def _media_field(method: str) -> str:
+        """Поле запроса с файлом: sendPhoto -> photo, sendDocument -> document"""
+        return method[len('send'):].lower()
+
+    @classmethod
+    def _with_media(cls, method: str, payload: dict, sources: list) -> dict:
+        """Копия запроса с подставленными источниками файлов (ссылки, file_id или attach://)"""
+        payload = dict(payload)
+        if method == 'sendMediaGroup':
+            payload['media'] = [dict(item, media=source) for item, source in zip(payload['media'], sources)]
+        else:
+            payload[cls._media_field(method)] = sources[0]
+        return payload
+
+    @staticmethod
+    def _max_upload_size(method: str, payload: dict) -> int:
+        """Лимит Telegram на размер загружаемого файла"""
+        if method == 'sendPhoto' or (method == 'sendMediaGroup' and payload['media'][0]['type'] == 'photo'):
+            return MEDIA_MAX_FILE_SIZE
+        return MEDIA_MAX_DOCUMENT_SIZE
+
+    async def _send_media(self, bot_token: str, method: str, payload: dict, media_urls: list, label: str,
+                          media_keys: list = None) -> dict:
+        """Отправка файлов: сначала по file_id из кэша, затем по ссылкам VK, затем загрузкой"""
+        media_keys = media_keys or [None] * len(media_urls)
+        bot_id = MediaCache.bot_id(bot_token)
+        
+        cached = [self.media_cache.get(key, bot_id) if key else None for key in media_keys]
+        result = None
+        if any(cached):
+            sources = [entry[0] if entry else url for entry, url in zip(cached, media_urls)]
+            result = await self.tg_client.call(bot_token, method, self._with_media(method, payload, sources))
+            if not result.get('ok'):
+                error = TelegramApiError(method, result)
+                if not error.url_fetch_failed:
+                    logger.error(f"Ошибка отправки {label}: {result}")
+                    raise error
+                # Telegram не принял file_id (например, чужого бота) - забываем его и отправляем по ссылкам
+                logger.warning(f"Telegram не принял file_id из кэша ({error.description}), отправляем по ссылкам")
+                for key, entry in zip(media_keys, cached):
+                    if entry and entry[1]:
+                        self.media_cache.forget(key, bot_id)
+                result = None
+        
+        if result is None:
+            result = await self._send_media_by_url(bot_token, method, payload, media_urls, label)
+        
+        for key, entry, file_id in zip(media_keys, cached, self._media_file_ids(result)):
+            if key and file_id and not (entry and entry[1] and entry[0] == file_id):
+                self.media_cache.put(key, bot_id, file_id)
+        return result
+
+    async def _send_media_by_url(self, bot_token: str, method: str, payload: dict, media_urls: list, label: str) -> dict:
+        """Отправка файлов по ссылкам VK; если Telegram не смог их скачать - скачиваем сами и загружаем"""
+        result = await self.tg_client.call(bot_token, method, payload)
+        if result.get('ok'):
+            return result
+        
+        error = TelegramApiError(method, result)
+        if not (MEDIA_UPLOAD_FALLBACK and error.url_fetch_failed):
+            logger.error(f"Ошибка отправки {label}: {result}")
+            raise error
+        
+        logger.warning(f"Telegram не смог скачать файл по ссылке ({error.description}), загружаем сами")
+        async with self.media_fetcher.fetched(media_urls, self._max_upload_size(method, payload)) as files:
+            if method == 'sendMediaGroup':
+                names = [f'file{i}' for i in range(len(files))]
+                upload_payload = self._with_media(method, payload, [f'attach://{name}' for name in names])
+                upload_files = dict(zip(names, files))
+            else:
+                field = self._media_field(method)
+                upload_payload = dict(payload)
+                upload_payload.pop(field)
+                upload_files = {field: files[0]}
+            result = await self.tg_client.call(bot_token, method, upload_payload, files=upload_files)
+        
+        if not result.get('ok'):
+            logger.error(f"Ошибка отправки {label} файлами: {result}")
+            raise TelegramApiError(method, result)
+        return result
 
     async def _auto_check_posts(self, context: ContextTypes.DEFAULT_TYPE):
         """Автоматическая проверка постов для всех ботов"""
-        # Получаем всех пользователей из базы данных
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute('SELECT user_id, data FROM users')
-        users = cursor.fetchall()
-        conn.close()
-        
-        # Проверяем каждого пользователя
-        for user_row in users:
-            user_id = user_row[0]
-            user_data = json.loads(user_row[1]) if user_row[1] else {}
+        async def check_group(group_id: str, group_sources: list, items: list):
+            return await self._check_group(group_id, group_sources, context, items)
+        
+        self._sync_database()
+        sources = self._get_sources()
+        if self.leases is not None:
+            # Без продлённой аренды шарды уже могут опрашивать другие воркеры
+            if not self._lease_valid():
+                self._sync_long_polls({})
+                return
+            sources = self._shard_sources(sources)
+        
+        # Группы пересобираются, только когда сменился список источников (раз в SOURCES_REFRESH_INTERVAL)
+        groups = self.scheduler.update_sources(sources)
+        if VK_LONG_POLL and groups is not self.long_poll_groups:
+            self._sync_long_polls(groups)
+        
+        prefetch = self._prefetch_walls if VK_BATCH_POLLING else None
+        await self.scheduler.run_pass(sources, check_group, prefetch)
+
+    def _lease_valid(self) -> bool:
+        """Аренда шардов продлена вовремя (процесс без аренды опрашивает все группы)"""
+        if self.leases is None:
+            return True
+        return self.lease_renewed_at is not None and time.monotonic() - self.lease_renewed_at <= LEASE_TTL
+
+    def _shard_sources(self, sources: list) -> list:
+        """Источники шардов этого воркера; пересобираются, только если сменились источники или шарды"""
+        cached = self.shard_sources
+        if cached is None or cached[0] is not sources or cached[1] is not self.shards:
+            owned = [
+                source for source in sources
+                if ShardLeases.shard_of(source[2]['vk_group_id'], self.leases.shards) in self.shards
+            ]
+            self.shard_sources = cached = (sources, self.shards, owned)
+        return cached[2]
+
+    def _sync_long_polls(self, groups: dict):
+        """Запуск long poll для новых групп и остановка для групп, которых больше нет в опросе"""
+        self.long_poll_groups = groups
+        now = time.monotonic()
+        for group_id in list(self.long_polls):
+            if group_id not in groups:
+                self.long_polls.pop(group_id).cancel()
+                self.scheduler.pushed.discard(group_id)
+        for group_id in groups:
+            if group_id in self.long_polls or not group_id.lstrip('-').isdigit():
+                continue
+            failed_at = self.long_poll_failed.get(group_id)
+            if failed_at is not None and now - failed_at < VK_LONG_POLL_RETRY:
+                continue
+            self.long_polls[group_id] = asyncio.create_task(self._long_poll_group(group_id, groups[group_id]))
+
+    def _current_group_sources(self, group_id: str) -> list:
+        """Подписанные на группу боты по последнему списку источников"""
+        return [source for source in self.sources if str(source[2]['vk_group_id']) == group_id]
+
+    async def _long_poll_group(self, group_id: str, sources: list):
+        """Получение постов группы через long poll; группа без доступа остаётся на опросе wall.get"""
+        async def on_posts(posts):
+            await self._ingest_pushed_posts(group_id, posts)
+        
+        try:
+            tokens = list(dict.fromkeys(bot['vk_token'] for _, _, bot in sources))
+            for token in tokens:
+                long_poll = VKLongPoll(self.vk_client, token, group_id, on_posts)
+                try:
+                    server = await long_poll.connect()
+                except VkApiError:
+                    continue
+                break
+            else:
+                # Ни один токен не подходит (обычно это токены пользователей) - остаёмся на wall.get
+                self.long_poll_failed[group_id] = time.monotonic()
+                return
+            
+            logger.info(f"Группа {group_id}: новые посты приходят через long poll")
+            self.scheduler.pushed.add(group_id)
+            while True:
+                try:
+                    try:
+                        await long_poll.run(server)
+                    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                        logger.warning(f"Ошибка long poll группы {group_id}, переподключаемся: {e}")
+                        await asyncio.sleep(VK_LONG_POLL_ERROR_DELAY)
+                        server = await long_poll.connect()
+                        # Пока соединения не было, посты могли выйти - перечитываем стену
+                        await self._ingest_pushed_posts(group_id, None)
+                except VkApiError as e:
+                    logger.warning(f"Long poll группы {group_id} больше недоступен, возвращаемся к wall.get: {e}")
+                    self.long_poll_failed[group_id] = time.monotonic()
+                    return
+                except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                    logger.warning(f"Не удалось переподключить long poll группы {group_id}: {e}")
+        finally:
+            self.scheduler.pushed.discard(group_id)
+            if self.long_polls.get(group_id) is asyncio.current_task():
+                del self.long_polls[group_id]
+                # Задача завершилась сама - на следующем тике группы сверяются заново
+                self.long_poll_groups = None
+
+    async def _ingest_pushed_posts(self, group_id: str, posts: list = None):
+        """Пересылка постов из long poll тем же путём, что и при опросе.
+        
+        Если посты идут не сразу за курсорами ботов (или события потеряны, posts=None),
+        стена перечитывается через wall.get, чтобы не пропустить посты между ними.
+        """
+        sources = self._current_group_sources(group_id)
+        if not sources or not self._lease_valid():
+            # Аренда просрочена: группу уже может вести другой воркер, он и перечитает стену
+            return
+        items = None
+        if posts:
+            min_cursor = min(self.user_config.get_last_post_id(user_id, bot_index) for user_id, bot_index, _ in sources)
+            if min_cursor and min(post['id'] for post in posts) <= min_cursor + 1:
+                items = posts
+        
+        async def check_group(group_id: str, group_sources: list, items: list):
+            return await self._check_group(group_id, group_sources, None, items)
+        
+        await self.scheduler.run_group(group_id, sources, check_group, items)
+
+    def _sync_database(self):
+        """Подхватить изменения, сделанные другими процессами: настройки ботов и журнал публикаций"""
+        self.user_config.sync()
+        self.ledger.sync()
+
+    def _get_sources(self) -> list:
+        """Список полностью настроенных ботов, перечитывается из базы раз в SOURCES_REFRESH_INTERVAL"""
+        now = time.monotonic()
+        if self.sources_loaded_at is None or now - self.sources_loaded_at >= SOURCES_REFRESH_INTERVAL:
+            self.sources = self.user_config.get_active_bots()
+            self.sources_loaded_at = now
+        return self.sources
+
+    def _invalidate_sources(self):
+        """Перечитать список ботов на следующем тике планировщика (после изменения настроек)"""
+        self.sources_loaded_at = None
+
+    async def _prefetch_walls(self, groups: dict) -> dict:
+        """Пакетная загрузка стен: группы с общим токеном запрашиваются через execute по 25 штук"""
+        by_token = {}
+        for group_id, sources in groups.items():
+            if group_id.lstrip('-').isdigit():
+                by_token.setdefault(sources[0][2]['vk_token'], []).append(group_id)
+        
+        batches = []
+        for token, group_ids in by_token.items():
+            # Одну группу выгоднее запросить обычным wall.get с перебором токенов
+            if len(group_ids) < 2:
+                continue
+            for i in range(0, len(group_ids), VK_EXECUTE_BATCH):
+                batches.append((token, group_ids[i:i + VK_EXECUTE_BATCH]))
+        
+        walls = {}
+        
+        async def run_batch(token: str, group_ids: list):
+            async with self.scheduler.semaphore:
+                try:
+                    walls.update(await VKParser.fetch_walls(self.vk_client, token, group_ids))
+                except VkApiError as e:
+                    logger.error(f"Ошибка VK API в пакетном запросе ({len(group_ids)} групп): {e}")
+                except Exception as e:
+                    # Группы без результата будут запрошены по отдельности
+                    logger.error(f"Ошибка пакетного запроса ({len(group_ids)} групп): {e}")
+        
+        await asyncio.gather(*(run_batch(token, group_ids) for token, group_ids in batches))
+        if batches:
+            logger.info(f"Пакетный опрос: {len(walls)} групп загружено за {len(batches)} запросов execute")
+        return walls
+
+    async def _fetch_group_posts(self, group_id: str, sources: list, last_checked_id: int,
+                                 first_page: list = None) -> tuple[list, list]:
+        """Загрузка постов группы токенами подписчиков (VKParser.fetch_pages).
+        
+        Стена читается первым токеном, который сработал. Посты достаются только источникам,
+        чей собственный токен читает группу: для остальных токенов доступ подтверждается
+        проверкой CredentialValidator (её результат кэшируется). Источники с отклонённым
+        токеном помечаются в failed_sources, источники с сетевой или временной ошибкой VK
+        ждут следующей проверки.
+        Возвращает (посты, источники, которым их можно отдать).
+        """
+        by_token = {}
+        for source in sources:
+            by_token.setdefault(source[2]['vk_token'], []).append(source)
+        
+        posts = None
+        readable = []
+        for i, (token, token_sources) in enumerate(by_token.items()):
+            try:
+                if posts is None:
+                    parser = VKParser(token, group_id, self.vk_client)
+                    posts = await parser.fetch_pages(last_checked_id, first_page if i == 0 else None)
+                    error = None
+                else:
+                    error = await self.validator.check_vk_group(token, group_id)
+            except VKMethodError as e:
+                if not e.permanent:
+                    logger.error(f"Временная ошибка VK при чтении группы {group_id} (токен {i+1} из {len(by_token)}): {e}")
+                    continue
+                error = str(e)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                logger.error(f"Ошибка сети при чтении группы {group_id} (токен {i+1} из {len(by_token)}): {e}")
+                continue
+            
+            for user_id, bot_index, _ in token_sources:
+                if error is None:
+                    self.failed_sources.pop((user_id, bot_index), None)
+                else:
+                    self.failed_sources[(user_id, bot_index)] = error
+            if error is None:
+                readable.extend(token_sources)
+            else:
+                logger.error(f"Токен VK не читает группу {group_id} (ботов: {len(token_sources)}): {error}")
+        return posts or [], readable
+
+    async def _check_group(self, group_id: str, sources: list, context: ContextTypes.DEFAULT_TYPE,
+                           items: list = None) -> list:
+        """Проверка одной группы VK и пересылка новых постов всем подписанным ботам.
+        
+        items - уже загруженные посты стены (пакетный опрос), иначе стена запрашивается здесь.
+        Возвращает новые посты группы (для оценки частоты публикаций).
+        """
+        cursors = {
+            (user_id, bot_index): self.user_config.get_last_post_id(user_id, bot_index)
+            for user_id, bot_index, _ in sources
+        }
+        # Стена догружается до самого старого курсора; новым подписчикам (курсор 0)
+        # хватает первой страницы, поэтому они не ограничивают догрузку остальных
+        floor = min([cursor for cursor in cursors.values() if cursor] or [0])
+        logger.info(f"Проверяем посты группы {group_id} для ботов: {len(sources)}")
+        wall, sources = await self._fetch_group_posts(group_id, sources, floor, items)
+        posts, _ = VKParser.filter_new_posts(wall, floor)
+        if not posts and all(cursors[(user_id, bot_index)] for user_id, bot_index, _ in sources):
+            return posts
+        POSTS_FETCHED.inc(len(posts))
+        
+        def enqueue(user_id: int, bot_index: int, bot: dict):
+            bot_posts, new_last_post_id = VKParser.filter_new_posts(wall, cursors[(user_id, bot_index)])
+            if not bot_posts:
+                return
+            
+            logger.info(f"Найдено {len(bot_posts)} новых постов для пользователя {user_id}, бот #{bot_index+1}")
+            # Посты и новый last_post_id сохраняются вместе, отправкой занимаются воркеры очереди
+            self.outbox.enqueue(user_id, bot_index, bot['tg_channel'], bot_posts, new_last_post_id)
+        
+        for user_id, bot_index, bot in sources:
+            enqueue(user_id, bot_index, bot)
+        self.delivery_event.set()
+        return posts
+
+    async def _deliver(self, row: dict) -> bool:
+        """Отправка одной записи очереди. Возвращает True, если пост опубликован"""
+        self._sync_database()
+        bot = self.user_config.get_bot(row['user_id'], row['slot'])
+        if not all(bot.get(key) for key in BOT_SETTINGS):
+            self.outbox.mark_failed(row, "Бот удалён или настроен не полностью", permanent=True)
+            return False
+        
+        try:
+            await self._forward_post(row['post'], bot['tg_bot_token'], bot['tg_channel'])
+        except asyncio.CancelledError:
+            self.outbox.release(row['id'])
+            raise
+        except Exception as e:
+            permanent = isinstance(e, TelegramApiError) and e.permanent
+            dead = self.outbox.mark_failed(row, str(e), permanent)
+            (POSTS_FAILED if dead else POSTS_RETRIED).inc()
+            logger.error(
+                f"Ошибка отправки поста #{row['post_id']} для пользователя {row['user_id']}, "
+                f"бот #{row['slot']+1} (попытка {row['attempts']+1}): {e}"
+                + (". Пост перемещён в dead-letter" if dead else "")
+            )
+            return False
+        
+        self.outbox.mark_delivered(row['id'])
+        POSTS_SENT.inc()
+        logger.info(f"Пост #{row['post_id']} успешно отправлен для пользователя {row['user_id']}, бот #{row['slot']+1}")
+        return True
+
+    async def _deliver_bot_posts(self, user_id: int, bot_index: int, on_progress=None) -> tuple[int, int]:
+        """Немедленная отправка очереди одного бота (ручная проверка). Возвращает (отправлено, ошибок)"""
+        sent_posts = 0
+        failed_posts = 0
+        while True:
+            row = self.outbox.claim(user_id, bot_index)
+            if row is None:
+                return sent_posts, failed_posts
+            if on_progress is not None:
+                await on_progress(sent_posts, failed_posts, row['post_id'])
+            if await self._deliver(row):
+                sent_posts += 1
+            else:
+                failed_posts += 1
+
+    async def _delivery_worker(self):
+        """Воркер очереди отправки: берёт посты по порядку внутри каждого канала"""
+        while True:
+            try:
+                row = self.outbox.claim()
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка чтения очереди отправки: {e}")
+                row = None
             
-            # Получаем все боты пользователя
-            bots = user_data.get('bots', [])
+            if row is None:
+                self.delivery_event.clear()
+                try:
+                    await asyncio.wait_for(self.delivery_event.wait(), OUTBOX_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
             
-            # Проверяем каждый бот пользователя
-            for bot_index, bot in enumerate(bots):
-                if bot and all(k in bot for k in ['vk_token', 'vk_group_id', 'tg_bot_token', 'tg_channel']):
+            try:
+                await self._deliver(row)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи статуса отправки поста #{row['post_id']}: {e}")
+
+    async def _purge_ledger(self, context: ContextTypes.DEFAULT_TYPE):
+        """Удаление старых записей журнала опубликованных постов"""
+        deleted = self.ledger.purge()
+        if deleted:
+            logger.info(f"Удалено устаревших записей журнала публикаций: {deleted}")
+
+    async def _requeue_stale_posts(self, context: ContextTypes.DEFAULT_TYPE):
+        """Возврат в очередь постов, отправка которых оборвалась (например, при падении процесса)"""
+        requeued = self.outbox.requeue_stale()
+        if requeued:
+            logger.warning(f"Возвращено в очередь зависших отправок: {requeued}")
+            self.delivery_event.set()
+
+    async def _renew_leases(self, context: ContextTypes.DEFAULT_TYPE = None):
+        """Heartbeat воркера: продление аренды шардов и перераспределение их между воркерами"""
+        try:
+            shards = self.leases.heartbeat()
+        except sqlite3.Error as e:
+            logger.error(f"Не удалось продлить аренду шардов: {e}")
+            return
+        self.lease_renewed_at = time.monotonic()
+        if shards != self.shards:
+            logger.info(f"Воркер {self.leases.worker_id}: шардов {len(shards)} из {self.leases.shards}")
+            self.shards = shards
+
+    def _collect_metrics(self):
+        """Метрики, которые считаются при запросе /metrics"""
+        for status, count in self.outbox.status_counts().items():
+            OUTBOX_ROWS.set(count, status=status)
+        # Метки пересобираются при каждом запросе, поэтому удалённые боты из метрик пропадают
+        now = time.time()
+        oldest = self.outbox.oldest_pending()
+        SOURCE_LAG_SECONDS.clear()
+        SOURCE_VK_FAILED.clear()
+        for user_id, slot, _ in self.user_config.get_active_bots():
+            created = oldest.get((user_id, slot))
+            SOURCE_LAG_SECONDS.set(max(0.0, now - created) if created else 0.0, user_id=user_id, slot=slot)
+            if (user_id, slot) in self.failed_sources:
+                SOURCE_VK_FAILED.set(1, user_id=user_id, slot=slot)
+
+    async def start_services(self, delivery: bool = True):
+        """Запуск HTTP-клиентов, сервера метрик и воркеров очереди отправки (не зависит от Application)"""
+        # Бот создаётся в main() до asyncio.run, а в Python 3.9 примитивы asyncio привязываются
+        # к циклу событий при создании, поэтому они создаются заново в цикле, где работают сервисы
+        self.delivery_event = asyncio.Event()
+        self.scheduler.init_primitives()
+        self.media_fetcher.init_primitives()
+        await self.metrics_server.start()
+        await self.vk_client.start()
+        await self.tg_client.start()
+        await self.media_fetcher.start()
+        if delivery:
+            self.outbox.requeue_stale()
+            self.delivery_tasks = [asyncio.create_task(self._delivery_worker()) for _ in range(OUTBOX_WORKERS)]
+
+    async def stop_services(self):
+        """Остановка воркеров очереди и long poll, закрытие HTTP-сессий и базы"""
+        tasks = self.delivery_tasks + list(self.long_polls.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.delivery_tasks = []
+        self.long_polls = {}
+        self.long_poll_groups = None
+        await self.tg_client.close()
+        await self.vk_client.close()
+        await self.media_fetcher.close()
+        await self.validator.close()
+        await self.metrics_server.stop()
+        stats = self.user_config.cache_stats()
+        logger.info(f"Кэш пользователей: попаданий {stats['hits']}, промахов {stats['misses']}")
+        self.user_config.close()
+
+    async def _post_init(self, application: Application):
+        """Запуск сервисов вместе с приложением (в роли ui посты отправляют воркеры)"""
+        await self.start_services(delivery=self.role == 'all')
+
+    async def _post_shutdown(self, application: Application):
+        """Остановка сервисов при остановке приложения"""
+        await self.stop_services()
+
+    @staticmethod
+    async def _run_periodic(job, interval: float, first: float = 0.0):
+        """Периодический запуск задачи без JobQueue (режим воркера)"""
+        await asyncio.sleep(first)
+        while True:
+            try:
+                await job(None)
+            except Exception as e:
+                logger.error(f"Ошибка фоновой задачи {job.__name__}: {e}", exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def _run_worker(self, worker_id: str):
+        """Воркер: опрос своих шардов групп VK и отправка очереди, без интерфейса бота"""
+        self.leases = ShardLeases(self.user_config, worker_id)
+        await self.start_services()
+        
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        
+        tasks = [
+            asyncio.create_task(self._run_periodic(self._renew_leases, LEASE_HEARTBEAT_INTERVAL)),
+            asyncio.create_task(self._run_periodic(self._auto_check_posts, SCHEDULER_TICK, first=1.0)),
+            asyncio.create_task(self._run_periodic(self._requeue_stale_posts, OUTBOX_CLAIM_TIMEOUT, OUTBOX_CLAIM_TIMEOUT)),
+            asyncio.create_task(self._run_periodic(self._purge_ledger, LEDGER_PURGE_INTERVAL, first=60.0)),
+        ]
+        logger.info(f"Воркер {worker_id} запущен")
+        try:
+            await stop.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.leases.release()
+            await self.stop_services()
+            logger.info(f"Воркер {worker_id} остановлен")
+
+    def run_worker(self, worker_id: str = None):
+        """Запуск процесса-воркера (python Bot.py --role worker)"""
+        self.role = 'worker'
+        asyncio.run(self._run_worker(worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"))
+
+    async def _sync_user_config(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Перед каждым обновлением подхватываем изменения, сделанные другими репликами интерфейса"""
+        self.user_config.sync()
+
+    async def _run_webhook(self, application: Application, webhook_url: str, port: int,
+                           secret: str = WEBHOOK_SECRET, stop: asyncio.Event = None):
+        """Работа интерфейса через webhook: обновления приходят на встроенный HTTP-сервер.
+        
+        stop - событие остановки; по умолчанию процесс останавливается по SIGINT/SIGTERM.
+        """
+        server = WebhookServer(application, port=port, secret=secret)
+        if stop is None:
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(signum, stop.set)
+        
+        async with application:
+            await self._post_init(application)
+            await application.start()
+            await server.start()
+            try:
+                if WEBHOOK_SET:
                     try:
-                        logger.info(f"Проверяем посты для пользователя {user_id}, бот #{bot_index+1}")
-                        last_post_id = self.user_config.get_last_post_id(user_id, bot_index)
-                        vk_parser = VKParser(bot['vk_token'], bot['vk_group_id'])
-                        posts, new_last_post_id = vk_parser.get_new_posts(last_post_id)
-                        
-                        if posts:
-                            logger.info(f"Найдено {len(posts)} новых постов для пользователя {user_id}, бот #{bot_index+1}")
-                            # Сохраняем новый last_post_id перед отправкой
-                            self.user_config.set_last_post_id(user_id, bot_index, new_last_post_id)
-                            
-                            for post in posts:
-                                await self._forward_post(post, bot['tg_bot_token'], bot['tg_channel'], context)
-                                await asyncio.sleep(1)  # Задержка между постами
-                            
-                    except VkApiError as e:
-                        logger.error(f"Ошибка VK API для пользователя {user_id}, бот #{bot_index+1}: {e}")
+                        await application.bot.set_webhook(
+                            webhook_url,
+                            secret_token=secret,
+                            allowed_updates=Update.ALL_TYPES
+                        )
                     except Exception as e:
-                        logger.error(f"Неизвестная ошибка для пользователя {user_id}, бот #{bot_index+1}: {e}", exc_info=True)
+                        logger.error(f"Не удалось зарегистрировать webhook {webhook_url}: {e}")
+                await stop.wait()
+            finally:
+                await server.stop()
+                await application.stop()
+                await self._post_shutdown(application)
 
-    def run(self):
-        """Запуск бота"""
-        application = Application.builder().token(self.token).build()
+    def build_application(self, role: str = 'all', webhook: bool = False) -> Application:
+        """Application с обработчиками интерфейса; Bot API - по адресу tg_client.api_url"""
+        self.role = role
+        builder = (
+            Application.builder()
+            .token(self.token)
+            .base_url(f"{self.tg_client.api_url}/bot")
+            .base_file_url(f"{self.tg_client.api_url}/file/bot")
+            .post_init(self._post_init)
+            .post_shutdown(self._post_shutdown)
+        )
+        if webhook:
+            builder = builder.updater(None)
+        application = builder.build()
         
         # Добавляем обработчики
+        application.add_handler(TypeHandler(Update, self._sync_user_config), group=-1)
         application.add_handler(CommandHandler("start", self.start))
         application.add_handler(CallbackQueryHandler(self.button_handler))
         application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         
-        # Автопроверка новых постов
         job_queue = application.job_queue
-        job_queue.run_repeating(
-            self._auto_check_posts,
-            interval=33.0,  # Проверка каждые 5 минут
-            first=10.0
-        )
-        
-        application.run_polling()
+        if role == 'all':
+            # Автопроверка новых постов (в роли ui этим занимаются воркеры)
+            job_queue.run_repeating(
+                self._auto_check_posts,
+                interval=SCHEDULER_TICK,  # Интервал каждой группы подбирается отдельно (PollState)
+                first=10.0
+            )
+            job_queue.run_repeating(self._requeue_stale_posts, interval=OUTBOX_CLAIM_TIMEOUT)
+            job_queue.run_repeating(self._purge_ledger, interval=LEDGER_PURGE_INTERVAL, first=60.0)
+        return application
 
-if __name__ == '__main__':
+    def run(self, role: str = 'all', webhook_url: str = WEBHOOK_URL, webhook_port: int = WEBHOOK_PORT):
+        """Запуск бота. role='all' - интерфейс и опрос в одном процессе, 'ui' - только интерфейс.
+        
+        Если задан webhook_url, обновления принимаются встроенным HTTP-сервером, иначе - long polling.
+        """
+        application = self.build_application(role, webhook=bool(webhook_url))
+        if webhook_url:
+            asyncio.run(self._run_webhook(application, webhook_url, webhook_port))
+        else:
+            application.run_polling()
+
+def main():
+    parser = argparse.ArgumentParser(description="Репост постов из групп VK в каналы Telegram")
+    parser.add_argument(
+        '--role', choices=('all', 'ui', 'worker'), default='all',
+        help="all - всё в одном процессе (по умолчанию), ui - только интерфейс бота, "
+             "worker - опрос VK и отправка постов (можно запустить несколько)"
+    )
+    parser.add_argument('--worker-id', help="имя воркера (по умолчанию хост, pid и случайный суффикс)")
+    parser.add_argument(
+        '--metrics-port', type=int, default=METRICS_PORT,
+        help=f"порт HTTP-сервера метрик (по умолчанию {METRICS_PORT}, 0 - отключить); у каждого процесса свой"
+    )
+    parser.add_argument(
+        '--webhook-url', default=WEBHOOK_URL,
+        help="публичный адрес webhook; если задан, интерфейс получает обновления через webhook, а не long polling"
+    )
+    parser.add_argument('--webhook-port', type=int, default=WEBHOOK_PORT, help="порт встроенного сервера webhook")
+    args = parser.parse_args()
+    if args.webhook_url and args.role != 'worker' and not WEBHOOK_SECRET:
+        parser.error("для работы через webhook задайте WEBHOOK_SECRET в Bot.py")
+    
     bot = TelegramBot(BOT_TOKEN)
-    bot.run()
+    bot.metrics_server.port = args.metrics_port
+    if args.role == 'worker':
+        bot.run_worker(args.worker_id)
+    else:
+        bot.run(args.role, args.webhook_url, args.webhook_port)
+
+if __name__ == '__main__':
+    main()
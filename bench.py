@@ -0,0 +1,568 @@
+"""Бенчмарки для Bot.py
+
+Запуск:
+    python bench.py userconfig [--users N] [--ops N] [--impl current|legacy|both]
+    python bench.py photos wall.json [--policy max --policy target:1280 ...] [--concurrency N]
+    python bench.py load [--users N] [--duration S] [--post-rate R] [--vk-latency MS] [--tg-error-rate P] ...
+    python bench.py webhook [--url URL --secret S] [--updates N] [--concurrency N]
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import re
+import resource
+import sqlite3
+import tempfile
+import time
+
+import Bot
+
+
+def measure(name: str, ops: int, func) -> float:
+    """Выполняет func(i) ops раз и печатает количество операций в секунду"""
+    started = time.perf_counter()
+    for i in range(ops):
+        func(i)
+    elapsed = time.perf_counter() - started
+    rate = ops / elapsed if elapsed else float('inf')
+    print(f"{name:<24} {rate:>12,.0f} ops/s")
+    return rate
+
+
+class LegacyUserConfig:
+    """UserConfig до постоянного соединения: новое подключение на каждый вызов и JSON
+    со всеми настройками пользователя в users.data. Нужен только для сравнения в бенчмарке.
+    """
+    def __init__(self, db_file: str):
+        self.db_file = db_file
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS users (user_id INTEGER PRIMARY KEY, data TEXT)')
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.db_file)
+
+    def _save(self, user_id: int, user_data: dict):
+        conn = self._connect()
+        conn.execute('INSERT OR REPLACE INTO users (user_id, data) VALUES (?, ?)', (user_id, json.dumps(user_data)))
+        conn.commit()
+        conn.close()
+
+    def get_user_data(self, user_id: int) -> dict:
+        conn = self._connect()
+        result = conn.execute('SELECT data FROM users WHERE user_id = ?', (user_id,)).fetchone()
+        conn.close()
+        return json.loads(result[0]) if result else {}
+
+    def get_bots(self, user_id: int) -> list:
+        return self.get_user_data(user_id).get('bots', [])
+
+    def update_bot(self, user_id: int, bot_index: int, bot_data: dict):
+        user_data = self.get_user_data(user_id)
+        bots = user_data.setdefault('bots', [{}, {}, {}])
+        while len(bots) <= bot_index:
+            bots.append({})
+        bots[bot_index] = bot_data
+        self._save(user_id, user_data)
+
+    def get_last_post_id(self, user_id: int, bot_index: int = 0) -> int:
+        bots = self.get_bots(user_id)
+        if 0 <= bot_index < len(bots) and bots[bot_index]:
+            return bots[bot_index].get('last_post_id', 0)
+        return 0
+
+    def set_last_post_id(self, user_id: int, bot_index: int, post_id: int):
+        bots = self.get_bots(user_id)
+        while len(bots) <= bot_index:
+            bots.append({})
+        bots[bot_index]['last_post_id'] = post_id
+        self.update_bot(user_id, bot_index, bots[bot_index])
+
+
+def bench_userconfig_impl(config, users: int, ops: int) -> dict:
+    """Замер операций одной реализации UserConfig, возвращает {операция: ops/s}"""
+    bot_data = {
+        'vk_token': 'vk1.a.' + 'x' * 80,
+        'vk_group_id': '-123456',
+        'tg_bot_token': '123456789:' + 'A' * 35,
+        'tg_channel': '@channel',
+        'last_post_id': 1,
+    }
+    for user_id in range(users):
+        for bot_index in range(3):
+            config.update_bot(user_id, bot_index, dict(bot_data))
+
+    return {
+        'get_user_data': measure('get_user_data', ops, lambda i: config.get_user_data(i % users)),
+        'get_bots': measure('get_bots', ops, lambda i: config.get_bots(i % users)),
+        'get_last_post_id': measure('get_last_post_id', ops, lambda i: config.get_last_post_id(i % users, i % 3)),
+        'update_bot': measure('update_bot', ops, lambda i: config.update_bot(i % users, i % 3, dict(bot_data))),
+        'set_last_post_id': measure('set_last_post_id', ops, lambda i: config.set_last_post_id(i % users, i % 3, i + 2)),
+    }
+
+
+def bench_userconfig(args):
+    """Скорость основных операций UserConfig на временной базе.
+    
+    --impl legacy замеряет прежний путь с подключением на каждый вызов, both - оба и сравнение.
+    """
+    workdir = tempfile.mkdtemp(prefix='bench_userconfig_')
+    os.chdir(workdir)
+    print(f"База: {workdir}, пользователей: {args.users}, операций: {args.ops}")
+    
+    results = {}
+    if args.impl in ('legacy', 'both'):
+        print("\n[legacy] подключение на каждый вызов")
+        results['legacy'] = bench_userconfig_impl(LegacyUserConfig('legacy.db'), args.users, args.ops)
+    if args.impl in ('current', 'both'):
+        print("\n[current] постоянное соединение")
+        config = Bot.UserConfig()
+        results['current'] = bench_userconfig_impl(config, args.users, args.ops)
+        config.close()
+    
+    if len(results) == 2:
+        print(f"\n{'операция':<24} {'legacy':>12} {'current':>12} {'ускорение':>10}")
+        for name, before in results['legacy'].items():
+            after = results['current'][name]
+            print(f"{name:<24} {before:>12,.0f} {after:>12,.0f} {after / before:>9.1f}x")
+
+
+def load_wall_items(path: str) -> list:
+    """Посты из сохранённого ответа wall.get: {"response": {"items": [...]}}, {"items": [...]} или список"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('response', data)
+        data = data.get('items', []) if isinstance(data, dict) else data
+    return data
+
+
+def iter_photo_sizes(item: dict):
+    """Списки размеров всех фото поста, включая цепочку репостов"""
+    for attach in item.get('attachments', []):
+        if attach.get('type') == 'photo' and attach['photo'].get('sizes'):
+            yield attach['photo']['sizes']
+    for repost in item.get('copy_history', []):
+        yield from iter_photo_sizes(repost)
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def download_photos(urls: list, concurrency: int) -> tuple[int, list]:
+    """Скачивает фото и возвращает (байт всего, задержки по каждому фото в секундах)"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def fetch(session, url):
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.get(url) as response:
+                body = await response.read()
+            latencies.append(time.perf_counter() - started)
+            return len(body)
+
+    async with Bot.aiohttp.ClientSession() as session:
+        sizes = await asyncio.gather(*(fetch(session, url) for url in urls), return_exceptions=True)
+    failed = sum(isinstance(size, BaseException) for size in sizes)
+    if failed:
+        print(f"  не удалось скачать {failed} из {len(urls)} фото")
+    return sum(size for size in sizes if isinstance(size, int)), latencies
+
+
+def bench_photos(args):
+    """Объём и время скачивания фото из записанных постов VK для каждой политики выбора размера"""
+    items = load_wall_items(args.payload)
+    policies = args.policy or [name for name in Bot.PhotoSizePolicy.POLICIES]
+    print(f"Постов: {len(items)}")
+    for spec in policies:
+        name, _, side = spec.partition(':')
+        policy = Bot.PhotoSizePolicy(name, int(side) if side else Bot.PHOTO_TARGET_SIDE)
+        selected = [policy.select(sizes) for item in items for sizes in iter_photo_sizes(item)]
+        urls = [size['url'] for size in selected]
+        pixels = sum(size['width'] * size['height'] for size in selected)
+        started = time.perf_counter()
+        total, latencies = asyncio.run(download_photos(urls, args.concurrency)) if urls else (0, [])
+        elapsed = time.perf_counter() - started
+        print(
+            f"{spec:<16} фото {len(urls):>5}  {pixels / 1e6:>9.1f} Мпикс  {total / 1024 / 1024:>9.1f} МБ  "
+            f"p50 {percentile(latencies, 0.5) * 1000:>7.0f} мс  p95 {percentile(latencies, 0.95) * 1000:>7.0f} мс  "
+            f"всего {elapsed:>6.2f} с"
+        )
+
+
+class LoadStub:
+    """Заглушки VK API и Telegram Bot API для нагрузочного теста.
+    
+    Посты в группах появляются с частотой post_rate в минуту (со случайным сдвигом по
+    группам) и вычисляются по времени, поэтому стены не хранятся в памяти. Заглушка
+    Telegram находит в тексте сообщения группу и номер поста и считает задержку от
+    появления поста в VK до его публикации.
+    """
+    POST_MARKER = re.compile(r'load (-?\d+) (\d+)')
+    EXECUTE_CALL = re.compile(r'API\.wall\.get\((\{.*?\})\)')
+
+    def __init__(self, args, started: float):
+        self.args = args
+        self.started = started
+        self.rate = args.post_rate / 60
+        self.phases = {}
+        self.lags = []
+        self.sent = 0
+        self.tg_errors = 0
+        self.vk_requests = 0
+
+    def _phase(self, group_id: int) -> float:
+        if group_id not in self.phases:
+            self.phases[group_id] = random.random()
+        return self.phases[group_id]
+
+    def created_at(self, group_id: int, post_id: int) -> float:
+        # Пост 1 существует до начала теста, дальше посты идут с частотой rate
+        return self.started + (post_id - 1 - self._phase(group_id)) / self.rate
+
+    def wall(self, group_id: int, offset: int, count: int) -> dict:
+        elapsed = time.time() - self.started
+        last_id = 1 + int(elapsed * self.rate + self._phase(group_id))
+        ids = range(last_id - offset, max(0, last_id - offset - count), -1)
+        items = [
+            {
+                'id': post_id,
+                'owner_id': group_id,
+                'date': int(self.created_at(group_id, post_id)),
+                'text': f"load {group_id} {post_id}"
+            }
+            for post_id in ids
+        ]
+        return {'count': last_id, 'items': items}
+
+    async def vk(self, request: Bot.web.Request) -> Bot.web.Response:
+        self.vk_requests += 1
+        await asyncio.sleep(self.args.vk_latency / 1000)
+        if random.random() < self.args.vk_error_rate:
+            return Bot.web.json_response({'error': {'error_code': 10, 'error_msg': 'Internal server error'}})
+        data = await request.post()
+        method = request.match_info['method']
+        if method == 'wall.get':
+            wall = self.wall(int(data['owner_id']), int(data.get('offset', 0)), int(data.get('count', 20)))
+            return Bot.web.json_response({'response': wall})
+        if method == 'execute':
+            calls = [json.loads(call) for call in self.EXECUTE_CALL.findall(data['code'])]
+            return Bot.web.json_response({
+                'response': [self.wall(call['owner_id'], call.get('offset', 0), call['count']) for call in calls]
+            })
+        return Bot.web.json_response({'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}})
+
+    async def telegram(self, request: Bot.web.Request) -> Bot.web.Response:
+        await asyncio.sleep(self.args.tg_latency / 1000)
+        if random.random() < self.args.tg_error_rate:
+            self.tg_errors += 1
+            return Bot.web.json_response({'ok': False, 'error_code': 500, 'description': 'Internal Server Error'})
+        body = await request.json()
+        match = self.POST_MARKER.search(body.get('text') or body.get('caption') or '')
+        if match:
+            self.lags.append(time.time() - self.created_at(int(match.group(1)), int(match.group(2))))
+        self.sent += 1
+        return Bot.web.json_response({'ok': True, 'result': {'message_id': self.sent, 'date': int(time.time())}})
+
+    async def stats(self, request: Bot.web.Request) -> Bot.web.Response:
+        return Bot.web.json_response({
+            'lags': self.lags,
+            'sent': self.sent,
+            'tg_errors': self.tg_errors,
+            'vk_requests': self.vk_requests
+        })
+
+    @classmethod
+    def serve(cls, args, started: float, ready):
+        """Запуск заглушек в отдельном процессе, чтобы они не влияли на замеры бота"""
+        stub = cls(args, started)
+
+        async def run():
+            app = Bot.web.Application()
+            app.router.add_post('/vk/{method}', stub.vk)
+            app.router.add_post('/tg/bot{token}/{method}', stub.telegram)
+            app.router.add_get('/stats', stub.stats)
+            runner = Bot.web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await Bot.web.TCPSite(runner, '127.0.0.1', args.port).start()
+            ready.set()
+            await asyncio.Event().wait()
+
+        asyncio.run(run())
+
+
+def seed_load_users(config, users: int, groups: int):
+    """Заполнение базы: users пользователей по BOT_SLOTS ботов, группы VK распределены по кругу"""
+    bots = []
+    cursors = []
+    for user_id in range(users):
+        for slot in range(Bot.BOT_SLOTS):
+            group_id = -(1 + (user_id * Bot.BOT_SLOTS + slot) % groups)
+            bots.append((user_id, slot, f'vk-token-{user_id}', str(group_id), f'{user_id}:LOAD', f'@load_{user_id}_{slot}'))
+            cursors.append((user_id, slot, 1))
+    with config.conn:
+        config.conn.executemany(
+            'INSERT OR REPLACE INTO bots (user_id, slot, vk_token, vk_group_id, tg_bot_token, tg_channel) VALUES (?, ?, ?, ?, ?, ?)',
+            bots
+        )
+        config.conn.executemany('INSERT OR REPLACE INTO cursors (user_id, slot, last_post_id) VALUES (?, ?, ?)', cursors)
+
+
+async def run_load(args) -> dict:
+    """Работа бота против заглушек в течение args.duration секунд; возвращает длительности проходов"""
+    bot = Bot.TelegramBot('load')
+    bot.vk_client.api_url = f'http://127.0.0.1:{args.port}/vk'
+    bot.tg_client.api_url = f'http://127.0.0.1:{args.port}/tg'
+    bot.metrics_server.port = 0
+    seed_load_users(bot.user_config, args.users, args.groups)
+
+    passes = []
+
+    async def timed_pass(context):
+        count = sum(state['count'] for state in Bot.PASS_SECONDS.values.values())
+        started = time.perf_counter()
+        await bot._auto_check_posts(context)
+        if sum(state['count'] for state in Bot.PASS_SECONDS.values.values()) > count:
+            passes.append(time.perf_counter() - started)
+
+    await bot.start_services()
+    tasks = [asyncio.create_task(bot._run_periodic(timed_pass, Bot.SCHEDULER_TICK))]
+    await asyncio.sleep(args.duration)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await bot.stop_services()
+
+    async with Bot.aiohttp.ClientSession() as session:
+        async with session.get(f'http://127.0.0.1:{args.port}/stats') as response:
+            stats = await response.json()
+    stats['passes'] = passes
+    return stats
+
+
+def bench_load(args):
+    """Нагрузочный тест: N пользователей по 3 бота против локальных заглушек VK и Telegram"""
+    args.groups = args.groups or args.users * Bot.BOT_SLOTS
+    os.chdir(tempfile.mkdtemp(prefix='bench_load_'))
+    Bot.logger.setLevel('WARNING')
+    Bot.POLL_MIN_INTERVAL = args.min_interval
+
+    started = time.time()
+    ready = multiprocessing.Event()
+    stub = multiprocessing.Process(target=LoadStub.serve, args=(args, started, ready), daemon=True)
+    stub.start()
+    ready.wait(10)
+    try:
+        stats = asyncio.run(run_load(args))
+    finally:
+        stub.terminate()
+
+    passes = stats['passes']
+    lags = stats['lags']
+    generated = args.groups * args.post_rate / 60 * args.duration
+    print(f"Пользователей {args.users}, ботов {args.users * Bot.BOT_SLOTS}, групп VK {args.groups}, {args.duration:.0f} с")
+    print(f"Заглушки: VK {args.vk_latency:.0f} мс, ошибок {args.vk_error_rate:.0%}; "
+          f"Telegram {args.tg_latency:.0f} мс, ошибок {args.tg_error_rate:.0%}; постов {args.post_rate:g}/мин на группу")
+    print(f"Проходов {len(passes)}: p50 {percentile(passes, 0.5):.2f} с, максимум {max(passes, default=0):.2f} с")
+    print(f"Запросов к VK {stats['vk_requests']}, ошибок Telegram {stats['tg_errors']}")
+    print(f"Опубликовано {stats['sent']} (новых постов в группах ~{generated:.0f}), {stats['sent'] / args.duration:.1f} постов/с")
+    print(f"Задержка публикации: p50 {percentile(lags, 0.5):.1f} с, p99 {percentile(lags, 0.99):.1f} с")
+    print(f"Пиковый RSS бота: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} МБ")
+
+
+def fake_update(update_id: int, user_id: int, text: str) -> dict:
+    """Обновление Telegram с текстовым сообщением пользователя"""
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'Load {user_id}'}
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private', 'first_name': user['first_name']},
+            'from': user,
+            'text': text,
+            **({'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]} if text.startswith('/') else {})
+        }
+    }
+
+
+async def post_updates(args) -> tuple[list, int, dict]:
+    """Отправка фейковых обновлений на webhook.
+    
+    Возвращает задержки ответов webhook, число отказов и моменты отправки принятых обновлений по чатам.
+    """
+    semaphore = asyncio.Semaphore(args.concurrency)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': args.secret} if args.secret else {}
+    latencies = []
+    rejected = 0
+    posted = {}
+
+    async def post(session, update_id):
+        nonlocal rejected
+        user_id = 1000 + update_id % args.users
+        update = fake_update(update_id, user_id, args.text)
+        async with semaphore:
+            started = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as response:
+                await response.read()
+                if response.status != 200:
+                    rejected += 1
+                else:
+                    posted.setdefault(user_id, []).append(started)
+            latencies.append(time.perf_counter() - started)
+
+    async with Bot.aiohttp.ClientSession() as session:
+        await asyncio.gather(*(post(session, update_id) for update_id in range(1, args.updates + 1)))
+    return latencies, rejected, posted
+
+
+class ReplyStub:
+    """Заглушка Bot API для бенчмарка webhook: запоминает, когда бот ответил в каждый чат"""
+    def __init__(self):
+        self.replies = {}  # chat_id -> [моменты ответов]
+        self.count = 0
+        self.registered = asyncio.Event()
+        self.replied = asyncio.Event()
+        self.expected = None
+
+    async def handle(self, request: Bot.web.Request) -> Bot.web.Response:
+        method = request.match_info['method']
+        if method == 'getMe':
+            return Bot.web.json_response({'ok': True, 'result': {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}})
+        if method == 'setWebhook':
+            self.registered.set()
+            return Bot.web.json_response({'ok': True, 'result': True})
+        
+        payload = await request.json() if request.content_type == 'application/json' else await request.post()
+        chat_id = int(payload['chat_id'])
+        self.replies.setdefault(chat_id, []).append(time.perf_counter())
+        self.count += 1
+        if self.expected is not None and self.count >= self.expected:
+            self.replied.set()
+        return Bot.web.json_response({
+            'ok': True,
+            'result': {'message_id': self.count, 'date': int(time.time()), 'chat': {'id': chat_id, 'type': 'private'}}
+        })
+
+
+async def run_local_webhook(args) -> tuple[list, int, list]:
+    """Интерфейс бота в этом же процессе с webhook против заглушки Bot API.
+    
+    Кроме ответа webhook (обновление только ставится в очередь), меряется полное время
+    обработки: от отправки обновления до ответа бота пользователю в заглушке.
+    """
+    stub = ReplyStub()
+    app = Bot.web.Application()
+    app.router.add_post('/bot{token}/{method}', stub.handle)
+    runner = Bot.web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = Bot.web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+
+    bot = Bot.TelegramBot('1:BENCH')
+    bot.tg_client.api_url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+    bot.metrics_server.port = 0
+    application = bot.build_application('ui', webhook=True)
+    stop = asyncio.Event()
+    server = asyncio.create_task(bot._run_webhook(application, args.url, args.port, args.secret, stop))
+    try:
+        await asyncio.wait_for(stub.registered.wait(), 10)
+        latencies, rejected, posted = await post_updates(args)
+        stub.expected = args.updates - rejected
+        if stub.count < stub.expected:
+            await asyncio.wait_for(stub.replied.wait(), 120)
+    finally:
+        stop.set()
+        await server
+        await runner.cleanup()
+
+    handled = [
+        replied - started
+        for chat_id, starts in posted.items()
+        for started, replied in zip(starts, stub.replies.get(chat_id, []))
+    ]
+    return latencies, rejected, handled
+
+
+def bench_webhook(args):
+    """Нагрузка на webhook интерфейса бота фейковыми обновлениями.
+    
+    С --url обновления уходят уже запущенному боту (python Bot.py --webhook-url ...), и меряется
+    только ответ webhook. Без --url бот запускается здесь же против заглушки Bot API.
+    """
+    local = args.url is None
+    if local:
+        os.chdir(tempfile.mkdtemp(prefix='bench_webhook_'))
+        Bot.logger.setLevel('WARNING')
+        Bot.logging.getLogger('httpx').setLevel('WARNING')
+        args.secret = args.secret or 'bench'
+        args.url = f'http://127.0.0.1:{args.port}{Bot.WEBHOOK_PATH}'
+    
+    started = time.perf_counter()
+    if local:
+        latencies, rejected, handled = asyncio.run(run_local_webhook(args))
+    else:
+        latencies, rejected, _ = asyncio.run(post_updates(args))
+        handled = []
+    elapsed = time.perf_counter() - started
+    print(f"Обновлений {args.updates} на {args.url}, отклонено {rejected}, {args.updates / elapsed:,.0f} обновлений/с")
+    print(f"Ответ webhook (постановка в очередь): p50 {percentile(latencies, 0.5) * 1000:.1f} мс, "
+          f"p99 {percentile(latencies, 0.99) * 1000:.1f} мс")
+    if local:
+        print(f"Обработка до ответа пользователю: {len(handled)} обновлений, p50 {percentile(handled, 0.5) * 1000:.1f} мс, "
+              f"p99 {percentile(handled, 0.99) * 1000:.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    userconfig = subparsers.add_parser('userconfig', help='операции UserConfig (ops/sec)')
+    userconfig.add_argument('--users', type=int, default=100)
+    userconfig.add_argument('--ops', type=int, default=2000)
+    userconfig.add_argument('--impl', choices=('current', 'legacy', 'both'), default='both',
+                            help='какую реализацию замерять: текущую, прежнюю (подключение на вызов) или обе')
+    userconfig.set_defaults(func=bench_userconfig)
+
+    photos = subparsers.add_parser('photos', help='политики выбора размера фото на записанных ответах wall.get')
+    photos.add_argument('payload', help='JSON-файл с ответом wall.get')
+    photos.add_argument('--policy', action='append', help='имя политики, для target можно указать сторону: target:2560')
+    photos.add_argument('--concurrency', type=int, default=Bot.MEDIA_FETCH_CONCURRENCY)
+    photos.set_defaults(func=bench_photos)
+
+    load = subparsers.add_parser('load', help='нагрузочный тест с заглушками VK и Telegram')
+    load.add_argument('--users', type=int, default=100)
+    load.add_argument('--groups', type=int, help='групп VK (по умолчанию у каждого бота своя)')
+    load.add_argument('--duration', type=float, default=60.0, help='секунд')
+    load.add_argument('--post-rate', type=float, default=2.0, help='постов в минуту в каждой группе')
+    load.add_argument('--min-interval', type=float, default=5.0, help='POLL_MIN_INTERVAL на время теста, секунд')
+    load.add_argument('--vk-latency', type=float, default=50.0, help='мс')
+    load.add_argument('--tg-latency', type=float, default=50.0, help='мс')
+    load.add_argument('--vk-error-rate', type=float, default=0.0, help='доля ответов VK с ошибкой')
+    load.add_argument('--tg-error-rate', type=float, default=0.0, help='доля ответов Telegram с ошибкой')
+    load.add_argument('--port', type=int, default=8790, help='порт заглушек')
+    load.set_defaults(func=bench_load)
+
+    webhook = subparsers.add_parser('webhook', help='фейковые обновления на webhook интерфейса бота')
+    webhook.add_argument('--url', help='webhook уже запущенного бота; без него бот запускается здесь против заглушки Bot API')
+    webhook.add_argument('--secret', default=Bot.WEBHOOK_SECRET)
+    webhook.add_argument('--port', type=int, default=Bot.WEBHOOK_PORT, help='порт webhook, если бот запускается здесь')
+    webhook.add_argument('--updates', type=int, default=1000)
+    webhook.add_argument('--users', type=int, default=100, help='сколько разных пользователей отправляют обновления')
+    webhook.add_argument('--concurrency', type=int, default=20)
+    webhook.add_argument('--text', default='/start')
+    webhook.set_defaults(func=bench_webhook)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
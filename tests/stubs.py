@@ -0,0 +1,163 @@
+"""Локальные заглушки VK API и Telegram Bot API для тестов"""
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+
+from aiohttp import web
+
+
+@asynccontextmanager
+async def serve(app: web.Application):
+    """Запуск приложения aiohttp на свободном порту, возвращает базовый адрес"""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+def make_post(group_id: str, post_id: int, **fields) -> dict:
+    post = {'id': post_id, 'owner_id': int(group_id), 'from_id': int(group_id), 'date': int(time.time()), 'text': f"post {post_id}"}
+    post.update(fields)
+    return post
+
+
+class VKStub:
+    """Стена групп в памяти: wall.get, execute с вложенными wall.get, Bots Long Poll и ошибки по токенам.
+    
+    walls - {group_id: [посты от старых к новым]}, errors - {токен: код ошибки VK},
+    broken - токены, на запросы с которыми отвечает не VK, а сломанный прокси (HTTP 502),
+    group_tokens - токены сообществ, которым доступен long poll (остальным - ошибка 27).
+    Посты для long poll отправляются через push(); запрос без событий висит long_poll_wait секунд.
+    delay - сколько секунд VK отвечает на каждый вызов метода (медленный API).
+    """
+    def __init__(self, walls: dict = None, errors: dict = None, broken: set = (), group_tokens: set = (),
+                 long_poll_wait: float = 0.5, delay: float = 0):
+        self.walls = walls or {}
+        self.delay = delay
+        self.errors = errors or {}
+        self.broken = set(broken)
+        self.group_tokens = set(group_tokens)
+        self.long_poll_wait = long_poll_wait
+        self.events = asyncio.Queue()
+        self.long_poll_requests = 0
+        self.calls = []  # (метод, параметры)
+        self.app = web.Application()
+        self.app.router.add_get('/long_poll', self.handle_long_poll)
+        self.app.router.add_post('/{method}', self.handle)
+
+    def push(self, post: dict):
+        """Новый пост на стене и событие wall_post_new о нём"""
+        self.walls.setdefault(str(post['owner_id']), []).append(post)
+        self.events.put_nowait(post)
+
+    def methods(self) -> list:
+        return [method for method, _ in self.calls]
+
+    async def handle_long_poll(self, request: web.Request) -> web.Response:
+        self.long_poll_requests += 1
+        ts = int(request.query['ts'])
+        try:
+            post = await asyncio.wait_for(self.events.get(), min(float(request.query['wait']), self.long_poll_wait))
+        except asyncio.TimeoutError:
+            return web.json_response({'ts': str(ts), 'updates': []})
+        return web.json_response({
+            'ts': str(ts + 1),
+            'updates': [{'type': 'wall_post_new', 'object': post, 'group_id': abs(post['owner_id'])}]
+        })
+
+    def wall_get(self, params: dict) -> dict:
+        wall = list(reversed(self.walls.get(str(params['owner_id']), [])))
+        if params.get('filter') == 'owner':
+            # Как в VK: только опубликованные записи самого владельца стены
+            wall = [post for post in wall if post.get('from_id') == int(params['owner_id']) and post.get('post_type', 'post') == 'post']
+        offset = int(params.get('offset', 0))
+        count = int(params.get('count', 20))
+        return {'count': len(wall), 'items': wall[offset:offset + count]}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = dict(await request.post())
+        self.calls.append((method, params))
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        
+        if params.get('access_token') in self.broken:
+            return web.Response(status=502, text='<html>Bad Gateway</html>')
+        code = self.errors.get(params.get('access_token'))
+        if code is not None:
+            return web.json_response({'error': {'error_code': code, 'error_msg': f"error {code}"}})
+        if method == 'wall.get':
+            return web.json_response({'response': self.wall_get(params)})
+        if method == 'groups.getLongPollServer':
+            if params['access_token'] not in self.group_tokens:
+                return web.json_response({'error': {'error_code': 27, 'error_msg': 'Group authorization failed'}})
+            server = str(request.url.with_path('/long_poll').with_query(None))
+            return web.json_response({'response': {'key': 'key', 'server': server, 'ts': '1'}})
+        if method == 'execute':
+            calls = params['code'][len('return ['):-len('];')].split('), ')
+            response = []
+            for call in calls:
+                call_params = json.loads(call[len('API.wall.get('):].rstrip(')'))
+                if str(call_params['owner_id']) in self.walls:
+                    response.append(self.wall_get(call_params))
+                else:
+                    response.append(False)
+            return web.json_response({'response': response})
+        return web.json_response({'error': {'error_code': 3, 'error_msg': 'Unknown method passed'}})
+
+
+class TelegramStub:
+    """Bot API в памяти: отвечает успехом на send*, getMe, getChat и setWebhook.
+    
+    failures - {метод: [ответы с ошибкой]}: очередной вызов метода получает первый из них,
+    delays - {метод: секунд}: ответ задерживается (запрос уже принят).
+    """
+    def __init__(self, failures: dict = None, delays: dict = None):
+        self.failures = failures or {}
+        self.delays = delays or {}
+        self.calls = []  # (метод, payload)
+        self.message_id = 0
+        self.app = web.Application()
+        self.app.router.add_post('/bot{token}/{method}', self.handle)
+
+    def message(self, **fields) -> dict:
+        self.message_id += 1
+        return dict(fields, message_id=self.message_id)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            payload = await request.json()
+        else:
+            payload = {key: value for key, value in (await request.post()).items() if isinstance(value, str)}
+        self.calls.append((method, payload))
+        if method in self.delays:
+            await asyncio.sleep(self.delays[method])
+        
+        if self.failures.get(method):
+            return web.json_response(self.failures[method].pop(0))
+        if method == 'sendMediaGroup':
+            media = payload['media'] if isinstance(payload['media'], list) else json.loads(payload['media'])
+            result = [self.message(photo=[{'file_id': f"file{self.message_id + 1}"}]) for _ in media]
+        elif method == 'sendPhoto':
+            result = self.message(photo=[{'file_id': f"file{self.message_id + 1}"}])
+        elif method == 'sendDocument':
+            result = self.message(document={'file_id': f"file{self.message_id + 1}"})
+        elif method.startswith('send'):
+            result = self.message()
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Stub', 'username': 'stub_bot'}
+        elif method == 'setWebhook':
+            result = True
+        else:
+            result = {'id': 1}
+        return web.json_response({'ok': True, 'result': result})
+
+    def methods(self) -> list:
+        return [method for method, _ in self.calls]
@@ -0,0 +1,168 @@
+import asyncio
+
+import Bot
+from stubs import TelegramStub, serve
+
+SERVER_ERROR = {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}
+
+
+def photo(photo_id: int) -> dict:
+    url = f"https://vk.example/photo{photo_id}.jpg"
+    return {'type': 'photo', 'photo': {'id': photo_id, 'owner_id': -1, 'sizes': [{'type': 'x', 'width': 1280, 'height': 960, 'url': url}]}}
+
+
+def three_part_post() -> dict:
+    """Альбом с подписью, продолжение текста отдельным сообщением и опрос"""
+    return {
+        'id': 42,
+        'owner_id': -1,
+        'date': 0,
+        'text': ' '.join(['слово'] * 400),
+        'attachments': [
+            photo(1),
+            photo(2),
+            {'type': 'poll', 'poll': {'question': 'Да?', 'answers': [{'text': 'да'}, {'text': 'нет'}]}}
+        ]
+    }
+
+
+async def forward(stub: TelegramStub, attempts: int) -> list:
+    """Пересылает пост attempts раз, возвращает ошибки попыток"""
+    errors = []
+    async with serve(stub.app) as url:
+        bot = Bot.TelegramBot('x')
+        bot.tg_client.api_url = url
+        await bot.tg_client.start()
+        try:
+            for _ in range(attempts):
+                try:
+                    await bot._forward_post(three_part_post(), '1:x', '@channel')
+                    errors.append(None)
+                except Bot.TelegramApiError as e:
+                    errors.append(e.error_code)
+        finally:
+            await bot.tg_client.close()
+            await bot.media_fetcher.close()
+        return errors, bot
+
+
+def test_retry_resumes_after_failed_second_part():
+    stub = TelegramStub(failures={'sendMessage': [SERVER_ERROR]})
+    errors, bot = asyncio.run(forward(stub, attempts=3))
+    
+    assert errors == [502, None, None]
+    # Альбом ушёл один раз; повтор начался с текста, третья попытка ничего не отправила
+    assert stub.methods() == ['sendMediaGroup', 'sendMessage', 'sendMessage', 'sendPoll']
+    assert bot.ledger.is_delivered('@channel', -1, 42)
+    assert bot.ledger.progress('@channel', -1, 42)['parts_sent'] == 0
+    # В журнал попадает message_id первого сообщения альбома
+    message_id = bot.user_config.conn.execute('SELECT message_id FROM delivered WHERE post_id = 42').fetchone()[0]
+    assert message_id == 1
+
+
+def test_failed_first_part_sends_everything_on_retry():
+    stub = TelegramStub(failures={'sendMediaGroup': [SERVER_ERROR]})
+    errors, bot = asyncio.run(forward(stub, attempts=2))
+    
+    assert errors == [502, None]
+    assert stub.methods() == ['sendMediaGroup', 'sendMediaGroup', 'sendMessage', 'sendPoll']
+    assert stub.calls[1][1]['media'][0]['caption']
+
+
+async def forward_interrupted(stub: TelegramStub, post: dict) -> Bot.TelegramBot:
+    """Первая попытка обрывается, пока Telegram обрабатывает запрос (как при падении процесса), вторая доходит до конца"""
+    async with serve(stub.app) as url:
+        bot = Bot.TelegramBot('x')
+        bot.tg_client.api_url = url
+        await bot.tg_client.start()
+        try:
+            task = asyncio.create_task(bot._forward_post(post, '1:x', '@channel'))
+            while not any(method in stub.delays for method in stub.methods()):
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            stub.delays.clear()
+            await bot._forward_post(post, '1:x', '@channel')
+        finally:
+            await bot.tg_client.close()
+        return bot
+
+
+def test_part_with_unknown_outcome_is_not_sent_twice():
+    stub = TelegramStub(delays={'sendPoll': 0.5})
+    bot = asyncio.run(forward_interrupted(stub, three_part_post()))
+    
+    assert stub.methods() == ['sendMediaGroup', 'sendMessage', 'sendPoll']
+    assert bot.ledger.is_delivered('@channel', -1, 42)
+
+
+def test_single_message_post_is_not_sent_twice():
+    stub = TelegramStub(delays={'sendMessage': 0.5})
+    bot = asyncio.run(forward_interrupted(stub, {'id': 7, 'owner_id': -1, 'text': 'короткий пост'}))
+    
+    assert stub.methods() == ['sendMessage']
+    assert bot.ledger.is_delivered('@channel', -1, 7)
+
+
+def test_part_with_unknown_outcome_can_be_resent(monkeypatch):
+    monkeypatch.setattr(Bot, 'OUTBOX_RESEND_UNCERTAIN', True)
+    stub = TelegramStub(delays={'sendMessage': 0.5})
+    bot = asyncio.run(forward_interrupted(stub, three_part_post()))
+    
+    assert stub.methods() == ['sendMediaGroup', 'sendMessage', 'sendMessage', 'sendPoll']
+    assert bot.ledger.is_delivered('@channel', -1, 42)
+
+
+def test_unreachable_telegram_clears_sending_mark():
+    async def run():
+        bot = Bot.TelegramBot('x')
+        bot.tg_client.api_url = 'http://127.0.0.1:9'
+        await bot.tg_client.start()
+        try:
+            await bot._forward_post({'id': 7, 'owner_id': -1, 'text': 'пост'}, '1:x', '@channel')
+        except Bot.aiohttp.ClientConnectorError:
+            pass
+        await bot.tg_client.close()
+        return bot.ledger.progress('@channel', -1, 7)
+    
+    assert asyncio.run(run())['sending'] is None
+
+
+
+async def forward_cancelled_while_waiting(stub: TelegramStub, post: dict, blocked: float = 0) -> Bot.TelegramBot:
+    """Первая попытка отменяется, пока часть ждёт лимита отправки (как при остановке воркера), вторая доходит до конца"""
+    async with serve(stub.app) as url:
+        bot = Bot.TelegramBot('x')
+        bot.tg_client.api_url = url
+        await bot.tg_client.start()
+        try:
+            if blocked:
+                bot.tg_client.rate_limiter.penalize('1:x', '@channel', blocked)
+            task = asyncio.create_task(bot._forward_post(post, '1:x', '@channel'))
+            await asyncio.sleep(0.3)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            bot.tg_client.rate_limiter = Bot.TelegramRateLimiter()
+            await bot._forward_post(post, '1:x', '@channel')
+        finally:
+            await bot.tg_client.close()
+        return bot
+
+
+def test_cancel_while_waiting_for_rate_limit_does_not_lose_post():
+    stub = TelegramStub()
+    bot = asyncio.run(forward_cancelled_while_waiting(stub, {'id': 7, 'owner_id': -1, 'text': 'пост'}, blocked=30))
+
+    # Запрос так и не ушёл в Telegram, поэтому повтор отправляет пост
+    assert stub.methods() == ['sendMessage']
+    assert bot.ledger.is_delivered('@channel', -1, 7)
+
+
+def test_cancel_during_429_backoff_does_not_lose_post():
+    too_many = {'ok': False, 'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': 30}}
+    stub = TelegramStub(failures={'sendMessage': [too_many]})
+    bot = asyncio.run(forward_cancelled_while_waiting(stub, {'id': 7, 'owner_id': -1, 'text': 'пост'}))
+
+    # Ответ 429 ничего не опубликовал, повтор отправляет пост заново
+    assert stub.methods() == ['sendMessage', 'sendMessage']
+    assert bot.ledger.is_delivered('@channel', -1, 7)
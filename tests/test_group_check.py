@@ -0,0 +1,121 @@
+import asyncio
+
+import Bot
+from stubs import VKStub, make_post, serve
+
+SETTINGS = {'vk_group_id': '-1', 'tg_bot_token': '1:x'}
+
+
+def add_source(bot: Bot.TelegramBot, user_id: int, token: str, last_post_id: int = 5) -> tuple:
+    settings = dict(SETTINGS, vk_token=token, tg_channel=f'@channel{user_id}', last_post_id=last_post_id)
+    bot.user_config.update_bot(user_id, 0, settings)
+    return (user_id, 0, bot.user_config.get_bot(user_id, 0))
+
+
+async def check_group(stub: VKStub, tokens: list) -> Bot.TelegramBot:
+    async with serve(stub.app) as url:
+        bot = Bot.TelegramBot('x')
+        bot.vk_client.api_url = url
+        sources = [add_source(bot, user_id, token) for user_id, token in enumerate(tokens, 1)]
+        try:
+            await bot._check_group('-1', sources, None)
+        finally:
+            await bot.vk_client.close()
+            await bot.validator.close()
+        return bot
+
+
+def queued(bot: Bot.TelegramBot, user_id: int) -> int:
+    return bot.outbox.pending_count(user_id, 0)
+
+
+def test_posts_only_reach_sources_whose_token_reads_the_group():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 9)]}, errors={'revoked': 15})
+    bot = asyncio.run(check_group(stub, ['revoked', 'good', 'other']))
+    
+    assert queued(bot, 1) == 0
+    assert queued(bot, 2) == 3
+    assert queued(bot, 3) == 3
+    assert set(bot.failed_sources) == {(1, 0)}
+    assert bot.user_config.get_last_post_id(1, 0) == 5
+    # Стена читается один раз, доступ третьего токена подтверждается отдельной проверкой
+    tokens = [(method, params['access_token'], params.get('count')) for method, params in stub.calls]
+    assert tokens == [('wall.get', 'revoked', '10'), ('wall.get', 'good', '10'), ('wall.get', 'other', '1')]
+
+
+def test_network_error_skips_source_without_marking_it_failed():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 9)]}, broken={'flaky'})
+    bot = asyncio.run(check_group(stub, ['good', 'flaky']))
+    
+    assert queued(bot, 1) == 3
+    assert queued(bot, 2) == 0
+    assert bot.failed_sources == {}
+
+
+def test_transient_vk_error_does_not_mark_source_failed():
+    # Первый токен упирается в лимит запросов, стену читает второй
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 9)]}, errors={'limited': 6})
+    bot = asyncio.run(check_group(stub, ['limited', 'good']))
+
+    assert queued(bot, 1) == 0
+    assert queued(bot, 2) == 3
+    assert bot.failed_sources == {}
+
+
+def test_recovered_token_clears_failure():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 9)]})
+    
+    async def run():
+        async with serve(stub.app) as url:
+            bot = Bot.TelegramBot('x')
+            bot.vk_client.api_url = url
+            source = add_source(bot, 1, 'token')
+            stub.errors['token'] = 5
+            await bot._check_group('-1', [source], None)
+            failed = dict(bot.failed_sources)
+            del stub.errors['token']
+            await bot._check_group('-1', [source], None)
+            await bot.vk_client.close()
+            return failed, bot
+    
+    failed, bot = asyncio.run(run())
+    assert (1, 0) in failed
+    assert bot.failed_sources == {}
+    assert queued(bot, 1) == 3
+
+
+def test_new_subscriber_does_not_shrink_backlog_of_others():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 61)]})
+    
+    async def run():
+        async with serve(stub.app) as url:
+            bot = Bot.TelegramBot('x')
+            bot.vk_client.api_url = url
+            sources = [add_source(bot, 1, 'token', last_post_id=5), add_source(bot, 2, 'token', last_post_id=0)]
+            posts = await bot._check_group('-1', sources, None)
+            await bot.vk_client.close()
+            return bot, posts
+    
+    bot, posts = asyncio.run(run())
+    assert len(posts) == 55
+    assert queued(bot, 1) == 55
+    assert bot.user_config.get_last_post_id(1, 0) == 60
+    # Новый подписчик получает только последнюю страницу
+    assert queued(bot, 2) == Bot.VK_POLL_COUNT
+    assert bot.outbox.claim(2, 0)['post_id'] == 60 - Bot.VK_POLL_COUNT + 1
+
+
+def test_only_new_subscribers_fetch_a_single_page():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 61)]})
+    
+    async def run():
+        async with serve(stub.app) as url:
+            bot = Bot.TelegramBot('x')
+            bot.vk_client.api_url = url
+            await bot._check_group('-1', [add_source(bot, 1, 'token', last_post_id=0)], None)
+            await bot.vk_client.close()
+            return bot
+    
+    bot = asyncio.run(run())
+    assert len(stub.calls) == 1
+    assert queued(bot, 1) == Bot.VK_POLL_COUNT
@@ -0,0 +1,16 @@
+import Bot
+
+
+def test_ledger_sees_posts_recorded_by_another_process():
+    ui, worker = Bot.UserConfig(), Bot.UserConfig()
+    ledger, other = Bot.DeliveryLedger(ui), Bot.DeliveryLedger(worker)
+    assert not ledger.is_delivered('@channel', -1, 7)
+    
+    other.record('@channel', -1, 7, 100)
+    # Кэш пользователей замечает чужую запись первым (как при _load_user), журнал всё равно её видит
+    assert ui.sync()
+    assert ledger.is_delivered('@channel', -1, 7)
+    assert not ledger.is_delivered('@channel', -1, 8)
+    
+    ui.close()
+    worker.close()
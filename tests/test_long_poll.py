@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import Bot
+from stubs import VKStub, make_post, serve
+
+
+async def until(predicate, timeout: float = 3.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(0.02)
+    return True
+
+
+def make_stub(**options) -> VKStub:
+    return VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 6)]}, group_tokens={'group'}, **options)
+
+
+def make_bot(url: str) -> Bot.TelegramBot:
+    bot = Bot.TelegramBot('x')
+    bot.vk_client.api_url = url
+    settings = {'vk_token': 'group', 'vk_group_id': '-1', 'tg_bot_token': '1:x', 'tg_channel': '@channel', 'last_post_id': 5}
+    bot.user_config.update_bot(1, 0, settings)
+    return bot
+
+
+async def start_long_poll(bot: Bot.TelegramBot):
+    await bot._auto_check_posts(None)
+    assert await until(lambda: '-1' in bot.scheduler.pushed)
+
+
+def queued(bot: Bot.TelegramBot) -> int:
+    return bot.outbox.pending_count(1, 0)
+
+
+def test_pushed_post_is_queued_without_wall_get():
+    stub = make_stub()
+
+    async def run():
+        async with serve(stub.app) as url:
+            bot = make_bot(url)
+            try:
+                await start_long_poll(bot)
+                reads = len(stub.calls)
+                stub.push(make_post('-1', 6))
+                assert await until(lambda: queued(bot) == 1)
+                assert stub.methods()[reads:] == []
+                assert bot.user_config.get_last_post_id(1, 0) == 6
+            finally:
+                await bot.stop_services()
+
+    asyncio.run(run())
+
+
+def test_only_community_posts_are_pushed():
+    stub = make_stub()
+
+    async def run():
+        async with serve(stub.app) as url:
+            bot = make_bot(url)
+            try:
+                await start_long_poll(bot)
+                # Пост пользователя на открытой стене и предложенная запись в канал не попадают
+                stub.push(make_post('-1', 6, from_id=123))
+                stub.push(make_post('-1', 7, post_type='suggest', from_id=123))
+                stub.push(make_post('-1', 8))
+                assert await until(lambda: queued(bot) == 1)
+                await asyncio.sleep(0.2)
+                assert queued(bot) == 1
+                assert bot.user_config.get_last_post_id(1, 0) == 8
+            finally:
+                await bot.stop_services()
+
+    asyncio.run(run())
+
+
+def test_pushed_post_waits_for_busy_bot():
+    stub = make_stub()
+
+    async def run():
+        async with serve(stub.app) as url:
+            bot = make_bot(url)
+            try:
+                await start_long_poll(bot)
+                lock = bot.scheduler.get_lock(1, 0)
+                async with lock:
+                    # Бот проверяется вручную: пост не теряется, а ждёт окончания проверки
+                    stub.push(make_post('-1', 6))
+                    await asyncio.sleep(0.3)
+                    assert queued(bot) == 0
+                assert await until(lambda: queued(bot) == 1)
+                assert bot.scheduler.next_due['-1'] - time.monotonic() > Bot.VK_LONG_POLL_RECONCILE - 5
+            finally:
+                await bot.stop_services()
+
+    asyncio.run(run())
+
+
+def test_long_poll_does_not_hold_api_connections():
+    stub = make_stub(long_poll_wait=5.0)
+
+    async def run():
+        async with serve(stub.app) as url:
+            bot = make_bot(url)
+            bot.vk_client.pool_size = 1
+            try:
+                await start_long_poll(bot)
+                assert await until(lambda: stub.long_poll_requests > 0)
+                # Единственное соединение пула свободно, пока запрос long poll висит
+                await asyncio.wait_for(bot.vk_client.method('wall.get', 'group', owner_id=-1, count=1), 1.0)
+            finally:
+                await bot.stop_services()
+
+    asyncio.run(run())
+
+
+def test_stale_lease_stops_long_polls():
+    stub = make_stub()
+
+    async def run():
+        async with serve(stub.app) as url:
+            bot = make_bot(url)
+            bot.leases = Bot.ShardLeases(bot.user_config, 'worker')
+            try:
+                await bot._renew_leases()
+                await start_long_poll(bot)
+                task = bot.long_polls['-1']
+
+                bot.lease_renewed_at = time.monotonic() - Bot.LEASE_TTL - 1
+                await bot._auto_check_posts(None)
+                await asyncio.wait([task], timeout=1.0)
+                assert task.cancelled()
+                assert bot.long_polls == {}
+                assert bot.scheduler.pushed == set()
+
+                # Посты, пришедшие после потери аренды, остаются воркеру, который забрал шард
+                await bot._ingest_pushed_posts('-1', [make_post('-1', 6)])
+                assert queued(bot) == 0
+            finally:
+                await bot.stop_services()
+
+    asyncio.run(run())
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from aiohttp import web
+
+import Bot
+from stubs import serve
+
+FILE_SIZE = 300 * 1024
+
+
+def file_server() -> web.Application:
+    async def handle(request: web.Request) -> web.Response:
+        name = request.match_info['name']
+        if name == 'missing':
+            raise web.HTTPNotFound()
+        await asyncio.sleep(0.01)
+        return web.Response(body=name.encode() * (FILE_SIZE // len(name)))
+    
+    app = web.Application()
+    app.router.add_get('/{name}', handle)
+    return app
+
+
+def test_albums_share_file_and_memory_limits():
+    fetcher = Bot.MediaFetcher(spool_size=512 * 1024, memory_budget=1024 * 1024, max_files=10)
+    peaks = {'files': 0, 'memory': 0}
+    
+    async def album(url: str, index: int):
+        urls = [f"{url}/a{index}f{i}" for i in range(10)]
+        async with fetcher.fetched(urls) as files:
+            peaks['files'] = max(peaks['files'], fetcher.files_held)
+            peaks['memory'] = max(peaks['memory'], fetcher.memory_used)
+            contents = [file.read(6) for file in files]
+            await asyncio.sleep(0.05)
+        return contents
+    
+    async def run():
+        async with serve(file_server()) as url:
+            try:
+                return await asyncio.wait_for(asyncio.gather(*(album(url, i) for i in range(3))), 10)
+            finally:
+                await fetcher.close()
+    
+    results = asyncio.run(run())
+    assert results[1][2] == b'a1f2a1'
+    assert peaks['files'] == 10
+    assert peaks['memory'] <= 1024 * 1024
+    assert fetcher.files_held == 0
+    assert fetcher.memory_used == 0
+
+
+def test_failed_download_releases_everything():
+    fetcher = Bot.MediaFetcher(max_files=10)
+    
+    async def run():
+        async with serve(file_server()) as url:
+            try:
+                with pytest.raises(Bot.MediaFetchError) as error:
+                    async with fetcher.fetched([f"{url}/ok", f"{url}/missing"]):
+                        pass
+                return error.value
+            finally:
+                await fetcher.close()
+    
+    error = asyncio.run(run())
+    assert error.url.endswith('/missing')
+    assert fetcher.files_held == 0
+    assert fetcher.memory_used == 0
+
+
+def test_files_beyond_memory_budget_are_on_disk():
+    # Бюджета хватает на один файл в памяти, остальные должны сразу лечь на диск
+    fetcher = Bot.MediaFetcher(spool_size=FILE_SIZE * 2, memory_budget=FILE_SIZE * 2, max_files=10)
+    
+    async def run():
+        async with serve(file_server()) as url:
+            try:
+                async with fetcher.fetched([f"{url}/f{i}" for i in range(3)]) as files:
+                    return sorted(file._rolled for file in files), [file.read(2) for file in files]
+            finally:
+                await fetcher.close()
+    
+    rolled, heads = asyncio.run(run())
+    assert rolled == [False, True, True]
+    assert heads == [b'f0', b'f1', b'f2']
@@ -0,0 +1,62 @@
+import time
+
+import Bot
+from stubs import make_post
+
+SETTINGS = {'vk_group_id': '-1', 'tg_bot_token': '1:x', 'vk_token': 'good'}
+
+
+def add_bot(bot: Bot.TelegramBot, user_id: int):
+    bot.user_config.update_bot(user_id, 0, dict(SETTINGS, tg_channel=f'@channel{user_id}', last_post_id=0))
+
+
+def lag(user_id: int) -> float:
+    return Bot.SOURCE_LAG_SECONDS.values.get((str(user_id), '0'))
+
+
+def test_lag_is_age_of_oldest_undelivered_post_at_scrape_time():
+    bot = Bot.TelegramBot('x')
+    add_bot(bot, 1)
+    add_bot(bot, 2)
+    now = time.time()
+    posts = [make_post('-1', 1, date=int(now) - 600), make_post('-1', 2, date=int(now) - 60)]
+    bot.outbox.enqueue(1, 0, '@channel1', posts, 2)
+
+    bot._collect_metrics()
+
+    # Очередь не двигается, а метрика растёт без успешных отправок
+    assert 600 <= lag(1) < 610
+    assert lag(2) == 0
+
+    row = bot.outbox.claim()
+    bot.outbox.mark_delivered(row['id'])
+    bot._collect_metrics()
+    assert 60 <= lag(1) < 70
+
+
+def test_deleted_bot_disappears_from_metrics():
+    bot = Bot.TelegramBot('x')
+    add_bot(bot, 1)
+    add_bot(bot, 2)
+    bot.failed_sources[(2, 0)] = 'Access denied'
+    bot._collect_metrics()
+    assert lag(2) == 0
+    assert Bot.SOURCE_VK_FAILED.values == {('2', '0'): 1}
+
+    bot.user_config.delete_bot(2, 0)
+    bot._collect_metrics()
+
+    assert lag(2) is None
+    assert Bot.SOURCE_VK_FAILED.values == {}
+
+
+def test_large_values_keep_full_precision():
+    counter = Bot.Counter('test_posts_total', "Тест")
+    counter.inc(1234567)
+    histogram = Bot.Histogram('test_seconds', "Тест", buckets=(1.0,))
+    histogram.observe(1234567.125)
+    
+    lines = (counter.render() + '\n' + histogram.render()).splitlines()
+    assert 'test_posts_total 1234567' in lines
+    assert 'test_seconds_sum 1234567.125' in lines
+    assert 'test_seconds_count 1' in lines
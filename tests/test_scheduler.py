@@ -0,0 +1,45 @@
+import time
+
+import Bot
+
+
+def source(user_id: int, group_id: str) -> tuple:
+    return (user_id, 0, {'vk_group_id': group_id})
+
+
+def test_tick_only_pops_due_groups(monkeypatch):
+    scheduler = Bot.CheckScheduler()
+    sources = [source(1, '-1'), source(2, '-2'), source(3, '-3')]
+    grouped = []
+    group_sources = Bot.CheckScheduler.group_sources
+    monkeypatch.setattr(Bot.CheckScheduler, 'group_sources', staticmethod(
+        lambda sources: grouped.append(sources) or group_sources(sources)
+    ))
+
+    scheduler.update_sources(sources)
+    now = time.monotonic()
+    assert sorted(scheduler.pop_due(now)) == ['-1', '-2', '-3']
+    scheduler.schedule('-1', now + 10)
+    scheduler.schedule('-2', now + 100)
+    scheduler.schedule('-3', now + 100)
+
+    # Тот же список источников не разбирается заново, а срок наступил только у одной группы
+    assert scheduler.update_sources(sources) is scheduler.groups
+    assert scheduler.pop_due(now + 5) == []
+    assert scheduler.pop_due(now + 20) == ['-1']
+    assert len(grouped) == 1
+    assert [group_id for _, group_id in scheduler.due_queue] == ['-2', '-3']
+
+
+def test_removed_group_is_forgotten_when_due():
+    scheduler = Bot.CheckScheduler()
+    scheduler.update_sources([source(1, '-1'), source(2, '-2')])
+    now = time.monotonic()
+    scheduler.pop_due(now)
+    scheduler.schedule('-1', now + 10)
+    scheduler.schedule('-2', now + 10)
+
+    scheduler.update_sources([source(1, '-1')])
+    assert scheduler.pop_due(now + 20) == ['-1']
+    assert '-2' not in scheduler.next_due
+    assert '-2' not in scheduler.poll_states
@@ -0,0 +1,40 @@
+import asyncio
+
+import Bot
+
+
+def test_services_run_in_a_new_event_loop():
+    # Как в main(): бот создаётся до цикла событий, в котором потом работают сервисы.
+    # Первый цикл привязывает примитивы к себе (в Python 3.9 это делает уже конструктор)
+    bot = Bot.TelegramBot('x')
+    bot.metrics_server.port = 0
+    
+    async def bind():
+        for lock in (bot.scheduler.pass_lock, bot.scheduler.semaphore):
+            async with lock:
+                waiter = asyncio.create_task(lock.acquire())
+                await asyncio.sleep(0)
+            await waiter
+            lock.release()
+        bot.delivery_event.clear()
+        waiter = asyncio.create_task(bot.delivery_event.wait())
+        await asyncio.sleep(0)
+        bot.delivery_event.set()
+        await waiter
+    
+    async def serve():
+        await bot.start_services()
+        try:
+            bot.delivery_event.set()
+            await asyncio.sleep(0.1)
+            async with bot.scheduler.pass_lock:
+                waiter = asyncio.create_task(bot.scheduler.pass_lock.acquire())
+                await asyncio.sleep(0)
+            await waiter
+            bot.scheduler.pass_lock.release()
+            return [task.done() for task in bot.delivery_tasks]
+        finally:
+            await bot.stop_services()
+    
+    asyncio.run(bind())
+    assert not any(asyncio.run(serve()))
@@ -0,0 +1,78 @@
+import multiprocessing
+import os
+import signal
+
+import pytest
+
+import Bot
+
+
+def commit_cursors_forever(workdir: str, acks):
+    """Дочерний процесс: двигает курсор и сообщает о каждом подтверждённом коммите"""
+    os.chdir(workdir)
+    config = Bot.UserConfig()
+    config.update_bot(1, 0, {'vk_token': 't', 'vk_group_id': '-1', 'tg_bot_token': '1:x', 'tg_channel': '@c'})
+    post_id = 0
+    while True:
+        post_id += 1
+        config.commit_cursor(1, 0, post_id)
+        acks.send(post_id)
+
+
+def test_committed_cursor_survives_crash(workdir):
+    context = multiprocessing.get_context('fork')
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(target=commit_cursors_forever, args=(str(workdir), sender))
+    process.start()
+    acked = 0
+    while acked < 200:
+        acked = receiver.recv()
+    # Процесс убивается посреди следующих коммитов, без close()
+    os.kill(process.pid, signal.SIGKILL)
+    process.join()
+    while receiver.poll():
+        acked = receiver.recv()
+    
+    config = Bot.UserConfig()
+    assert config.get_last_post_id(1, 0) >= acked
+    assert config.get_active_bots()[0][2]['last_post_id'] >= acked
+
+
+def test_failed_transaction_keeps_cursor():
+    config = Bot.UserConfig()
+    config.update_bot(1, 0, {'vk_token': 't', 'vk_group_id': '-1', 'tg_bot_token': '1:x', 'tg_channel': '@c'})
+    config.commit_cursor(1, 0, 10)
+    
+    def fail(conn):
+        conn.execute("INSERT OR REPLACE INTO users (user_id, data) VALUES (1, '{\"partial\": true}')")
+        raise RuntimeError("отправка в очередь не удалась")
+    
+    with pytest.raises(RuntimeError):
+        config.commit_cursor(1, 0, 20, in_transaction=fail)
+    assert config.get_last_post_id(1, 0) == 10
+    assert config.get_bot(1, 0)['last_post_id'] == 10
+    other = Bot.UserConfig()
+    assert other.get_last_post_id(1, 0) == 10
+    assert 'partial' not in other.get_user_data(1)
+
+
+def test_set_last_post_id_is_written_through():
+    config = Bot.UserConfig()
+    config.update_bot(1, 0, {'vk_token': 't', 'vk_group_id': '-1', 'tg_bot_token': '1:x', 'tg_channel': '@c'})
+    config.set_last_post_id(1, 0, 30)
+    other = Bot.UserConfig()
+    assert other.get_last_post_id(1, 0) == 30
+    # В отличие от commit_cursor курсор можно вернуть назад
+    config.set_last_post_id(1, 0, 5)
+    assert other.get_last_post_id(1, 0) == 5
+
+
+def test_stale_commit_does_not_move_cached_cursor_back():
+    config = Bot.UserConfig()
+    config.update_bot(1, 0, {'vk_token': 't', 'vk_group_id': '-1', 'tg_bot_token': '1:x', 'tg_channel': '@c'})
+    config.commit_cursor(1, 0, 20)
+    assert config.get_bot(1, 0)['last_post_id'] == 20
+    # Запоздавший коммит другой задачи не откатывает курсор ни в базе, ни в кэше
+    config.commit_cursor(1, 0, 10)
+    assert config.get_last_post_id(1, 0) == 20
+    assert config.get_bot(1, 0)['last_post_id'] == 20
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+import Bot
+from stubs import TelegramStub, VKStub, make_post, serve
+
+
+def run_checks(app, make_validator, check, times: int = 2) -> list:
+    """check(validator) times раз подряд; результат или исключение каждого вызова"""
+    async def run():
+        async with serve(app) as url:
+            validator = make_validator(url)
+            results = []
+            try:
+                for _ in range(times):
+                    try:
+                        results.append(await check(validator))
+                    except Exception as e:
+                        results.append(e)
+            finally:
+                await validator.close()
+                await validator.vk_client.close()
+            return results
+
+    return asyncio.run(run())
+
+
+def vk_validator(url: str) -> Bot.CredentialValidator:
+    return Bot.CredentialValidator(Bot.VKApiClient(api_url=url))
+
+
+def tg_validator(url: str) -> Bot.CredentialValidator:
+    return Bot.CredentialValidator(Bot.VKApiClient(), api_url=url)
+
+
+@pytest.mark.parametrize('code', [5, 15, 27, 100, 113])
+def test_vk_rejection_is_cached(code):
+    stub = VKStub(walls={'-1': [make_post('-1', 1)]}, errors={'token': code})
+    results = run_checks(stub.app, vk_validator, lambda validator: validator.check_vk_group('token', '-1'))
+
+    assert results == [f"[{code}] error {code}"] * 2
+    assert len(stub.calls) == 1
+
+
+@pytest.mark.parametrize('code', [6, 9, 10])
+def test_vk_transient_error_is_not_cached(code):
+    stub = VKStub(walls={'-1': [make_post('-1', 1)]}, errors={'token': code})
+    results = run_checks(stub.app, vk_validator, lambda validator: validator.check_vk_group('token', '-1'))
+
+    assert all(isinstance(result, Bot.VKMethodError) and result.code == code for result in results)
+    assert len(stub.calls) == 2
+
+
+@pytest.mark.parametrize('error_code, description', [
+    (401, 'Unauthorized'),
+    (403, 'Forbidden: bot is not a member of the channel chat'),
+    (400, 'Bad Request: chat not found'),
+])
+def test_telegram_rejection_is_cached(error_code, description):
+    stub = TelegramStub(failures={'getChat': [{'ok': False, 'error_code': error_code, 'description': description}]})
+    results = run_checks(stub.app, tg_validator, lambda validator: validator.check_tg_channel('1:x', '@channel'))
+
+    assert results == [description] * 2
+    assert stub.methods() == ['getChat']
+
+
+@pytest.mark.parametrize('failure', [
+    {'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 5', 'parameters': {'retry_after': 5}},
+    {'ok': False, 'error_code': 502, 'description': 'Bad Gateway'},
+])
+def test_telegram_transient_error_is_retried(failure):
+    stub = TelegramStub(failures={'getChat': [failure]})
+    results = run_checks(stub.app, tg_validator, lambda validator: validator.check_tg_channel('1:x', '@channel'))
+
+    assert isinstance(results[0], Bot.TelegramApiError)
+    assert results[1] is None
+    assert stub.methods() == ['getChat', 'getChat']
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import Bot
+from stubs import VKStub, make_post, serve
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def with_client(stub: VKStub, job):
+    async with serve(stub.app) as url:
+        client = Bot.VKApiClient(api_url=url)
+        try:
+            return await job(client)
+        finally:
+            await client.close()
+
+
+def test_method_error_raises_vk_method_error():
+    stub = VKStub(walls={'-1': []}, errors={'bad': 5})
+    
+    async def job(client):
+        with pytest.raises(Bot.VKMethodError) as error:
+            await client.method('wall.get', 'bad', owner_id=-1)
+        return error.value
+    
+    error = run(with_client(stub, job))
+    assert error.code == 5
+    assert isinstance(error, Bot.VkApiError)
+
+
+def test_fetch_new_posts_pages_back_to_cursor():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 251)]})
+    
+    async def job(client):
+        return await Bot.VKParser('token', '-1', client).fetch_new_posts(20)
+    
+    posts, last_id = run(with_client(stub, job))
+    assert [post['id'] for post in posts] == list(range(21, 251))
+    assert last_id == 250
+    offsets = [int(params['offset']) for method, params in stub.calls]
+    assert offsets == [0, Bot.VK_POLL_COUNT, Bot.VK_POLL_COUNT + Bot.VK_PAGE_SIZE, Bot.VK_POLL_COUNT + 2 * Bot.VK_PAGE_SIZE]
+
+
+def test_fetch_new_posts_skips_pinned_and_ads():
+    wall = [make_post('-1', i) for i in range(1, 6)]
+    wall[1]['marked_as_ads'] = 1
+    wall.append(make_post('-1', 1, is_pinned=1))
+    stub = VKStub(walls={'-1': wall})
+    
+    async def job(client):
+        return await Bot.VKParser('token', '-1', client).fetch_new_posts(2)
+    
+    posts, last_id = run(with_client(stub, job))
+    assert [post['id'] for post in posts] == [3, 4, 5]
+    assert last_id == 5
+
+
+def test_get_new_posts_keeps_cursor_on_error():
+    stub = VKStub(walls={'-1': [make_post('-1', 1)]}, errors={'bad': 15})
+    
+    async def job(client):
+        return await Bot.VKParser('bad', '-1', client).get_new_posts(7)
+    
+    assert run(with_client(stub, job)) == ([], 7)
+
+
+def test_fetch_walls_batches_groups_through_execute():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 4)], '-2': [make_post('-2', 9)]})
+    
+    async def job(client):
+        return await Bot.VKParser.fetch_walls(client, 'token', ['-1', '-2', '-3'])
+    
+    walls = run(with_client(stub, job))
+    assert [post['id'] for post in walls['-1']] == [3, 2, 1]
+    assert [post['id'] for post in walls['-2']] == [9]
+    assert '-3' not in walls
+    assert [method for method, params in stub.calls] == ['execute']
+
+
+def test_fetch_pages_streams_only_publishable_posts():
+    stub = VKStub(walls={'-1': [make_post('-1', i) for i in range(1, 251)]})
+    
+    async def job(client):
+        return await Bot.VKParser('token', '-1', client).fetch_pages(200)
+    
+    items = run(with_client(stub, job))
+    # Первая страница целиком, дальше только посты новее курсора
+    assert sorted(post['id'] for post in items) == list(range(201, 251))
+
+
+def test_filter_new_posts_caps_first_check():
+    items = [make_post('-1', i) for i in range(1, 31)]
+    posts, last_id = Bot.VKParser.filter_new_posts(items, 0)
+    assert [post['id'] for post in posts] == list(range(31 - Bot.VK_POLL_COUNT, 31))
+    assert last_id == 30
+
+
+def test_ui_latency_stays_flat_while_polling(monkeypatch):
+    monkeypatch.setattr(Bot, 'VK_BATCH_POLLING', False)
+    groups = [str(-i) for i in range(1, 21)]
+    stub = VKStub(walls={group: [make_post(group, i) for i in range(1, 6)] for group in groups}, delay=0.3)
+    
+    def start_update(latencies: list):
+        started = [0.0]
+        
+        async def reply_text(text, **kwargs):
+            latencies.append(time.perf_counter() - started[0])
+        
+        update = SimpleNamespace(
+            effective_user=SimpleNamespace(id=1000, first_name='User'),
+            callback_query=None,
+            message=SimpleNamespace(reply_text=reply_text)
+        )
+        return update, started
+    
+    async def job():
+        async with serve(stub.app) as url:
+            bot = Bot.TelegramBot('x')
+            bot.vk_client.api_url = url
+            for user_id, group in enumerate(groups, 1):
+                bot.user_config.update_bot(user_id, 0, {
+                    'vk_token': 'token', 'vk_group_id': group, 'tg_bot_token': '1:x',
+                    'tg_channel': f'@channel{user_id}', 'last_post_id': 5
+                })
+            latencies = []
+            try:
+                polling = asyncio.create_task(bot._auto_check_posts(None))
+                await asyncio.sleep(0.05)
+                # Пока проход ждёт медленный VK, меню отвечает другим пользователям сразу
+                for _ in range(10):
+                    update, started = start_update(latencies)
+                    started[0] = time.perf_counter()
+                    await bot.start(update, None)
+                    await asyncio.sleep(0.02)
+                still_polling = not polling.done()
+                await polling
+            finally:
+                await bot.vk_client.close()
+                await bot.validator.close()
+            return latencies, still_polling, len(stub.calls)
+    
+    latencies, still_polling, vk_calls = run(job())
+    assert still_polling
+    assert vk_calls >= len(groups)
+    assert len(latencies) == 10
+    assert max(latencies) < 0.1
@@ -0,0 +1,86 @@
+import asyncio
+import socket
+
+import aiohttp
+import pytest
+
+import Bot
+from stubs import TelegramStub, serve
+
+SECRET = 'secret'
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_update(update_id: int, user_id: int) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': 0,
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'User'},
+            'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]
+        }
+    }
+
+
+def test_webhook_against_local_bot_api():
+    stub = TelegramStub()
+    port = free_port()
+    url = f'http://127.0.0.1:{port}{Bot.WEBHOOK_PATH}'
+
+    async def post(session, body, secret: str = SECRET) -> int:
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        async with session.post(url, data=body, headers=headers) as response:
+            return response.status
+
+    async def run():
+        async with serve(stub.app) as api_url:
+            bot = Bot.TelegramBot('1:x')
+            bot.tg_client.api_url = api_url
+            bot.metrics_server.port = 0
+            application = bot.build_application('ui', webhook=True)
+            stop = asyncio.Event()
+            task = asyncio.create_task(bot._run_webhook(application, 'https://bot.example.com/telegram', port, SECRET, stop))
+            try:
+                async with aiohttp.ClientSession() as session:
+                    for _ in range(50):
+                        if 'setWebhook' in stub.methods():
+                            break
+                        await asyncio.sleep(0.05)
+
+                    update = Bot.json.dumps(start_update(1, 42))
+                    assert await post(session, update, secret=None) == 403
+                    assert await post(session, update, secret='wrong') == 403
+                    assert await post(session, '{not json') == 400
+                    assert await post(session, '[1, 2]') == 400
+                    assert await post(session, '{"message": {}}') == 400
+                    assert await post(session, update) == 200
+
+                    for _ in range(50):
+                        if 'sendMessage' in stub.methods():
+                            break
+                        await asyncio.sleep(0.05)
+            finally:
+                stop.set()
+                await task
+
+    asyncio.run(run())
+
+    # getMe и setWebhook ушли в локальную заглушку, а не в api.telegram.org
+    assert stub.methods()[:2] == ['getMe', 'setWebhook']
+    assert stub.calls[1][1]['secret_token'] == SECRET
+    replies = [payload for method, payload in stub.calls if method == 'sendMessage']
+    assert [str(reply['chat_id']) for reply in replies] == ['42']
+
+
+def test_webhook_requires_secret():
+    application = Bot.TelegramBot('1:x').build_application('ui', webhook=True)
+    with pytest.raises(ValueError):
+        Bot.WebhookServer(application, secret='')